@@ -22,6 +22,7 @@ from collections import defaultdict
 #--- 3rd party modules ---
 from bacpypes.app import BIPSimpleApplication, BIPForeignApplication
 from bacpypes.pdu import Address
+from bacpypes.apdu import SimpleAckPDU
 
 #--- this application's modules ---
 from ..utils.notes import note_and_log
@@ -29,8 +30,29 @@ from ..utils.notes import note_and_log
 #------------------------------------------------------------------------------
 
 
+class COVNotifications():
+    """
+    Reception of COV notifications. Notifications are passed to cov_handler
+    (set by BAC0.core.io.COV.SubscribeCOV when subscribing).
+    """
+    cov_handler = None
+
+    def do_ConfirmedCOVNotificationRequest(self, apdu):
+        """Acknowledge and pass on a confirmed COV notification."""
+        self.log(("do_ConfirmedCOVNotificationRequest {!r}".format(apdu)))
+        self.response(SimpleAckPDU(context=apdu))
+        if self.cov_handler is not None:
+            self.cov_handler(apdu)
+
+    def do_UnconfirmedCOVNotificationRequest(self, apdu):
+        """Pass on an unconfirmed COV notification."""
+        self.log(("do_UnconfirmedCOVNotificationRequest {!r}".format(apdu)))
+        if self.cov_handler is not None:
+            self.cov_handler(apdu)
+
+
 @note_and_log
-class SimpleApplication(BIPSimpleApplication):
+class SimpleApplication(COVNotifications, BIPSimpleApplication):
     """
     Defines a basic BACnet/IP application to process BACnet requests.
 
@@ -84,7 +106,7 @@ class SimpleApplication(BIPSimpleApplication):
 
 
 @note_and_log
-class ForeignDeviceApplication(BIPForeignApplication):
+class ForeignDeviceApplication(COVNotifications, BIPForeignApplication):
     """
     Defines a basic BACnet/IP application to process BACnet requests.
 
@@ -12,6 +12,7 @@ Device.py - describe a BACnet Device
 from collections import namedtuple
 from datetime import datetime
 import weakref
+from threading import Lock, local
 
 import os.path
 
@@ -40,6 +41,10 @@ from ..io.IOExceptions import NoResponseFromController, SegmentationNotSupported
 from ...sql.sql import SQLMixin
 from ...tasks.DoOnce import DoOnce
 from .mixins.read_mixin import ReadPropertyMultiple, ReadProperty
+from .mixins.cov_mixin import SubscribeCOV
+from .mixins.trendlog_mixin import TrendLogs
+from .mixins.write_mixin import WritePropertyMultiple
+from .mixins.simulate_mixin import SimulateMultiple
 
 from ..utils.notes import note_and_log
 
@@ -64,6 +69,20 @@ class DeviceProperties(object):
         self.multistates = None
         self.db_name = None
         self.segmentation_supported = True
+        self.max_in_flight = 2
+        self.max_apdu_length = 480
+        self.rpm_budget = None
+        self.history_size = None
+        self.compress_history = False
+        self.deadband = None
+        self.heartbeat = None
+        self.storage = 'wide'
+        self.background_save = False
+        self.flush_interval = 5
+        self.flush_size = 500
+        self.verify_writes = 'immediate'
+        self.write_delay = 0.5
+        self.max_age = None
 
     def __repr__(self):
         return '%s' % self.asdict
@@ -104,6 +123,43 @@ class Device(SQLMixin):
                 before auto_save is called. Will write the histories to
                 SQLite db locally.
     :clear_history_on_save: (boolean) Will clear device history
+    :max_in_flight: (int) Number of ReadPropertyMultiple requests sent to the
+                    device before waiting for the first answer when polling.
+                    Use 1 to send requests one at a time.
+    :history_size: (int) Number of samples kept in memory for each point.
+                   When reached, oldest samples are overwritten. None (default)
+                   keeps everything.
+    :compress_history: (boolean) Keep histories in memory in compressed
+                       blocks (see BAC0.core.devices.History.CompressedHistory)
+    :deadband: (float or str) Default deadband of the points. A reading is
+               added to the history only if it differs from the last one kept
+               by more than deadband (or a percentage of the last value, ex.
+               '2%'). Binary and multistate points keep every change of state.
+               None (default) keeps every reading.
+    :heartbeat: (float) With a deadband, seconds after which a reading is kept
+                even if the value didn't change
+    :storage: (str) Layout of the histories saved to SQLite. 'wide' (default)
+              is one table with a column per point, resampled to 1 second.
+              'long' keeps every raw reading in a (point_id, ts, value) table
+              so one point can be read without loading the others.
+              'compressed' keeps raw readings of each point in compressed
+              blocks.
+    :background_save: (boolean) Write every reading to the database from a
+                      background thread instead of saving in the polling task.
+                      Implies storage='long'.
+    :flush_interval: (float) With background_save, maximum delay in seconds
+                     before a reading is written (default 5)
+    :flush_size: (int) With background_save, readings are written as soon as
+                 that many are waiting (default 500)
+    :verify_writes: (str) 'immediate' (default) reads a point right after
+                    writing to it. 'deferred' keeps the point until it is
+                    read by the next poll or by confirm_writes().
+    :write_delay: (float) Seconds the writes queued with queue_write wait
+                  before being sent (default 0.5). A newer value for the same
+                  property replaces the one waiting.
+    :max_age: (float) Seconds the value of a point (point.value and the
+              operators like point > 20) is used without being read again.
+              None (default) uses Point.default_max_age (0 = always read).
 
     :type address: (str)
     :type device_id: int
@@ -113,7 +169,11 @@ class Device(SQLMixin):
     def __init__(self, address, device_id, network, *, poll=10,
                  from_backup=None, segmentation_supported=True,
                  object_list=None, auto_save=False,
-                 clear_history_on_save=False):
+                 clear_history_on_save=False, max_in_flight=2,
+                 history_size=None, compress_history=False, deadband=None,
+                 heartbeat=None, storage='wide', background_save=False,
+                 flush_interval=5, flush_size=500, verify_writes='immediate',
+                 write_delay=0.5, max_age=None):
 
         self.properties = DeviceProperties()
 
@@ -127,6 +187,40 @@ class Device(SQLMixin):
         self.properties.multistates = {}
         self.properties.auto_save = auto_save
         self.properties.clear_history_on_save = clear_history_on_save
+        self.properties.max_in_flight = max_in_flight
+        self.properties.history_size = history_size
+        self.properties.compress_history = compress_history
+        if not (deadband is None or isinstance(deadband, (int, float)) and deadband >= 0
+                or isinstance(deadband, str) and deadband.endswith('%')):
+            raise WrongParameter("deadband must be a positive number or a percentage like '2%'")
+        self.properties.deadband = deadband
+        self.properties.heartbeat = heartbeat
+        if storage not in ('wide', 'long', 'compressed'):
+            raise WrongParameter("storage must be 'wide', 'long' or 'compressed'")
+        self.properties.storage = 'long' if background_save else storage
+        self.properties.background_save = background_save
+        self.properties.flush_interval = flush_interval
+        self.properties.flush_size = flush_size
+        if verify_writes not in ('immediate', 'deferred'):
+            raise WrongParameter("verify_writes must be 'immediate' or 'deferred'")
+        self.properties.verify_writes = verify_writes
+        self.properties.write_delay = write_delay
+        self.properties.max_age = max_age
+        self._history_writer = None
+        # {point name: process identifier} of COV subscriptions
+        self._cov_subscriptions = {}
+        self._cov_task = None
+        # {point name: trendLog instance}, found on first use
+        self._trend_logs = None
+        # {point name: point} written but not read since
+        self._pending_writes = {}
+        # Depth of the batch_writes() blocks, per thread
+        self._write_batches = local()
+        # {(type, instance, property, priority): (point, value)} waiting to be sent
+        self._write_queue = {}
+        self._write_queue_lock = Lock()
+        self._write_drain = None
+        self._write_drain_scheduled = False
 
         self.segmentation_supported = segmentation_supported
         self.custom_object_list = object_list
@@ -155,6 +249,54 @@ class Device(SQLMixin):
         else:
             self.new_state(DeviceDisconnected)
 
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        """
+        Points are kept in a tuple : changing them in place (ex. append) would
+        leave the indexes stale. Assign a new list or use add_point.
+        """
+        self._points = tuple(points)
+        self._reindex()
+
+    def add_point(self, point):
+        """
+        Add a point to the device (indexes and poll plan are updated)
+
+        :param point: (BAC0.core.devices.Points.Point)
+        """
+        self.points = self._points + (point,)
+
+    def _reindex(self):
+        """
+        Index points by name, by object identifier and by kind (analog,
+        binary, multistates) so they can be found without iterating the list.
+        Requests prepared for the points must be rebuilt when the list changes.
+        """
+        points = self._points
+        self._points_by_name = {}
+        self._points_by_id = {}
+        self._analog_units = {}
+        self._binary_states = {}
+        self._multi_states = {}
+        for point in points:
+            self._points_by_name[point.properties.name] = point
+            self._points_by_id[(point.properties.type, int(point.properties.address))] = point
+            if isinstance(point, NumericPoint):
+                self._analog_units[point.properties.name] = point.properties.units_state
+            elif isinstance(point, BooleanPoint):
+                self._binary_states[point.properties.name] = point.properties.units_state
+            elif isinstance(point, EnumPoint):
+                self._multi_states[point.properties.name] = point.properties.units_state
+        self._temperatures = [each for each in self._analog_units.items()
+                              if isinstance(each[1], str) and "deg" in each[1]]
+        self._percent = [each for each in self._analog_units.items()
+                         if isinstance(each[1], str) and "percent" in each[1]]
+        self._poll_plan = None
+
     def new_state(self, newstate):
         """
         Base of the state machine mechanism.
@@ -201,7 +343,7 @@ class Device(SQLMixin):
         :rtype: BAC0.core.devices.Points.Point
         """
         for each in self.points:
-            if each.properties.simulated:
+            if each.properties.simulated[0]:
                 yield each
 
     def _buildPointList(self):
@@ -307,6 +449,16 @@ class Device(SQLMixin):
         """
         raise NotImplementedError()
 
+    def _findPointById(self, obj_type, obj_inst):
+        """
+        Helper that retrieve point based on its object identifier.
+
+        :param obj_type: (str) object type (ex. 'analogInput')
+        :param obj_inst: (int) object instance
+        :returns: Point object
+        """
+        raise NotImplementedError()
+
     def do(self, func):
         DoOnce(func).start()
 
@@ -315,7 +467,8 @@ class Device(SQLMixin):
 
 
 #@fix_docs
-class DeviceConnected(Device):
+class DeviceConnected(Device, SubscribeCOV, TrendLogs, WritePropertyMultiple,
+                      SimulateMultiple):
     """
     Find a device on the BACnet network.  Set its state to 'connected'.
     Once connected, all subsequent commands use this BACnet connection.
@@ -324,10 +477,15 @@ class DeviceConnected(Device):
     def _init_state(self):
         self._buildPointList()
         self.properties.network.register_device(self)
+        if self.properties.background_save:
+            self.start_history_writer()
 
     def disconnect(self):
         self._log.info('Wait while stopping polling')
         self.poll(command='stop')
+        if self._cov_subscriptions:
+            self.unsubscribe_cov()
+        self.stop_history_writer()
         self.properties.network.unregister_device(self)
         self.new_state(DeviceFromDB)
 
@@ -420,7 +578,7 @@ class DeviceConnected(Device):
         Allows the syntax:
             if "point_name" in device: 
         """
-        return value in self.points_name
+        return value in self._points_by_name
 
     @property
     def points_name(self):
@@ -454,57 +612,50 @@ class DeviceConnected(Device):
         """
         Shortcut to retrieve all analog points units [Used by Bokeh trending feature]
         """
-        au = []
-        us = []
-        for each in self.points:
-            if isinstance(each, NumericPoint):
-                au.append(each.properties.name)
-                us.append(each.properties.units_state)
-        return dict(zip(au, us))
+        return dict(self._analog_units)
 
     @property
     def temperatures(self):
-        for each in self.analog_units.items():
-            if "deg" in each[1]:
-                yield each
+        for each in self._temperatures:
+            yield each
 
     @property
     def percent(self):
-        for each in self.analog_units.items():
-            if "percent" in each[1]:
-                yield each
+        for each in self._percent:
+            yield each
 
     @property
     def multi_states(self):
-        ms = []
-        us = []
-        for each in self.points:
-            if isinstance(each, EnumPoint):
-                ms.append(each.properties.name)
-                us.append(each.properties.units_state)
-        return dict(zip(ms, us))
+        return dict(self._multi_states)
 
     @property
     def binary_states(self):
-        bs = []
-        us = []
-
-        for each in self.points:
-            if isinstance(each, BooleanPoint):
-                bs.append(each.properties.name)
-                us.append(each.properties.units_state)
-        return dict(zip(bs, us))
+        return dict(self._binary_states)
 
     def _findPoint(self, name, force_read=True):
         """
         Used by getter and setter functions
         """
-        for point in self.points:
-            if point.properties.name == name:
-                if force_read:
-                    point.value
-                return point
-        raise ValueError("{} doesn't exist in controller".format(name))
+        try:
+            point = self._points_by_name[name]
+        except KeyError:
+            raise ValueError("{} doesn't exist in controller".format(name))
+        if force_read:
+            point.value
+        return point
+
+    def _findPointById(self, obj_type, obj_inst):
+        """
+        Retrieve a point using its object identifier
+
+        :param obj_type: (str) object type (ex. 'analogInput')
+        :param obj_inst: (int) object instance
+        :returns: Point object
+        """
+        try:
+            return self._points_by_id[(obj_type, int(obj_inst))]
+        except KeyError:
+            raise ValueError("{}:{} doesn't exist in controller".format(obj_type, obj_inst))
 
     def __repr__(self):
         return '%s / Connected' % self.properties.name
@@ -533,7 +684,37 @@ class RPMDeviceConnected(DeviceConnected, ReadPropertyMultiple):
         return 'connected [for ReadPropertyMultiple]'
 
 
+# Actions needing BACnet, done by neither a disconnected device nor a device
+# loaded from a database
+_BACNET_ACTIONS = ('_buildPointList', '_discoverPoints', 'read_multiple', 'poll',
+                   'subscribe_cov', 'read_trend_log', 'backfill', 'write_many',
+                   'batch_writes', 'confirm_writes', 'queue_write', 'flush_writes',
+                   'out_of_service_many', 'sim_many', 'release_all', 'to_excel',
+                   '__contains__', '__setitem__')
+
+
+def _not_connected(methods=(), properties=()):
+    """
+    Class decorator of the offline device states : the methods and
+    properties named raise DeviceNotConnected
+    """
+    def not_connected(self, *args, **kwargs):
+        raise DeviceNotConnected('Must connect to BACnet or database')
+
+    def decorate(cls):
+        for name in methods:
+            setattr(cls, name, not_connected)
+        for name in properties:
+            setattr(cls, name, property(not_connected))
+        return cls
+    return decorate
+
+
 #@fix_docs
+@_not_connected(_BACNET_ACTIONS + ('df', '_findPoint', '_findPointById', '__getitem__',
+                                   '__iter__', '__len__'),
+                properties=('points_name', 'analog_units', 'temperatures', 'percent',
+                            'multi_states', 'binary_states'))
 class DeviceDisconnected(Device):
     """
     [Device state] Initial state of a device. Disconnected from BACnet.
@@ -556,6 +737,9 @@ class DeviceDisconnected(Device):
             segmentation = self.properties.network.read('{} device {} segmentationSupported'.format(
                 self.properties.address, self.properties.device_id))
 
+            self.properties.max_apdu_length = self.properties.network.read('{} device {} maxApduLengthAccepted'.format(
+                self.properties.address, self.properties.device_id))
+
             if not self.segmentation_supported or \
                     segmentation not in ('segmentedTransmit', 'segmentedBoth'):
                 segmentation_supported = False
@@ -583,82 +767,19 @@ class DeviceDisconnected(Device):
                     'Offline: provide database name to load stored data.')
                 self._log.warning("Ex. controller.connect(db = 'backup')")
 
-    def df(self, list_of_points, force_read=True):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
     @property
     def simulated_points(self):
         for each in self.points:
-            if each.properties.simulated:
+            if each.properties.simulated[0]:
                 yield each
 
-    def _buildPointList(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-
-# This should be a "read" function and rpm defined in state rpm
-    def read_multiple(self, points_list, *, points_per_request=25, discover_request=(None, 6)):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def poll(self, command='start', *, delay=10):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def __getitem__(self, point_name):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def __iter__(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def __contains__(self, value):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    @property
-    def points_name(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def to_excel(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def __setitem__(self, point_name, value):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def __len__(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    @property
-    def analog_units(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    @property
-    def temperatures(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    @property
-    def percent(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    @property
-    def multi_states(self):
-        raise DeviceNotConnected('Must connect to bacnet or database')
-
-    @property
-    def binary_states(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def _discoverPoints(self, custom_object_list=None):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def _findPoint(self, name, force_read=True):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
     def __repr__(self):
         return '{} / Disconnected'.format(self.properties.name)
 
 #------------------------------------------------------------------------------
 
 #@fix_docs
-
-
+@_not_connected(_BACNET_ACTIONS, properties=('simulated_points',))
 class DeviceFromDB(DeviceConnected):
     """
     [Device state] Where requests for a point's present value returns the last 
@@ -688,6 +809,9 @@ class DeviceFromDB(DeviceConnected):
                 segmentation = self.properties.network.read('{} device {} segmentationSupported'.format(
                     self.properties.address, self.properties.device_id))
 
+                self.properties.max_apdu_length = self.properties.network.read('{} device {} maxApduLengthAccepted'.format(
+                    self.properties.address, self.properties.device_id))
+
                 if not self.segmentation_supported or \
                         segmentation not in ('segmentedTransmit', 'segmentedBoth'):
                     segmentation_supported = False
@@ -723,9 +847,9 @@ class DeviceFromDB(DeviceConnected):
 
         self.db = sqlite3.connect('%s.db' % (self.properties.db_name))
         self._props = self.read_dev_prop(self.properties.db_name)
-        self.points = []
-        for point in self.points_from_sql(self.db):
-            self.points.append(OfflinePoint(self, point))
+        points_props = self.read_points_prop(self.properties.db_name)
+        self.points = [OfflinePoint(self, point, props=points_props[point])
+                       for point in self.points_from_sql(self.db)]
 
         self.properties = DeviceProperties()
         self.properties.db_name = dbname
@@ -739,35 +863,9 @@ class DeviceFromDB(DeviceConnected):
         self.properties.serving_chart = {}
         self.properties.charts = []
         self.properties.multistates = self._props['multistates']
+        self.properties.storage = self._props.get('storage', 'wide')
         print('Device restored from db')
 
-    @property
-    def simulated_points(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def _buildPointList(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-
-# This should be a "read" function and rpm defined in state rpm
-    def read_multiple(self, points_list, *, points_per_request=25, discover_request=(None, 6)):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def poll(self, command='start', *, delay=10):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def __contains__(self, value):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def to_excel(self):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def __setitem__(self, point_name, value):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
-    def _discoverPoints(self, custom_object_list=None):
-        raise DeviceNotConnected('Must connect to BACnet or database')
-
     def __repr__(self):
         return '{} / Disconnected'.format(self.properties.name)
 
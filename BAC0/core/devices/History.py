@@ -0,0 +1,463 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+History.py - Storage of point histories (timestamp, value)
+
+Samples are kept in numpy arrays. With a capacity, the history is a ring
+buffer overwriting the oldest samples. Without one, arrays grow as needed.
+Timestamps are stored as datetime64[ns] so pandas can use them as an index
+without copying.
+
+CompressedHistory keeps the samples in compressed blocks (see
+BAC0.core.utils.gorilla) and takes a fraction of the memory. Timestamps are
+kept to the microsecond.
+'''
+
+#--- standard Python modules ---
+from collections import deque
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from threading import RLock
+
+#--- 3rd party modules ---
+try:
+    import numpy as np
+    _NUMPY = True
+except ImportError:
+    _NUMPY = False
+
+#--- this application's modules ---
+from ..utils.gorilla import encode, decode
+
+#------------------------------------------------------------------------------
+
+_INITIAL_SIZE = 64
+_EPOCH = datetime(1970, 1, 1)
+
+
+class History():
+    """
+    Timestamps and values of a point.
+
+    :param capacity: (int) number of samples kept. When full, the oldest
+                     sample is overwritten. None (default) means unbounded.
+    :param dtype: numpy dtype of the values ('float64' for analog points,
+                  object for points returning strings or integers)
+
+    timestamps and values are views on the storage (no copy). When the history
+    is bounded and full, a new sample overwrites the oldest one, so keep a
+    copy of a view if you need it after the next append. Readings are
+    appended from other threads (polling, COV notifications) : use snapshot()
+    to get timestamps and values matching each other.
+
+    append and merge share a lock : a reading added while the history is
+    rebuilt by a merge is not lost.
+
+    last is the (timestamp, value) of the last valid reading, set with
+    update_last. It survives clear() and readings not kept in the history.
+    """
+
+    def __init__(self, capacity=None, dtype=object):
+        if capacity is not None and capacity < 1:
+            raise ValueError('History capacity must be at least 1')
+        self.capacity = capacity
+        self.dtype = dtype
+        self._lock = RLock()
+        self.last = None
+        self.clear()
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+        if not _NUMPY:
+            self._timestamps = deque(maxlen=self.capacity)
+            self._values = deque(maxlen=self.capacity)
+            return
+        # A bounded history writes each sample twice (i and i + capacity)
+        # so the ordered samples are always a contiguous slice.
+        size = 2 * self.capacity if self.capacity else _INITIAL_SIZE
+        self._timestamps = np.empty(size, dtype='datetime64[ns]')
+        self._values = np.empty(size, dtype=self.dtype)
+
+    def append(self, timestamp, value):
+        """
+        Add a sample
+
+        :param timestamp: (datetime) time of the reading
+        :param value: value read (None or invalid float are stored as NaN
+                      in float histories)
+        :returns: the value as stored
+        """
+        with self._lock:
+            return self._append(timestamp, value)
+
+    def _append(self, timestamp, value):
+        if not _NUMPY:
+            self._timestamps.append(timestamp)
+            self._values.append(value)
+            self._count = len(self._values)
+            return value
+
+        value = self._cast(value)
+        if self.capacity is None:
+            if self._count == len(self._values):
+                self._grow()
+            self._timestamps[self._count] = timestamp
+            self._values[self._count] = value
+            self._count += 1
+            return value
+
+        if self._count < self.capacity:
+            i = self._count
+            self._count += 1
+        else:
+            i = self._start
+            self._start = (self._start + 1) % self.capacity
+        for idx in (i, i + self.capacity):
+            self._timestamps[idx] = timestamp
+            self._values[idx] = value
+        return value
+
+    def _cast(self, value):
+        if self._values.dtype.kind == 'f':
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return float('nan')
+        return value
+
+    def _grow(self):
+        size = 2 * len(self._values)
+        timestamps = np.empty(size, dtype='datetime64[ns]')
+        values = np.empty(size, dtype=self._values.dtype)
+        timestamps[:self._count] = self._timestamps[:self._count]
+        values[:self._count] = self._values[:self._count]
+        self._timestamps = timestamps
+        self._values = values
+
+    @property
+    def timestamps(self):
+        """
+        returns: timestamps ordered from oldest to newest
+        """
+        if not _NUMPY:
+            return list(self._timestamps)
+        return self._timestamps[self._start:self._start + self._count]
+
+    @property
+    def values(self):
+        """
+        returns: values ordered from oldest to newest
+        """
+        if not _NUMPY:
+            return list(self._values)
+        return self._values[self._start:self._start + self._count]
+
+    def snapshot(self):
+        """
+        Timestamps and values read together, under the lock.
+        Views are returned while they can't change. Once a bounded history is
+        full, the next append overwrites them : copies are returned instead.
+
+        :returns: (tuple) timestamps, values
+        """
+        with self._lock:
+            timestamps, values = self.timestamps, self.values
+            if _NUMPY and self.capacity is not None and self._count == self.capacity:
+                return (timestamps.copy(), values.copy())
+            return (timestamps, values)
+
+    def between(self, start=None, end=None):
+        """
+        Samples taken after start (excluded) and up to end (included).
+        Samples being ordered, the bounds are found by binary search.
+
+        :param start: (datetime) None = from the first sample
+        :param end: (datetime) None = up to the last sample
+        :returns: (tuple) timestamps, values
+        """
+        timestamps, values = self.snapshot()
+        if _NUMPY:
+            lo = 0 if start is None else \
+                timestamps.searchsorted(np.datetime64(start, 'ns'), side='right')
+            hi = len(timestamps) if end is None else \
+                timestamps.searchsorted(np.datetime64(end, 'ns'), side='right')
+        else:
+            lo = 0 if start is None else bisect_right(timestamps, start)
+            hi = len(timestamps) if end is None else bisect_right(timestamps, end)
+        return (timestamps[lo:hi], values[lo:hi])
+
+    def merge(self, timestamps, values):
+        """
+        Add samples taken in the past (ex. records of a controller trend log).
+        See _merge.
+        """
+        with self._lock:
+            return _merge(self, timestamps, values)
+
+    def update_last(self, timestamp, value, newer_only=False):
+        """
+        Make (timestamp, value) the last valid reading.
+        See _update_last.
+        """
+        with self._lock:
+            _update_last(self, timestamp, value, newer_only)
+
+    def __len__(self):
+        return self._count
+
+
+def _merge(history, timestamps, values):
+    """
+    Add samples to a history, in time order. A sample at the time of a
+    sample already in the history is ignored. The history is rebuilt : with
+    a capacity, only the most recent samples are kept.
+
+    :param timestamps: (list of datetime)
+    :param values: (list)
+    :returns: (int) number of samples added
+    """
+    known = set()
+    samples = []
+    for timestamp, value in zip(*history.snapshot()):
+        key = _microseconds(timestamp)
+        known.add(key)
+        samples.append((key, timestamp, value))
+    added = 0
+    for timestamp, value in zip(timestamps, values):
+        key = _microseconds(timestamp)
+        if key in known:
+            continue
+        known.add(key)
+        samples.append((key, timestamp, value))
+        added += 1
+    if not added:
+        return 0
+    samples.sort(key=lambda sample: sample[0])
+    history.clear()
+    for _, timestamp, value in samples:
+        history.append(timestamp, value)
+    return added
+
+
+def _update_last(history, timestamp, value, newer_only=False):
+    """
+    Set history.last to (timestamp, value).
+
+    :param newer_only: (bool) keep history.last if it is newer (readings
+                       taken in the past, ex. trend log records)
+    """
+    if newer_only and history.last is not None and timestamp <= history.last[0]:
+        return
+    history.last = (timestamp, value)
+
+
+def _microseconds(timestamp):
+    """
+    datetime (or numpy.datetime64, ISO string) as integer microseconds since the epoch
+    """
+    if _NUMPY and not isinstance(timestamp, datetime):
+        return int(np.datetime64(timestamp, 'us').astype('int64'))
+    delta = timestamp - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+class CompressedHistory():
+    """
+    Timestamps and values of a point, compressed.
+
+    Samples are gathered in blocks of block_size samples. Once full, a block
+    is compressed (delta of delta timestamps, XORed float values). Values that
+    are not floats (binary states, multistate values) are stored as the index
+    of the value in a table of the distinct values read.
+
+    :param capacity: (int) number of samples kept. When full, the oldest
+                     sample is dropped. None (default) means unbounded.
+    :param dtype: numpy dtype of the values ('float64' for analog points,
+                  object for points returning strings or integers)
+    :param block_size: (int) samples per compressed block
+
+    Unlike History, timestamps and values are copies, decoded on each call
+    (the last decoded history is cached until the next append).
+    append, merge and update_last share a lock, as in History.
+    """
+
+    def __init__(self, capacity=None, dtype=object, block_size=1024):
+        if capacity is not None and capacity < 1:
+            raise ValueError('History capacity must be at least 1')
+        self.capacity = capacity
+        self.dtype = dtype
+        self.block_size = min(block_size, capacity) if capacity else block_size
+        self._float = _NUMPY and np.dtype(dtype).kind == 'f'
+        self._lock = RLock()
+        self.last = None
+        self.clear()
+
+    def clear(self):
+        # Compressed blocks : (first timestamp, last timestamp, count, data)
+        self._blocks = deque()
+        # Samples of the first block already dropped (bounded history)
+        self._skip = 0
+        self._timestamps = []
+        self._values = []
+        self._count = 0
+        self._labels = []
+        self._codes = {}
+        self._cache = None
+
+    def append(self, timestamp, value):
+        """
+        Add a sample
+
+        :param timestamp: (datetime) time of the reading
+        :param value: value read (None or invalid float are stored as NaN
+                      in float histories)
+        :returns: the value as stored
+        """
+        with self._lock:
+            return self._append(timestamp, value)
+
+    def _append(self, timestamp, value):
+        if self._float:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                value = float('nan')
+            code = value
+        else:
+            code = self._code(value)
+        self._timestamps.append(_microseconds(timestamp))
+        self._values.append(code)
+        self._count += 1
+        self._cache = None
+        if len(self._timestamps) >= self.block_size:
+            self._seal()
+        if self.capacity is not None and self._count > self.capacity:
+            self._drop(self._count - self.capacity)
+        return value
+
+    def _code(self, value):
+        try:
+            return self._codes[value]
+        except KeyError:
+            code = self._codes[value] = float(len(self._labels))
+            self._labels.append(value)
+            return code
+
+    def _seal(self):
+        self._blocks.append((self._timestamps[0], self._timestamps[-1], len(self._timestamps),
+                             encode(self._timestamps, self._values)))
+        self._timestamps = []
+        self._values = []
+
+    def _drop(self, count):
+        self._count -= count
+        self._skip += count
+        while self._blocks and self._skip >= self._blocks[0][2]:
+            self._skip -= self._blocks.popleft()[2]
+
+    @property
+    def nbytes(self):
+        """
+        returns: (int) approximate memory used by the samples
+        """
+        return sum(len(block[3]) for block in self._blocks) + 16 * len(self._timestamps)
+
+    def _samples(self, start=None, end=None):
+        """
+        Decode the blocks holding samples taken after start and up to end
+        """
+        timestamps = []
+        values = []
+        for i, (first, last, count, data) in enumerate(self._blocks):
+            if start is not None and last <= start:
+                continue
+            if end is not None and first > end:
+                break
+            block_timestamps, block_values = decode(data)
+            skip = self._skip if i == 0 else 0
+            timestamps.extend(block_timestamps[skip:])
+            values.extend(block_values[skip:])
+        timestamps.extend(self._timestamps)
+        values.extend(self._values)
+        lo = 0 if start is None else bisect_right(timestamps, start)
+        hi = len(timestamps) if end is None else bisect_right(timestamps, end)
+        return (timestamps[lo:hi], values[lo:hi])
+
+    def _output(self, timestamps, values):
+        if not self._float:
+            values = [self._labels[int(code)] for code in values]
+        if not _NUMPY:
+            return ([_EPOCH + timedelta(microseconds=each) for each in timestamps], values)
+        timestamps = np.array(timestamps, dtype='int64').astype('datetime64[us]').astype('datetime64[ns]')
+        if self._float:
+            return (timestamps, np.array(values, dtype='float64'))
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return (timestamps, array)
+
+    def _decoded(self):
+        with self._lock:
+            if self._cache is None:
+                self._cache = self._output(*self._samples())
+            return self._cache
+
+    def snapshot(self):
+        """
+        Timestamps and values read together, under the lock (copies).
+
+        :returns: (tuple) timestamps, values
+        """
+        return self._decoded()
+
+    @property
+    def timestamps(self):
+        """
+        returns: timestamps ordered from oldest to newest
+        """
+        return self._decoded()[0]
+
+    @property
+    def values(self):
+        """
+        returns: values ordered from oldest to newest
+        """
+        return self._decoded()[1]
+
+    def between(self, start=None, end=None):
+        """
+        Samples taken after start (excluded) and up to end (included).
+        Only the blocks covering the period are decoded.
+
+        :param start: (datetime) None = from the first sample
+        :param end: (datetime) None = up to the last sample
+        :returns: (tuple) timestamps, values
+        """
+        with self._lock:
+            samples = self._samples(
+                None if start is None else _microseconds(start),
+                None if end is None else _microseconds(end))
+        return self._output(*samples)
+
+    def merge(self, timestamps, values):
+        """
+        Add samples taken in the past (ex. records of a controller trend log).
+        See _merge.
+        """
+        with self._lock:
+            return _merge(self, timestamps, values)
+
+    def update_last(self, timestamp, value, newer_only=False):
+        """
+        Make (timestamp, value) the last valid reading.
+        See _update_last.
+        """
+        with self._lock:
+            _update_last(self, timestamp, value, newer_only)
+
+    def __len__(self):
+        return self._count
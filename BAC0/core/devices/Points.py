@@ -11,16 +11,13 @@ Points.py - Definition of points so operations on Read results are more convenie
 #--- standard Python modules ---
 from datetime import datetime
 from collections import namedtuple
+from concurrent.futures import Future
+from threading import Lock
 import time
 
 #--- 3rd party modules ---
 try:
     import pandas as pd
-    from pandas.io import sql
-    try:
-        from pandas import Timestamp
-    except ImportError:
-        from pandas.lib import Timestamp
     _PANDAS = True
 except ImportError:
     _PANDAS = False
@@ -29,6 +26,7 @@ except ImportError:
 from ...tasks.Poll import SimplePoll as Poll
 from ...tasks.Match import Match, Match_Value
 from ..io.IOExceptions import NoResponseFromController
+from .History import History, CompressedHistory
 
 #------------------------------------------------------------------------------
 
@@ -47,6 +45,10 @@ class PointProperties(object):
         self.units_state = None
         self.simulated = (False, None)
         self.overridden = (False, None)
+        # None = use the device setting
+        self.deadband = None
+        self.heartbeat = None
+        self.max_age = None
 
     def __repr__(self):
         return '%s' % self.asdict
@@ -64,13 +66,45 @@ class Point():
 
     Each point implements a history feature. Each time the point is read, its value (with timestamp)
     is added to a history table. Histories capture the changes to point values over time.
+    The number of samples kept is limited by device.properties.history_size (None = unlimited).
+    With device.properties.compress_history, samples are kept compressed.
+
+    With a deadband (point.properties.deadband, or device.properties.deadband
+    by default), a reading is added to the history only if it changed :
+    numeric points by more than the deadband (a number, or a percentage of
+    the last value kept like '2%'), binary and multistate points as soon as
+    the state changes. A heartbeat (seconds) adds a reading even without
+    change when the last one kept is that old. lastValue is always the last
+    value read.
+
+    value (and the operators using it) returns the last value without
+    reading it again when it was read (or polled) less than max_age seconds
+    ago : point.properties.max_age, device.properties.max_age or
+    Point.default_max_age. Callers asking for the value while it is being
+    read share that read.
     """
+    _history_dtype = object
+    _states = 'analog'
+    # Seconds a value is used without being read again (0 = always read)
+    default_max_age = 0
 
     def __init__(self, device=None,
                  pointType=None,    pointAddress=None,  pointName=None,
                  description=None,  presentValue=None,  units_state=None):
 
-        self._history = namedtuple('_history', ['timestamp', 'value'])
+        try:
+            history_size = device.properties.history_size
+            compress = device.properties.compress_history
+        except AttributeError:
+            history_size = None
+            compress = False
+        history = CompressedHistory if compress else History
+        self._history = history(history_size, dtype=self._history_dtype)
+        # (time, value) of the last reading added to the history
+        self._last_stored = None
+        # Read in progress, shared by the callers asking for the value
+        self._reading = None
+        self._read_lock = Lock()
         self.properties = PointProperties()
 
         self._polling_task = namedtuple('_polling_task', ['task', 'running'])
@@ -81,11 +115,6 @@ class Point():
         self._match_task.task = None
         self._match_task.running = False
 
-        self._history.timestamp = []
-        self._history.value = []
-        self._history.value.append(presentValue)
-        self._history.timestamp.append(datetime.now())
-
         self.properties.device = device
         self.properties.name = pointName
         self.properties.type = pointType
@@ -96,24 +125,145 @@ class Point():
         self.properties.simulated = (False, 0)
         self.properties.overridden = (False, 0)
 
+        self._trend(presentValue)
+
     @property
     def value(self):
         """
-        Retrieve value of the point
+        Retrieve value of the point (last value if read less than max_age
+        seconds ago)
+        """
+        if self._is_fresh():
+            return self._history.last[1]
+        return self._read()
+
+    def _read(self, *, shared=True):
+        """
+        Read the value from BACnet network. A caller asking while a read is
+        in progress waits for its answer instead of sending another request.
+
+        :param shared: (boolean) False always sends a new request (ex. after
+                       a write, a read in progress may hold the old value).
+                       Callers coming next share it.
         """
+        with self._read_lock:
+            reading = self._reading
+            if reading is None or not shared:
+                reading = self._reading = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return reading.result()
+
         try:
             res = self.properties.device.properties.network.read('{} {} {} presentValue'.format(
                 self.properties.device.properties.address, self.properties.type, str(self.properties.address)))
             self._trend(res)
         except Exception:
-            raise Exception(
-                'Problem reading : {}'.format(self.properties.name))
-
+            error = Exception('Problem reading : {}'.format(self.properties.name))
+            reading.set_exception(error)
+            raise error
+        else:
+            reading.set_result(res)
+        finally:
+            with self._read_lock:
+                if self._reading is reading:
+                    self._reading = None
         return res
 
+    def _is_fresh(self):
+        """
+        True if the last value was read less than max_age seconds ago (and
+        the point was not written since)
+        """
+        max_age = self._setting('max_age')
+        if max_age is None:
+            max_age = self.default_max_age
+        last = self._history.last
+        if not max_age or last is None:
+            return False
+        try:
+            if self.properties.name in self.properties.device._pending_writes:
+                return False
+        except AttributeError:
+            pass
+        return (datetime.now() - last[0]).total_seconds() < max_age
+
     def _trend(self, res):
-        self._history.timestamp.append(datetime.now())
-        self._history.value.append(res)
+        now = datetime.now()
+        res = self._cast(res)
+        # Keep last valid value so lastValue doesn't need the whole history
+        if res is not None and res == res:
+            self._history.update_last(now, res)
+        # A reading confirms a write waiting for verification
+        try:
+            pending = self.properties.device._pending_writes
+        except AttributeError:
+            pending = None
+        if pending:
+            pending.pop(self.properties.name, None)
+        if not self._must_store(now, res):
+            return
+        res = self._history.append(now, res)
+        self._last_stored = (now, res)
+        try:
+            writer = self.properties.device._history_writer
+        except AttributeError:
+            writer = None
+        if writer is not None:
+            writer.put(self, now, res)
+
+    def _merge(self, timestamps, values):
+        """
+        Add readings taken in the past (ex. trend log records) to the
+        history. lastValue becomes the newest of them if it is newer than
+        the last reading.
+
+        :returns: (int) number of readings added
+        """
+        added = self._history.merge(timestamps, values)
+        newest = None
+        for timestamp, value in zip(timestamps, values):
+            value = self._cast(value)
+            if value is not None and value == value \
+                    and (newest is None or timestamp > newest[0]):
+                newest = (timestamp, value)
+        if newest is not None:
+            self._history.update_last(*newest, newer_only=True)
+        return added
+
+    def _cast(self, value):
+        return value
+
+    def _setting(self, name):
+        """
+        Point property, device property when not set on the point
+        """
+        value = getattr(self.properties, name)
+        if value is None:
+            try:
+                value = getattr(self.properties.device.properties, name)
+            except AttributeError:
+                pass
+        return value
+
+    def _must_store(self, now, value):
+        """
+        True if the reading goes to the history (deadband and heartbeat)
+        """
+        deadband = self._setting('deadband')
+        if deadband is None or self._last_stored is None:
+            return True
+        last_time, last_value = self._last_stored
+        heartbeat = self._setting('heartbeat')
+        if heartbeat is not None and (now - last_time).total_seconds() >= heartbeat:
+            return True
+        return self._changed(last_value, value, deadband)
+
+    def _changed(self, previous, value, deadband):
+        # States : any change
+        return not value == previous
 
     @property
     def units(self):
@@ -125,39 +275,45 @@ class Point():
     @property
     def lastValue(self):
         """
-        returns: last value read
+        returns: last valid value read
         """
-        if _PANDAS:
-            return self.history.dropna().iloc[-1]
-        else:
-            return self._history.value[-1]
+        last = self._history.last
+        if last is None:
+            raise IndexError('No value read for {}'.format(self.properties.name))
+        return last[1]
 
     @property
     def history(self):
         """
         returns : (pd.Series) containing timestamp and value of all readings
         """
+        timestamps, values = self._history.snapshot()
         if not _PANDAS:
-            return dict(zip(self._history.timestamp, self._history.value))
-        his_table = pd.Series(self._history.value,
-                              index=self._history.timestamp)
+            return dict(zip(timestamps, values))
+        his_table = pd.Series(values, index=pd.DatetimeIndex(timestamps, copy=False),
+                              copy=False)
         his_table.name = (
             '{}/{}').format(self.properties.device.properties.name, self.properties.name)
         his_table.units = self.properties.units_state
-        if self.properties.name in self.properties.device.binary_states:
-            his_table.states = 'binary'
-        elif self.properties.name in self.properties.device.multi_states:
-            his_table.states = 'multistates'
-        else:
-            his_table.states = 'analog'
+        his_table.states = self._states
         his_table.description = self.properties.description
 
         his_table.datatype = self.properties.type
         return his_table
 
+    def history_between(self, start=None, end=None):
+        """
+        returns : (pd.Series) readings taken after start and up to end
+        """
+        timestamps, values = self._history.between(start, end)
+        if not _PANDAS:
+            return dict(zip(timestamps, values))
+        return pd.Series(values, index=pd.DatetimeIndex(timestamps, copy=False),
+                         name=self.properties.name, copy=False)
+
     def clear_history(self):
-        self._history.timestamp = []
-        self._history.value = []
+        self._history.clear()
+        self._last_stored = None
 
     def chart(self, remove=False):
         """
@@ -211,8 +367,10 @@ class Point():
         except Exception:
             raise NoResponseFromController()
 
-        # Read after the write so history gets updated.
-        self.value
+        # Read after the write so history gets updated. The device can keep
+        # the point to read it later with others (see device.batch_writes)
+        if not self.properties.device._queue_verification(self):
+            self._read(shared=False)
 
     def default(self, value):
         self.write(value, prop='relinquishDefault')
@@ -258,15 +416,20 @@ class Point():
         self.write('null', priority=8)
         self.properties.overridden = (False, 0)
 
-    def _setitem(self, value):
+    def _setitem(self, value, *, queued=False):
         """
         Called by _set, will trigger right function depending on
         point type to write to the value and make tests.
         This is default behaviour of the point  :
         AnalogValue are written to
         AnalogOutput are overridden
+        With queued=True, writes go through the write queue of the device
+        (see device.queue_write)
         """
-        if 'Value' in self.properties.type:
+        if queued:
+            self._queue_setitem(value)
+
+        elif 'Value' in self.properties.type:
             if str(value).lower() == 'auto':
                 raise ValueError(
                     'Value was not simulated or overridden, cannot release to auto')
@@ -286,6 +449,27 @@ class Point():
             else:
                 self.sim(value)
 
+    def _queue_setitem(self, value):
+        device = self.properties.device
+        auto = str(value).lower() == 'auto'
+        if 'Value' in self.properties.type:
+            if auto:
+                raise ValueError(
+                    'Value was not simulated or overridden, cannot release to auto')
+            device.queue_write(self, value)
+
+        elif 'Output' in self.properties.type:
+            device.queue_write(self, 'null' if auto else value, priority=8)
+            self.properties.overridden = (False, 0) if auto else (True, value)
+
+        elif auto:
+            device.queue_write(self, 'False', prop='outOfService')
+            self.properties.simulated = (False, None)
+        else:
+            device.queue_write(self, 'True', prop='outOfService')
+            device.queue_write(self, value)
+            self.properties.simulated = (True, value)
+
     def _set(self, value):
         """
         Allows the syntax:
@@ -293,11 +477,12 @@ class Point():
         """
         raise Exception('Must be overridden')
 
-    def poll(self, command='start', *, delay=10):
+    def poll(self, command='start', *, delay=10, fixed_rate=False):
         """
         Poll a point every x seconds (delay=x sec)
         Stopped by using point.poll('stop') or .poll(0) or .poll(False)
         or by setting a delay = 0
+        Use fixed_rate=True to read on a fixed grid of delay seconds
         """
         if str(command).lower() == 'stop' \
                 or command == False \
@@ -310,14 +495,14 @@ class Point():
                 self._polling_task.running = False
 
         elif self._polling_task.task is None:
-            self._polling_task.task = Poll(self, delay=delay)
+            self._polling_task.task = Poll(self, delay=delay, fixed_rate=fixed_rate)
             self._polling_task.task.start()
             self._polling_task.running = True
 
         elif self._polling_task.running:
             self._polling_task.task.stop()
             self._polling_task.running = False
-            self._polling_task.task = Poll(self, delay=delay)
+            self._polling_task.task = Poll(self, delay=delay, fixed_rate=fixed_rate)
             self._polling_task.task.start()
             self._polling_task.running = True
 
@@ -388,7 +573,7 @@ class Point():
         """
         Length of a point = # of history records
         """
-        return len(self.history)
+        return len(self._history)
 
 
 #------------------------------------------------------------------------------
@@ -397,6 +582,7 @@ class NumericPoint(Point):
     """
     Representation of a Numeric value
     """
+    _history_dtype = 'float64'
 
     def __init__(self, device=None,
                  pointType=None,    pointAddress=None,  pointName=None,
@@ -410,6 +596,20 @@ class NumericPoint(Point):
     def units(self):
         return self.properties.units_state
 
+    def _cast(self, value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return float('nan')
+
+    def _changed(self, previous, value, deadband):
+        if value != value or previous != previous:
+            # From or to NaN
+            return (value == value) != (previous == previous)
+        if isinstance(deadband, str):
+            deadband = abs(previous) * float(deadband.rstrip('%')) / 100
+        return abs(value - previous) > deadband
+
     def _set(self, value):
         if str(value).lower() == 'auto':
             self._setitem(value)
@@ -460,6 +660,7 @@ class BooleanPoint(Point):
     """
     Representation of a Boolean value
     """
+    _states = 'binary'
 
     def __init__(self, device=None,
                  pointType=None,    pointAddress=None,  pointName=None,
@@ -472,16 +673,10 @@ class BooleanPoint(Point):
     @property
     def value(self):
         """
-        Read the value from BACnet network
+        Read the value from BACnet network (last value if read less than
+        max_age seconds ago)
         """
-        try:
-            res = self.properties.device.properties.network.read('{} {} {} presentValue'.format(
-                self.properties.device.properties.address, self.properties.type, str(self.properties.address)))
-            self._trend(res)
-
-        except Exception:
-            raise Exception(
-                'Problem reading : {}'.format(self.properties.name))
+        res = super().value
 
         if res == 'inactive':
             self._key = 0
@@ -544,6 +739,7 @@ class EnumPoint(Point):
     """
     Representation of an Enumerated (multiState) value
     """
+    _states = 'multistates'
 
     def __init__(self, device=None,
                  pointType=None,    pointAddress=None,  pointName=None,
@@ -600,11 +796,12 @@ class OfflinePoint(Point):
     (we can't read on bacnet...)
     """
 
-    def __init__(self, device, name):
+    def __init__(self, device, name, props=None):
         self.properties = PointProperties()
         self.properties.device = device
-        dev_name = self.properties.device.properties.db_name
-        props = self.properties.device.read_point_prop(dev_name, name)
+        if props is None:
+            dev_name = self.properties.device.properties.db_name
+            props = self.properties.device.read_point_prop(dev_name, name)
 
         self.properties.name = props['name']
         self.properties.type = props['type']
@@ -628,14 +825,33 @@ class OfflinePoint(Point):
         self.__class__ = newstate
 
 
-class NumericPointOffline(NumericPoint):
+class OfflineHistory():
+    """
+    Offline points read their history from the device database. Only the
+    rows of the point (and of the requested period) are read.
+    """
     @property
     def history(self):
-        his = sql.read_sql('select * from "{}"'.format(
-            'history', self.properties.device.db))
-        his.index = his['index'].apply(Timestamp)
-        return his.set_index('index')[self.properties.name]
+        return self.history_between()
+
+    def history_between(self, start=None, end=None):
+        """
+        returns : (pd.Series) readings taken after start and up to end
+        """
+        return self.properties.device.his_from_sql(self.properties.device.db,
+                                                   self.properties.name,
+                                                   start=start, end=end)
 
+    @property
+    def lastValue(self):
+        return self.properties.device.value_from_sql(self.properties.device.db,
+                                                     self.properties.name)
+
+    def __len__(self):
+        return len(self.history)
+
+
+class NumericPointOffline(OfflineHistory, NumericPoint):
     @property
     def value(self):
         """
@@ -667,14 +883,7 @@ class NumericPointOffline(NumericPoint):
         return '{}/{} : {:.2f} {}'.format(self.properties.device.properties.name, self.properties.name, self.value, self.properties.units_state)
 
 
-class BooleanPointOffline(BooleanPoint):
-    @property
-    def history(self):
-        his = sql.read_sql('select * from "{}"'.format(
-            'history', self.properties.device.db))
-        his.index = his['index'].apply(Timestamp)
-        return his.set_index('index')[self.properties.name]
-
+class BooleanPointOffline(OfflineHistory, BooleanPoint):
     @property
     def value(self):
         try:
@@ -696,14 +905,7 @@ class BooleanPointOffline(BooleanPoint):
         raise OfflineException('Must be online to write')
 
 
-class EnumPointOffline(EnumPoint):
-    @property
-    def history(self):
-        his = sql.read_sql('select * from "{}"'.format(
-            'history', self.properties.device.db))
-        his.index = his['index'].apply(Timestamp)
-        return his.set_index('index')[self.properties.name]
-
+class EnumPointOffline(OfflineHistory, EnumPoint):
     @property
     def value(self):
         """
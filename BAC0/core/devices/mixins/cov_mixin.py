@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+cov_mixin.py - Add COV subscriptions to a device
+'''
+#--- standard Python modules ---
+#--- 3rd party modules ---
+#--- this application's modules ---
+from ....tasks.COV import COVResubscribe
+from ...io.IOExceptions import COVSubscriptionError, NoResponseFromController, UnrecognizedService
+from ..Points import Point
+
+#------------------------------------------------------------------------------
+
+
+class SubscribeCOV():
+    """
+    Handle COV subscriptions for a device. Subscribed points get their value
+    from the notifications sent by the device and are not polled anymore.
+    Points refusing the subscription keep being polled.
+    """
+
+    @property
+    def cov_points(self):
+        """
+        returns: (list) names of the points updated by COV notifications
+        """
+        return list(self._cov_subscriptions)
+
+
+    def subscribe_cov(self, points=None, *, lifetime=300, confirmed=False):
+        """
+        Subscribe to the changes of value of points. Subscriptions are renewed
+        before lifetime expires until unsubscribe_cov() is called.
+
+        :param points: (list) point names (or points). None = every point.
+        :param lifetime: (int) lifetime of the subscriptions in seconds.
+                         None = subscriptions never expire (not renewed).
+        :param confirmed: (bool) ask for confirmed notifications
+        :returns: (list) names of the points refusing the subscription (they
+                  are still polled)
+
+        :Example:
+
+        device.subscribe_cov(['ZN-T', 'ZN-SP'], lifetime=600)
+        """
+        if points is None:
+            points = self.points
+        elif isinstance(points, (str, Point)):
+            points = [points]
+        self._cov_lifetime = lifetime
+        self._cov_confirmed = confirmed
+        refused = self._subscribe_cov(points)
+
+        if self._cov_task is not None:
+            self._cov_task.stop()
+            self._cov_task = None
+        if lifetime and self._cov_subscriptions:
+            self._cov_task = COVResubscribe(self, lifetime)
+            self._cov_task.start()
+        return refused
+
+
+    def renew_cov(self):
+        """
+        Renew every subscription. Used by the resubscription task.
+        """
+        refused = self._subscribe_cov(list(self._cov_subscriptions))
+        if refused:
+            self._log.warning('COV subscriptions lost, points will be polled : {}'.format(refused))
+
+
+    def _subscribe_cov(self, points):
+        network = self.properties.network
+        futures = []
+        for each in points:
+            point = each if isinstance(each, Point) else self._findPoint(each, force_read=False)
+            name = point.properties.name
+            futures.append((name, network.subscribe_cov_async(
+                self._cov_args(point), lifetime=self._cov_lifetime,
+                confirmed=self._cov_confirmed, callback=self._cov_value,
+                process_id=self._cov_subscriptions.get(name))))
+
+        refused = []
+        for name, future in futures:
+            try:
+                self._cov_subscriptions[name] = future.result()
+            except (COVSubscriptionError, UnrecognizedService, NoResponseFromController) as error:
+                self._log.warning('{} will be polled : {}'.format(name, error))
+                self._cov_subscriptions.pop(name, None)
+                refused.append(name)
+        # Subscribed points are removed from the poll plan
+        self._poll_plan = None
+        return refused
+
+
+    def unsubscribe_cov(self, points=None):
+        """
+        Cancel subscriptions. Points are polled again.
+
+        :param points: (list) point names. None = every subscribed point.
+        """
+        if points is None:
+            points = list(self._cov_subscriptions)
+        elif isinstance(points, (str, Point)):
+            points = [points]
+        for each in points:
+            point = each if isinstance(each, Point) else self._findPoint(each, force_read=False)
+            process_id = self._cov_subscriptions.pop(point.properties.name, None)
+            if process_id is not None:
+                self.properties.network.unsubscribe_cov(self._cov_args(point), process_id)
+        if not self._cov_subscriptions and self._cov_task is not None:
+            self._cov_task.stop()
+            self._cov_task = None
+        self._poll_plan = None
+
+
+    def _cov_args(self, point):
+        return '{} {} {}'.format(self.properties.address, point.properties.type,
+                                 point.properties.address)
+
+
+    def _cov_value(self, object_identifier, values):
+        """
+        Notification received (BACnet stack thread)
+        """
+        if 'presentValue' not in values:
+            return
+        try:
+            point = self._findPointById(*object_identifier)
+        except ValueError:
+            return
+        point._trend(values['presentValue'])
@@ -8,13 +8,17 @@
 read_mixin.py - Add ReadProperty and ReadPropertyMultiple to a device 
 '''
 #--- standard Python modules ---
-
 #--- 3rd party modules ---
+from bacpypes.pdu import Address
+from bacpypes.object import get_datatype
+from bacpypes.apdu import PropertyReference, ReadAccessSpecification, ReadPropertyMultipleRequest
 
 #--- this application's modules ---
 from ....tasks.Poll import DevicePoll
 from ...io.IOExceptions import ReadPropertyMultipleException, NoResponseFromController, SegmentationNotSupported
+from ...io.Futures import pipelined
 from ..Points import NumericPoint, BooleanPoint, EnumPoint, OfflinePoint
+from ...utils.apdu_size import apdu_budget, packed_slices, rpm_sizes, rpm_sizes_from_str, MIN_BUDGET
 
 #------------------------------------------------------------------------------
 
@@ -24,6 +28,42 @@ def retrieve_type(obj_list, point_type_key):
             yield (point_type, point_address)
 
 
+class PollPlan():
+    """
+    ReadPropertyMultiple requests prepared once to poll all the points of a
+    device. Each batch holds the ReadAccessSpecification to send and the
+    points receiving the values (same order).
+    """
+
+    def __init__(self, address):
+        self.address = Address(address)
+        self.batches = []
+        self.datatypes = {}
+
+    def add_batch(self, points):
+        read_access_specs = []
+        for point in points:
+            obj_type = point.properties.type
+            read_access_specs.append(ReadAccessSpecification(
+                objectIdentifier=(obj_type, int(point.properties.address)),
+                listOfPropertyReferences=[PropertyReference(propertyIdentifier='presentValue')]))
+            if (obj_type, 'presentValue') not in self.datatypes:
+                self.datatypes[(obj_type, 'presentValue')] = get_datatype(obj_type, 'presentValue')
+        self.batches.append((read_access_specs, points))
+
+    def requests(self):
+        """
+        Generator of requests ready to be sent
+        """
+        for read_access_specs, points in self.batches:
+            request = ReadPropertyMultipleRequest(listOfReadAccessSpecs=read_access_specs)
+            request.pduDestination = self.address
+            yield request
+
+    def __len__(self):
+        return len(self.batches)
+
+
 class ReadPropertyMultiple():
     """
     Handle ReadPropertyMultiple for a device
@@ -62,17 +102,174 @@ class ReadPropertyMultiple():
         return (requests, points)
 
 
-    def read_multiple(self, points_list, *, points_per_request=25, discover_request=(None, 6), force_single=False):
+    def _rpm_budget(self):
+        """
+        Size (bytes) a ReadPropertyMultiple answer may use for this device.
+        Starts from the device maxApduLengthAccepted and is reduced each time
+        the device tells a request was too big. The learned value is kept in
+        device.properties.rpm_budget.
+        """
+        if self.properties.rpm_budget is None:
+            self.properties.rpm_budget = apdu_budget(
+                self.properties.max_apdu_length, self.properties.segmentation_supported)
+        return self.properties.rpm_budget
+
+
+    def _packed_batches(self, requests, points_per_request=None):
+        """
+        Split requests in 'request batches' filled up to the size the device
+        can handle.
+        :params: requests a list of request str (one object each)
+        :params: (int) points_per_request optional maximum number of objects per batch
+        :returns: (list) slices of requests
+        """
+        sizes = [rpm_sizes_from_str(request) for request in requests]
+        return list(packed_slices(sizes, self.properties.max_apdu_length,
+                                  self._rpm_budget(), max_items=points_per_request))
+
+
+    def _request_too_big(self, batches):
+        """
+        Device refused a request because of its size. Stop relying on
+        segmentation, then reduce the budget by half each time.
+        :params: batches list of slices that were sent
+        :returns: (bool) False if requests can't be made smaller
+        """
+        if max((batch.stop - batch.start for batch in batches), default=1) <= 1:
+            return False
+
+        budget = self._rpm_budget()
+        if self.properties.segmentation_supported:
+            self.properties.segmentation_supported = False
+            budget = min(budget, apdu_budget(self.properties.max_apdu_length))
+        else:
+            budget = budget // 2
+        self.properties.rpm_budget = budget if budget >= MIN_BUDGET else 1
+        self._poll_plan = None
+        self._log.warning('Request too big...will reduce it to {} bytes'.format(
+            self.properties.rpm_budget))
+        return True
+
+
+    @property
+    def poll_plan(self):
+        """
+        Requests used to poll every points of the device. Built on first use
+        and rebuilt when the points list changes.
+        """
+        if self._poll_plan is None:
+            self._poll_plan = self._build_poll_plan()
+        return self._poll_plan
+
+
+    def _polled_points(self):
+        """
+        Points not updated by COV notifications
+        """
+        return [point for point in self.points
+                if point.properties.name not in self._cov_subscriptions]
+
+
+    def _build_poll_plan(self):
+        points = self._polled_points()
+        sizes = [rpm_sizes(point.properties.type, ['presentValue']) for point in points]
+        plan = PollPlan(self.properties.address)
+        for batch in packed_slices(sizes, self.properties.max_apdu_length, self._rpm_budget()):
+            plan.add_batch(points[batch])
+        self._log.debug('Poll plan : {} points in {} requests'.format(len(points), len(plan)))
+        return plan
+
+
+    def read_poll_plan(self, *, max_in_flight=None):
+        """
+        Read the presentValue of every points of the device using the poll plan.
+        Points subscribed to COV are not read. Used by the polling task.
+        """
+        if not self.properties.pss['readPropertyMultiple']:
+            return self.read_multiple([point.properties.name for point in self._polled_points()],
+                                      max_in_flight=max_in_flight)
+
+        if max_in_flight is None:
+            max_in_flight = self.properties.max_in_flight
+        max_in_flight = max(1, int(max_in_flight))
+
+        plan = self.poll_plan
+        datatypes = plan.datatypes
+        send = self.properties.network.send_rpm_request
+        done = 0
+        try:
+            for (read_access_specs, points), future in zip(plan.batches, self._pipelined(
+                    plan.requests(), max_in_flight,
+                    send=lambda request: send(request, datatypes=datatypes))):
+                val = self._batch_result(future, points)
+                if val is not None:
+                    for point, value in zip(points, val):
+                        point._trend(value)
+                done += 1
+
+        except SegmentationNotSupported:
+            batches = [slice(0, len(points)) for read_access_specs, points in plan.batches]
+            if self._request_too_big(batches):
+                # Points of the batches already read are not read again
+                remaining = [point.properties.name
+                             for read_access_specs, points in plan.batches[done:]
+                             for point in points]
+                self.read_multiple(remaining, max_in_flight=max_in_flight)
+            else:
+                self._log.error('Device refuses to answer even with one point per request')
+
+
+    def _pipelined(self, requests, max_in_flight, send=None):
+        """
+        Generator sending ReadPropertyMultiple requests while keeping up to
+        "max_in_flight" of them waiting for an answer.
+        :params: requests an iterable of RPM request as str
+        :params: (int) max_in_flight
+        :params: send optional function sending a request and returning a future
+                 (defaults to network.readMultiple_async)
+        :returns: (iter) completed futures, in the same order as the requests
+        """
+        if send is None:
+            send = self.properties.network.readMultiple_async
+        return pipelined(requests, send, max_in_flight)
+
+
+    def _batch_result(self, future, points):
+        """
+        Values read by a request of a poll. A request without answer is
+        logged and skipped (None) so the other requests are still read.
+        An answer without values is taken as a request too big : raises
+        SegmentationNotSupported.
+        """
+        names = ', '.join(point.properties.name for point in points)
+        try:
+            val = future.result()
+        except NoResponseFromController as error:
+            self._log.warning('No answer reading {} : {}'.format(names, error))
+            return None
+        if val is None:
+            self._log.warning('Nothing read for {}'.format(names))
+            raise SegmentationNotSupported()
+        return val
+
+
+    def read_multiple(self, points_list, *, points_per_request=None, discover_request=(None, 6), force_single=False, max_in_flight=None):
         """
         Read points from a device using a ReadPropertyMultiple request.
         [ReadProperty requests are very slow in comparison].
 
         :param points_list: (list) a list of all point_name as str
-        :param points_per_request: (int) number of points in the request
-
-        Requesting many points results big requests that need segmentation.  Aim to request 
-        just the 'right amount' so segmentation can be avoided.  Determining the 'right amount' 
-        is often trial-&-error.
+        :param points_per_request: (int) maximum number of points in the request.
+                                   By default, requests are filled up to the
+                                   size accepted by the device.
+        :param max_in_flight: (int) number of requests sent to the device
+                              before waiting for the first answer. Defaults to
+                              device.properties.max_in_flight
+
+        Requesting many points results big requests that need segmentation.
+        BAC0 estimates the size of each request using the maxApduLengthAccepted
+        of the device and reduces it (remembering the size that works) if the
+        device answers the request was too big.
 
         :Example:
 
@@ -82,64 +279,63 @@ class ReadPropertyMultiple():
             self._log.warning('Read property Multiple Not supported')
             self.read_single(points_list,points_per_request=1, discover_request=discover_request)
         else:
-            if not self.properties.segmentation_supported:
-                points_per_request = 1
+            if max_in_flight is None:
+                max_in_flight = self.properties.max_in_flight
+            max_in_flight = max(1, int(max_in_flight))
 
             if discover_request[0]:
                 values = []
                 info_length = discover_request[1]
                 big_request = discover_request[0]
 
-                for request in self._batches(big_request, points_per_request):
-                    
-                    try:
-                        request = ('{} {}'.format(self.properties.address, ''.join(request)))
-                        self._log.debug('RPM_Request: %s ' % request)
-                        val = self.properties.network.readMultiple(request)
-
+                batches = self._packed_batches(big_request, points_per_request)
+                requests = ('{} {}'.format(self.properties.address, ''.join(big_request[batch]))
+                            for batch in batches)
+                try:
+                    for future in self._pipelined(requests, max_in_flight):
+                        val = future.result()
                         #print('val : ', val, len(val), type(val))
                         if val == None:
-                            self.properties.segmentation_supported = False
                             raise SegmentationNotSupported
 
-                    except KeyError as error:
-                        raise Exception('Unknown point name : %s' % error)
-                        
-                    except SegmentationNotSupported as error:
-                        self.properties.segmentation_supported = False
-                        #self.read_multiple(points_list,points_per_request=1, discover_request=discover_request)
-                        self._log.warning('Segmentation not supported')
-                
-                        self._log.warning('Request too big...will reduce it')
-                        if points_per_request == 1:
-                            raise
-                        self.read_multiple(points_list,points_per_request=1, discover_request=discover_request)
-                        
-                    else:
                         for points_info in self._batches(val, info_length):
                             values.append(points_info)
-                return values
 
-            else:
-                big_request = self._rpm_request_by_name(points_list)
-                i = 0
-                for request in self._batches(big_request[0], points_per_request):
-                    try:
-                        request = ('{} {}'.format(self.properties.address, ''.join(request)))
-                        val = self.properties.network.readMultiple(request)
-
-                    except SegmentationNotSupported as error:
+                except KeyError as error:
+                    raise Exception('Unknown point name : %s' % error)
+
+                except SegmentationNotSupported as error:
+                    self._log.warning('Segmentation not supported')
+                    if not self._request_too_big(batches):
                         self.properties.segmentation_supported = False
-                        self.read_multiple(points_list,points_per_request=1, discover_request=discover_request)
+                        raise
+                    return self.read_multiple(points_list, points_per_request=points_per_request, discover_request=discover_request, max_in_flight=max_in_flight)
 
-                    except KeyError as error:
-                        raise Exception('Unknown point name : %s' % error)
+                return values
 
+            else:
+                requests, points = self._rpm_request_by_name(points_list)
+                batches = self._packed_batches(requests, points_per_request)
+                batches_of_requests = ('{} {}'.format(self.properties.address, ''.join(requests[batch]))
+                                       for batch in batches)
+                done = 0
+                try:
+                    for batch, future in zip(batches, self._pipelined(batches_of_requests, max_in_flight)):
+                        val = self._batch_result(future, points[batch])
+                        if val is not None:
+                            for point, value in zip(points[batch], val):
+                                point._trend(value)
+                        done = batch.stop
+
+                except SegmentationNotSupported as error:
+                    if self._request_too_big(batches):
+                        # Points of the batches already read are not read again
+                        self.read_multiple([point.properties.name for point in points[done:]], points_per_request=points_per_request, discover_request=discover_request, max_in_flight=max_in_flight)
                     else:
-                        points_values = zip(big_request[1][i:i + len(val)], val)
-                        i += len(val)
-                        for each in points_values:
-                            each[0]._trend(each[1])
+                        self._log.error('Device refuses to answer even with one point per request')
+
+                except KeyError as error:
+                    raise Exception('Unknown point name : %s' % error)
 
 
     def read_single(self, points_list, *, points_per_request=1, discover_request=(None, 4)):
@@ -210,7 +406,7 @@ class ReadPropertyMultiple():
             analog_request.append('{} {} objectName presentValue units description '.format(analog_points, address))
 
         try:
-            analog_points_info = self.read_multiple('', discover_request=(analog_request, 4), points_per_request=5)
+            analog_points_info = self.read_multiple('', discover_request=(analog_request, 4))
             self._log.info(analog_points_info)
         except SegmentationNotSupported:
             raise
@@ -253,7 +449,7 @@ class ReadPropertyMultiple():
             multistate_request.append('{} {} objectName presentValue stateText description '.format(multistate_points, address))
 
         try:
-            multistate_points_info= self.read_multiple('', discover_request=(multistate_request, 4), points_per_request=5)
+            multistate_points_info= self.read_multiple('', discover_request=(multistate_request, 4))
         except SegmentationNotSupported:
             raise
             
@@ -276,7 +472,7 @@ class ReadPropertyMultiple():
             binary_request.append('{} {} objectName presentValue inactiveText activeText description '.format(binary_points, address))
 
         try:
-            binary_points_info= self.read_multiple('', discover_request=(binary_request, 5), points_per_request=5)
+            binary_points_info= self.read_multiple('', discover_request=(binary_request, 5))
         except SegmentationNotSupported:
             raise
             
@@ -319,7 +515,7 @@ class ReadPropertyMultiple():
         return (objList, points)
 
             
-    def poll(self, command='start', *, delay=10):
+    def poll(self, command='start', *, delay=10, fixed_rate=False):
         """
         Poll a point every x seconds (delay=x sec)
         Can be stopped by using point.poll('stop') or .poll(0) or .poll(False)
@@ -327,6 +523,9 @@ class ReadPropertyMultiple():
 
         :param command: (str) start or stop polling
         :param delay: (int) time delay between polls in seconds
+        :param fixed_rate: (bool) poll on a fixed grid of delay seconds
+                           (ex. 10:00:00, 10:00:10...) whatever the time
+                           taken by the poll
         :type command: str
         :type delay: int
 
@@ -335,6 +534,7 @@ class ReadPropertyMultiple():
         device.poll()
         device.poll('stop')
         device.poll(delay = 5)
+        device.poll(delay = 10, fixed_rate = True)
         """
         if str(command).lower() == 'stop' \
                 or command == False \
@@ -343,26 +543,24 @@ class ReadPropertyMultiple():
 
             if isinstance(self._polling_task.task, DevicePoll):
                 self._polling_task.task.stop()
-                while self._polling_task.task.is_alive():
-                    pass
+                self._polling_task.task.join()
 
                 self._polling_task.task = None
                 self._polling_task.running = False
                 self._log.info('Polling stopped')
                 
         elif self._polling_task.task is None:
-            self._polling_task.task = DevicePoll(self, delay=delay)
+            self._polling_task.task = DevicePoll(self, delay=delay, fixed_rate=fixed_rate)
             self._polling_task.task.start()
             self._polling_task.running = True
             self._log.info('Polling started, values read every {} seconds'.format(delay))
             
         elif self._polling_task.running:
             self._polling_task.task.stop()
-            while self._polling_task.task.is_alive():
-                pass
+            self._polling_task.task.join()
             
             self._polling_task.running = False
-            self._polling_task.task = DevicePoll(self, delay=delay)
+            self._polling_task.task = DevicePoll(self, delay=delay, fixed_rate=fixed_rate)
             self._polling_task.task.start()
             self._polling_task.running = True
             self._log.info('Polling started, every values read each %s seconds' % delay)
@@ -519,7 +717,7 @@ class ReadProperty():
         return (objList, points)
 
             
-    def poll(self, command='start', *, delay=60):
+    def poll(self, command='start', *, delay=60, fixed_rate=False):
         """
         Poll a point every x seconds (delay=x sec)
         Can be stopped by using point.poll('stop') or .poll(0) or .poll(False)
@@ -539,5 +737,6 @@ class ReadProperty():
         self._log.warning('Device too slow, use single points polling if needed')
         self._log.warning('Points will be read once...')
         for each in self.points:
-            each.value
+            if each.properties.name not in self._cov_subscriptions:
+                each.value
         self._log.info('Complete')
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+simulate_mixin.py - Simulate or release many points of a device at once
+'''
+#--- standard Python modules ---
+#--- 3rd party modules ---
+#--- this application's modules ---
+from ..Points import Point
+
+#------------------------------------------------------------------------------
+
+
+class SimulateMultiple():
+    """
+    Set outOfService and simulate the value of many points with a few
+    requests (see write_many) instead of two writes and a read per point.
+    """
+
+    def out_of_service_many(self, points):
+        """
+        Set the Out_Of_Service property of points to True
+
+        :param points: (list) point names (or points)
+        :returns: (list) names of the points that could not be written
+        """
+        points = self._find_points(points)
+        failed = self.write_many({point.properties.name: 'True' for point in points},
+                                 prop='outOfService')
+        for point in points:
+            if point.properties.name not in failed:
+                point.properties.simulated = (True, None)
+        return failed
+
+
+    def sim_many(self, values, *, force=False):
+        """
+        Simulate the value of points : Out_Of_Service is set for the points
+        not simulated yet, then Present_Values are written.
+
+        :param values: (dict) {point name (or point): value}
+        :param force: (boolean) write values already simulated
+        :returns: (list) names of the points that could not be written
+
+        :Example:
+
+        device.sim_many({'ZN-T': 21.5, 'OA-T': -10, 'Fan-S': True})
+        """
+        simulate = {}
+        for name, value in values.items():
+            point = name if isinstance(name, Point) else self._findPoint(name, force_read=False)
+            if force or point.properties.simulated != (True, value):
+                simulate[point.properties.name] = (point, value)
+
+        failed = self.out_of_service_many(
+            [point for point, value in simulate.values() if not point.properties.simulated[0]])
+        for name in failed:
+            del simulate[name]
+        failed.extend(self.write_many({name: value for name, (point, value) in simulate.items()}))
+        for name, (point, value) in simulate.items():
+            if name not in failed:
+                point.properties.simulated = (True, value)
+        return failed
+
+
+    def release_all(self, points=None):
+        """
+        Set the Out_Of_Service property of points back to False so the
+        controller regains control of them. Points are then read.
+
+        :param points: (list) point names (or points). None = every
+                       simulated point.
+        :returns: (list) names of the points that could not be written
+        """
+        points = list(self.simulated_points) if points is None else self._find_points(points)
+        failed = self.write_many({point.properties.name: 'False' for point in points},
+                                 prop='outOfService')
+        released = [point for point in points if point.properties.name not in failed]
+        for point in released:
+            point.properties.simulated = (False, None)
+        self._verify(released)
+        return failed
+
+
+    def _find_points(self, points):
+        if isinstance(points, (str, Point)):
+            points = [points]
+        return [each if isinstance(each, Point) else self._findPoint(each, force_read=False)
+                for each in points]
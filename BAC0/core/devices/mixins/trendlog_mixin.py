@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+trendlog_mixin.py - Retrieve the trend logs kept by a device
+'''
+#--- standard Python modules ---
+#--- 3rd party modules ---
+try:
+    import pandas as pd
+    _PANDAS = True
+except ImportError:
+    _PANDAS = False
+
+#--- this application's modules ---
+from ...io.IOExceptions import NoResponseFromController, UnknownObjectError, UnknownPropertyError
+from ...utils.apdu_size import records_per_request
+from ..Points import Point, BooleanPoint, EnumPoint
+
+#------------------------------------------------------------------------------
+
+
+def _log_value(point, value):
+    """
+    Value of a trend log record as the point would have read it
+    """
+    if value is None:
+        return None
+    try:
+        if isinstance(point, BooleanPoint):
+            return 'active' if int(value) else 'inactive'
+        if isinstance(point, EnumPoint):
+            return int(value)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+class TrendLogs():
+    """
+    Read the trend logs of a device (ReadRange) to fill the histories of the
+    points with the readings recorded by the controller, ex. while BAC0 was
+    not running.
+    """
+
+    @property
+    def trend_logs(self):
+        """
+        returns: (dict) {point name: trendLog instance} of the trend logs
+                 recording the presentValue of a point of the device
+        """
+        if self._trend_logs is None:
+            self._trend_logs = self._discover_trend_logs()
+        return self._trend_logs
+
+
+    def _discover_trend_logs(self):
+        network = self.properties.network
+        futures = []
+        for obj_type, obj_inst in self.properties.objects_list:
+            if obj_type == 'trendLog':
+                futures.append((obj_inst, network.read_async('{} trendLog {} logDeviceObjectProperty'.format(
+                    self.properties.address, obj_inst))))
+
+        trend_logs = {}
+        for obj_inst, future in futures:
+            try:
+                reference = future.result()
+            except (NoResponseFromController, UnknownObjectError, UnknownPropertyError) as error:
+                self._log.warning('Unable to read trendLog {} : {}'.format(obj_inst, error))
+                continue
+            if not reference or reference.propertyIdentifier != 'presentValue':
+                continue
+            # Trend logs can record objects of other devices
+            if reference.deviceIdentifier is not None \
+                    and reference.deviceIdentifier[1] != self.properties.device_id:
+                continue
+            try:
+                point = self._findPointById(*reference.objectIdentifier)
+            except ValueError:
+                continue
+            trend_logs[point.properties.name] = obj_inst
+        return trend_logs
+
+
+    def read_trend_log(self, point, *, start=None, end=None):
+        """
+        Read the records of the trend log of a point
+
+        :param point: (str or Point)
+        :param start: (datetime) only records taken after start
+        :param end: (datetime) only records taken up to end
+        :returns: (pd.Series) values as the point would have read them
+        """
+        if not isinstance(point, Point):
+            point = self._findPoint(point, force_read=False)
+        try:
+            instance = self.trend_logs[point.properties.name]
+        except KeyError:
+            raise ValueError('No trend log for {}'.format(point.properties.name))
+
+        timestamps = []
+        values = []
+        page_size = records_per_request(self.properties.max_apdu_length,
+                                        self.properties.segmentation_supported)
+        for page in self.properties.network.read_log(
+                '{} trendLog {}'.format(self.properties.address, instance),
+                start=start, end=end, page_size=page_size):
+            for timestamp, value in page:
+                timestamps.append(timestamp)
+                values.append(_log_value(point, value))
+        if not _PANDAS:
+            return dict(zip(timestamps, values))
+        return pd.Series(values, index=pd.DatetimeIndex(timestamps), name=point.properties.name,
+                         dtype=point._history_dtype)
+
+
+    def backfill(self, points=None, *, start=None, end=None, save=False):
+        """
+        Merge the records of the trend logs in the histories of the points.
+        Readings already in a history are kept.
+
+        :param points: (list) point names (or points). None = every point
+                       having a trend log.
+        :param start: (datetime) only records taken after start
+        :param end: (datetime) only records taken up to end
+        :param save: (boolean) also write the records to the SQLite database
+        :returns: (dict) {point name: number of readings added}
+
+        :Example:
+
+        device.backfill(start=datetime.now() - timedelta(days=1), save=True)
+        """
+        if points is None:
+            points = list(self.trend_logs)
+        elif isinstance(points, (str, Point)):
+            points = [points]
+
+        added = {}
+        histories = {}
+        for each in points:
+            point = each if isinstance(each, Point) else self._findPoint(each, force_read=False)
+            name = point.properties.name
+            if name not in self.trend_logs:
+                self._log.warning('No trend log for {}'.format(name))
+                continue
+            his = self.read_trend_log(point, start=start, end=end)
+            added[name] = point._merge(list(his.index), list(his.values))
+            histories[name] = his
+
+        if save:
+            self.save_backfill(histories)
+        return added
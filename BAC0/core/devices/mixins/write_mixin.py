@@ -0,0 +1,356 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+write_mixin.py - Add WritePropertyMultiple to a device
+'''
+#--- standard Python modules ---
+from contextlib import contextmanager
+
+#--- 3rd party modules ---
+#--- this application's modules ---
+from ....tasks.WriteQueue import WriteQueueDrain
+from ...io.Futures import pipelined
+from ...io.IOExceptions import NoResponseFromController, UnrecognizedService, \
+    SegmentationNotSupported, WritePropertyException, WritePropertyCastError, \
+    WritePropertyMultipleException
+from ...utils.apdu_size import packed_slices, wpm_size
+from ..Points import Point, BooleanPoint, EnumPoint
+from .read_mixin import ReadPropertyMultiple
+
+#------------------------------------------------------------------------------
+
+
+def _write_value(point, value):
+    """
+    Value as written by point[...] = value (True for a binary point, state
+    text for a multistate point...)
+    """
+    if isinstance(value, Point):
+        value = value.lastValue
+    if isinstance(point, BooleanPoint) and isinstance(value, bool):
+        return 'active' if value else 'inactive'
+    if isinstance(point, EnumPoint) and isinstance(value, str) \
+            and value in (point.properties.units_state or []):
+        return point.properties.units_state.index(value) + 1
+    return value
+
+
+def _refused_write(writes, prop, error):
+    """
+    Index in writes (all to prop) of the write refused by the device, as
+    told by a WritePropertyMultipleException (None if unknown)
+    """
+    try:
+        (obj_type, obj_inst), refused_prop = error.args[1]
+    except (IndexError, TypeError, ValueError):
+        return None
+    if str(refused_prop) != prop:
+        return None
+    for i, (point, value, request) in enumerate(writes):
+        if point.properties.type == obj_type and int(point.properties.address) == obj_inst:
+            return i
+    return None
+
+
+class WritePropertyMultiple():
+    """
+    Write many points of a device at once. Writes are grouped in
+    WritePropertyMultiple requests filled up to the size the device accepts.
+    Devices not supporting WritePropertyMultiple get WriteProperty requests,
+    sent without waiting for each answer.
+
+    Points are read after being written so their history is updated. With
+    device.properties.verify_writes = 'deferred', or inside batch_writes(),
+    points written wait in pending_writes and are confirmed by the next
+    reading (poll) or all together by confirm_writes().
+
+    Writes made with queue_write wait a little in a queue where a newer
+    value for the same property replaces the older one, then are sent
+    together by a single task.
+    """
+
+    def write_many(self, values, *, priority=None, prop='presentValue', read_back=True):
+        """
+        Write to many points
+
+        :param values: (dict) {point name (or point): value}. 'null'
+                       relinquishes the priority.
+        :param priority: (int) priority (1-16) of the writes
+        :param prop: (str) property to write. Default = presentValue
+        :param read_back: (boolean) read the points written (in one batch)
+                          so histories get updated
+        :returns: (list) names of the points that could not be written
+
+        :Example:
+
+        device.write_many({'SP-1': 21, 'SP-2': 22.5, 'Fan-C': True}, priority=8)
+        """
+        if priority is not None and not 1 <= int(priority) <= 16:
+            raise ValueError('Priority must be a number between 1 and 16')
+
+        writes = []
+        for name, value in values.items():
+            point = name if isinstance(name, Point) else self._findPoint(name, force_read=False)
+            value = _write_value(point, value)
+            writes.append((point, value, self._write_request(point, prop, value, priority)))
+
+        if self.properties.pss['writePropertyMultiple']:
+            failed = self._write_multiple(writes, prop, priority)
+        else:
+            failed = self._write_pipelined(writes)
+
+        if read_back and prop == 'presentValue':
+            self._verify([point for point, value, request in writes
+                          if point.properties.name not in failed])
+        return failed
+
+
+    @contextmanager
+    def batch_writes(self):
+        """
+        Points written inside the block are read together when it ends (one
+        batched read) instead of being read after each write.
+        Blocks can be nested, points are read when the outermost one ends.
+        Only the writes made by the thread running the block wait for its
+        end (writes made meanwhile by the poll or other threads don't).
+
+        :Example:
+
+        with device.batch_writes():
+            for name in setpoints:
+                device[name].ovr(21)
+        """
+        batches = self._write_batches
+        batches.depth = getattr(batches, 'depth', 0) + 1
+        try:
+            yield self
+        finally:
+            batches.depth -= 1
+            if not batches.depth:
+                self.confirm_writes()
+
+
+    @property
+    def pending_writes(self):
+        """
+        returns: (list) names of the points written and not read since
+        """
+        return list(self._pending_writes)
+
+
+    def confirm_writes(self):
+        """
+        Read every point written and not read since, in as few requests as
+        possible
+        """
+        pending, self._pending_writes = self._pending_writes, {}
+        self._read_back(list(pending.values()))
+
+
+    def queue_write(self, point, value, *, prop='presentValue', priority=None):
+        """
+        Write to a point through the write queue of the device. Writes wait
+        properties.write_delay seconds then are sent together (see
+        write_many). Meanwhile, a new value for the same property of the
+        same object at the same priority replaces the one waiting : a loop
+        writing a point over and over only sends the latest value.
+
+        :param point: (str or Point)
+        :param value: value, as for write_many
+        :param prop: (str) property to write. Default = presentValue
+        :param priority: (int) priority (1-16) of the write
+
+        :Example:
+
+        device.queue_write('SP-1', 21, priority=8)
+        """
+        if priority is not None and not 1 <= int(priority) <= 16:
+            raise ValueError('Priority must be a number between 1 and 16')
+        if not isinstance(point, Point):
+            point = self._findPoint(point, force_read=False)
+        key = (point.properties.type, point.properties.address, prop, priority)
+
+        with self._write_queue_lock:
+            if key in self._write_queue:
+                self._log.debug('{} : {} replaced by {}'.format(
+                    point.properties.name, self._write_queue[key][1], value))
+            self._write_queue[key] = (point, value)
+            if self._write_drain_scheduled:
+                return
+            self._write_drain_scheduled = True
+            if self._write_drain is None:
+                self._write_drain = WriteQueueDrain(self, self.properties.write_delay)
+        self._write_drain.start()
+
+
+    @property
+    def queued_writes(self):
+        """
+        returns: (list) (point name, property, priority, value) of the writes
+                 waiting in the queue
+        """
+        with self._write_queue_lock:
+            return [(point.properties.name, prop, priority, value)
+                    for (obj_type, obj_inst, prop, priority), (point, value)
+                    in self._write_queue.items()]
+
+
+    def flush_writes(self):
+        """
+        Send the writes waiting in the queue now, grouped by property and
+        priority. outOfService is written first so simulated values are
+        accepted.
+
+        :returns: (list) names of the points that could not be written
+        """
+        with self._write_queue_lock:
+            queue, self._write_queue = self._write_queue, {}
+            self._write_drain_scheduled = False
+
+        groups = {}
+        for (obj_type, obj_inst, prop, priority), (point, value) in queue.items():
+            groups.setdefault((prop, priority), {})[point.properties.name] = value
+        failed = []
+        for prop, priority in sorted(groups, key=lambda group: group[0] != 'outOfService'):
+            failed.extend(self.write_many(groups[(prop, priority)], prop=prop, priority=priority))
+        return failed
+
+
+    def _verify(self, points):
+        """
+        Read points just written, now or later (see batch_writes)
+        """
+        if self._defer_verification():
+            for point in points:
+                self._pending_writes[point.properties.name] = point
+        else:
+            self._read_back(points)
+
+
+    def _defer_verification(self):
+        return getattr(self._write_batches, 'depth', 0) > 0 \
+            or self.properties.verify_writes == 'deferred'
+
+
+    def _queue_verification(self, point):
+        """
+        Called by Point.write. True if the point will be read later.
+        """
+        if not self._defer_verification():
+            return False
+        self._pending_writes[point.properties.name] = point
+        return True
+
+
+    def _write_request(self, point, prop, value, priority=None):
+        """
+        Write request string without the address
+        (<type> <inst> <prop> <value> [ - <priority> ])
+        """
+        request = '{} {} {} {}'.format(point.properties.type, point.properties.address,
+                                       prop, value)
+        if priority is not None:
+            request += ' - {}'.format(int(priority))
+        return request
+
+
+    def _write_multiple(self, writes, prop, priority=None):
+        """
+        Send writes in WritePropertyMultiple requests. When the device refuses
+        a write, the writes before it are done : the point refused fails and
+        only the writes after it are sent again. Requests refused without
+        telling which write failed are sent again as WriteProperty requests
+        to find which points fail.
+
+        :param writes: (list) of (point, value, write request string)
+        :returns: (list) names of the points that could not be written
+        """
+        network = self.properties.network
+        address = self.properties.address
+        sizes = [(wpm_size(prop, priority, value), 0) for point, value, request in writes]
+        max_apdu = self.properties.max_apdu_length
+        batches = list(packed_slices(sizes, max_apdu, max_apdu))
+        max_in_flight = max(1, int(self.properties.max_in_flight))
+
+        failed = []
+        retry = []
+        rest = []
+        for batch, future in zip(batches, pipelined(
+                batches, lambda batch: network.writeMultiple_async(
+                    address, [request for point, value, request in writes[batch]]),
+                max_in_flight)):
+            try:
+                future.result()
+            except WritePropertyMultipleException as error:
+                refused = _refused_write(writes[batch], prop, error)
+                if refused is None:
+                    self._log.debug('WritePropertyMultiple refused ({}), will use WriteProperty'.format(error))
+                    retry.extend(writes[batch])
+                    continue
+                point = writes[batch][refused][0]
+                self._log.warning('Unable to write {} : {}'.format(point.properties.name, error))
+                failed.append(point.properties.name)
+                rest.extend(writes[batch][refused + 1:])
+            except UnrecognizedService:
+                self._log.warning('WritePropertyMultiple not supported, will use WriteProperty')
+                self.properties.pss['writePropertyMultiple'] = 0
+                retry.extend(writes[batch])
+            except (SegmentationNotSupported, WritePropertyException, WritePropertyCastError,
+                    ValueError, TypeError) as error:
+                # Refused or not built : WriteProperty requests tell which points fail
+                self._log.debug('WritePropertyMultiple refused ({}), will use WriteProperty'.format(error))
+                retry.extend(writes[batch])
+            except NoResponseFromController:
+                self._log.warning('No answer to WritePropertyMultiple')
+                failed.extend(point.properties.name for point, request in writes[batch])
+        if rest:
+            failed.extend(self._write_multiple(rest, prop, priority))
+        if retry:
+            failed.extend(self._write_pipelined(retry))
+        return failed
+
+
+    def _write_pipelined(self, writes):
+        """
+        Send writes in WriteProperty requests, up to max_in_flight at a time
+
+        :param writes: (list) of (point, value, write request string)
+        :returns: (list) names of the points that could not be written
+        """
+        network = self.properties.network
+        address = self.properties.address
+        max_in_flight = max(1, int(self.properties.max_in_flight))
+
+        failed = []
+        for (point, value, request), future in zip(writes, pipelined(
+                writes, lambda write: network.write_async('{} {}'.format(address, write[2])),
+                max_in_flight)):
+            if future.exception() is not None:
+                self._log.warning('Unable to write {} : {}'.format(
+                    point.properties.name, future.exception()))
+                failed.append(point.properties.name)
+        return failed
+
+
+    def _read_back(self, points):
+        """
+        Read the presentValue of points just written, in as few requests as possible
+        """
+        if not points:
+            return
+        if isinstance(self, ReadPropertyMultiple):
+            self.read_multiple([point.properties.name for point in points])
+            return
+
+        network = self.properties.network
+        max_in_flight = max(1, int(self.properties.max_in_flight))
+        for point, future in zip(points, pipelined(
+                points, lambda point: network.read_async('{} {} {} presentValue'.format(
+                    self.properties.address, point.properties.type, point.properties.address)),
+                max_in_flight)):
+            if future.exception() is None:
+                point._trend(future.result())
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+COV.py - creation of SubscribeCOV requests and reception of COV notifications
+
+    Used while defining an app
+    Example::
+
+        class BasicScript(WhoisIAm, ReadProperty, SubscribeCOV)
+
+    Class::
+
+        SubscribeCOV()
+            def subscribe_cov()
+            def subscribe_cov_async()
+            def unsubscribe_cov()
+
+'''
+#--- standard Python modules ---
+import itertools
+
+#--- 3rd party modules ---
+from bacpypes.pdu import Address
+from bacpypes.object import get_datatype
+from bacpypes.apdu import SubscribeCOVRequest, SimpleAckPDU
+from bacpypes.primitivedata import Unsigned
+from bacpypes.constructeddata import Array
+from bacpypes.iocb import IOCB
+from bacpypes.core import deferred
+
+#--- this application's modules ---
+from .IOExceptions import COVSubscriptionError, NoResponseFromController, UnrecognizedService, ApplicationNotStarted
+from .Futures import IOCBFuture
+from .Read import find_reason
+from ..utils.notes import note_and_log
+
+#------------------------------------------------------------------------------
+
+
+@note_and_log
+class SubscribeCOV():
+    """
+    Defines BACnet SubscribeCOV. Notifications received for a subscription
+    are decoded and passed to the callback given when subscribing.
+    """
+
+    def _cov_state(self):
+        if not hasattr(self, '_cov_callbacks'):
+            self._cov_callbacks = {}
+            self._cov_process_ids = itertools.count(1)
+        self.this_application.cov_handler = self._cov_notification
+
+    def subscribe_cov(self, args, *, lifetime=300, confirmed=False, callback=None,
+                      process_id=None):
+        """
+        Subscribe to the changes of value of an object and wait for the answer.
+
+        :param args: String with <addr> <type> <inst>
+        :param lifetime: (int) seconds before the subscription expires.
+                         None = never expires.
+        :param confirmed: (bool) ask for confirmed notifications
+        :param callback: function(object_identifier, values) called for each
+                         notification. values is a dict {property: value}.
+                         Called from the BACnet stack thread : must not block.
+        :param process_id: (int) identifier of a subscription to renew
+        :returns: (int) process identifier of the subscription
+
+        *Example*::
+
+            bacnet.subscribe_cov('2:5 analogInput 1', lifetime=600,
+                                 callback=lambda oid, values: print(oid, values))
+        """
+        return self.subscribe_cov_async(args, lifetime=lifetime, confirmed=confirmed,
+                                        callback=callback, process_id=process_id).result()
+
+    def subscribe_cov_async(self, args, *, lifetime=300, confirmed=False, callback=None,
+                            process_id=None):
+        """
+        Build a SubscribeCOV request and return immediately without waiting
+        for the answer. See subscribe_cov.
+
+        :returns: (IOCBFuture) future holding the process identifier
+        """
+        if not self._started:
+            raise ApplicationNotStarted(
+                'BACnet stack not running - use startApp()')
+        self._cov_state()
+        if process_id is None:
+            process_id = next(self._cov_process_ids)
+        self._cov_callbacks[process_id] = callback
+
+        request = self.build_cov_request(args.split(), process_id,
+                                         lifetime=lifetime, confirmed=confirmed)
+        iocb = IOCB(request)
+        future = IOCBFuture(iocb, lambda iocb: self._cov_response(iocb, args, process_id))
+        deferred(self.this_application.request_io, iocb)
+        self._log.debug("{:<20} {!r}".format('iocb', iocb))
+        return future
+
+    def unsubscribe_cov(self, args, process_id):
+        """
+        Cancel a subscription
+
+        :param args: String with <addr> <type> <inst>
+        :param process_id: (int) as returned by subscribe_cov
+        """
+        self._cov_state()
+        self._cov_callbacks.pop(process_id, None)
+        request = self.build_cov_request(args.split(), process_id, cancel=True)
+        iocb = IOCB(request)
+        deferred(self.this_application.request_io, iocb)
+        iocb.wait()
+        if iocb.ioError:
+            self._log.warning('Unable to cancel COV subscription {} : {}'.format(
+                args, iocb.ioError))
+
+    def build_cov_request(self, args, process_id, *, lifetime=None, confirmed=False,
+                          cancel=False):
+        addr, obj_type, obj_inst = args[:3]
+        if obj_type.isdigit():
+            obj_type = int(obj_type)
+        request = SubscribeCOVRequest(subscriberProcessIdentifier=process_id,
+                                      monitoredObjectIdentifier=(obj_type, int(obj_inst)))
+        # Without issueConfirmedNotifications and lifetime, the request is
+        # a cancellation
+        if not cancel:
+            request.issueConfirmedNotifications = confirmed
+            if lifetime:
+                request.lifetime = int(lifetime)
+        request.pduDestination = Address(addr)
+        self._log.debug("{:<20} {}".format("REQUEST", request))
+        return request
+
+    def _cov_response(self, iocb, args, process_id):
+        """
+        Decode the answer to a SubscribeCOV request.
+        Called by the stack when the IOCB completes.
+        """
+        if iocb.ioResponse and isinstance(iocb.ioResponse, SimpleAckPDU):
+            return process_id
+
+        self._cov_callbacks.pop(process_id, None)
+        apdu = iocb.ioError
+        if not hasattr(apdu, 'pduType'):
+            raise NoResponseFromController('No answer to COV subscription {}'.format(args))
+        reason = find_reason(apdu)
+        if reason == 'unrecognizedService':
+            raise UnrecognizedService('SubscribeCOV not supported by {}'.format(args))
+        raise COVSubscriptionError('COV subscription refused for {} : {}'.format(args, reason))
+
+    def _cov_notification(self, apdu):
+        """
+        Decode a COV notification and pass the values to the callback of
+        the subscription. Called by the application (stack thread).
+        """
+        callback = getattr(self, '_cov_callbacks', {}).get(apdu.subscriberProcessIdentifier)
+        if callback is None:
+            return
+        obj_type = apdu.monitoredObjectIdentifier[0]
+        values = {}
+        for element in apdu.listOfValues:
+            prop_id = element.propertyIdentifier
+            datatype = get_datatype(obj_type, prop_id)
+            if not datatype:
+                continue
+            if issubclass(datatype, Array) and element.propertyArrayIndex is not None:
+                if element.propertyArrayIndex == 0:
+                    datatype = Unsigned
+                else:
+                    datatype = datatype.subtype
+            try:
+                values[prop_id] = element.value.cast_out(datatype)
+            except Exception as error:
+                self._log.warning('Unable to decode {} in COV notification : {}'.format(
+                    prop_id, error))
+        try:
+            callback(apdu.monitoredObjectIdentifier, values)
+        except Exception as error:
+            self._log.error('COV callback failed : {}'.format(error))
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+Futures.py - wrap bacpypes IOCB in futures so requests don't need to block
+
+    Used by the *_async services::
+
+        future = bacnet.read_async('2:5 analogInput 1 presentValue')
+        value = future.result()             # from a thread
+        value = await future                # from a coroutine
+
+'''
+#--- standard Python modules ---
+import asyncio
+from collections import deque
+from concurrent.futures import Future, wait
+
+#--- 3rd party modules ---
+from bacpypes.core import deferred
+
+#--- this application's modules ---
+from .IOExceptions import NoResponseFromController
+
+#------------------------------------------------------------------------------
+
+# Seconds pipelined() waits for the answer to a request
+REQUEST_TIMEOUT = 10
+
+
+class AwaitableFuture(Future):
+    """
+    A concurrent.futures.Future that can also be awaited from a coroutine.
+    """
+
+    def __await__(self):
+        """
+        Allows the syntax:
+            value = await bacnet.read_async(...)
+        """
+        return asyncio.wrap_future(self).__await__()
+
+    __iter__ = __await__
+
+
+class IOCBFuture(AwaitableFuture):
+    """
+    A concurrent.futures.Future completed by the BACnet stack when the IOCB
+    it wraps gets its answer.
+
+    :param iocb: (bacpypes.iocb.IOCB) the request sent to the stack
+    :param process: (callable) function receiving the completed IOCB and
+                    returning the decoded value (or raising)
+
+    The processing function is executed in the stack thread, as soon as
+    the answer is received, so it must never block.
+    """
+
+    def __init__(self, iocb, process):
+        AwaitableFuture.__init__(self)
+        self.iocb = iocb
+        self._process = process
+        self.set_running_or_notify_cancel()
+        iocb.add_callback(self._iocb_complete)
+
+    def _iocb_complete(self, iocb):
+        try:
+            result = self._process(iocb)
+        except Exception as error:
+            self.set_exception(error)
+        else:
+            self.set_result(result)
+
+    def abort(self, error):
+        """
+        Give up waiting for the answer. The stack drops the IOCB (in its
+        thread, before any request sent after this call).
+        """
+        deferred(self.iocb.abort, error)
+
+
+def failed_future(error):
+    """
+    Future holding an exception, for a request that could not be built.
+    Callers waiting for many futures see the error like any other failure.
+    """
+    future = AwaitableFuture()
+    future.set_exception(error)
+    return future
+
+
+def pipelined(requests, send, max_in_flight, timeout=REQUEST_TIMEOUT):
+    """
+    Generator sending requests while keeping up to max_in_flight of them
+    waiting for an answer.
+
+    :param requests: iterable of requests
+    :param send: function sending a request and returning a future
+    :param max_in_flight: (int) requests sent before waiting for the first answer
+    :param timeout: (float) seconds to wait for an answer. A request still
+                    unanswered after that is aborted, so it doesn't stay in
+                    flight, and yielded as a failed future
+                    (NoResponseFromController). None waits forever.
+    :returns: (iter) completed futures, in the order of the requests
+    """
+    in_flight = deque()
+    for request in requests:
+        in_flight.append(send(request))
+        if len(in_flight) >= max_in_flight:
+            yield _completed(in_flight.popleft(), timeout)
+    while in_flight:
+        yield _completed(in_flight.popleft(), timeout)
+
+
+def _completed(future, timeout):
+    done, not_done = wait([future], timeout=timeout)
+    if not_done:
+        error = NoResponseFromController('No answer after {} seconds'.format(timeout))
+        if isinstance(future, IOCBFuture):
+            future.abort(error)
+        else:
+            future.cancel()
+        return failed_future(error)
+    return future
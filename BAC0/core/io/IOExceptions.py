@@ -16,6 +16,15 @@ class WritePropertyException(Exception):
     pass
 
 
+class WritePropertyMultipleException(WritePropertyException):
+    """
+    This exception is used when a WritePropertyMultiple request is refused.
+    args[1] is the (object identifier, property) of the first write refused
+    (None if unknown). Writes before it were done.
+    """
+    pass
+
+
 class WritePropertyCastError(Exception):
     """
     This exception is used when trying to write to a property and a cast error occurs.
@@ -45,6 +54,13 @@ class ReadPropertyMultipleException(ValueError):
     pass
 
 
+class ReadRangeException(ValueError):
+    """
+    This exception is used when a ReadRange request is refused.
+    """
+    pass
+
+
 class NoResponseFromController(Exception):
     """
     This exception is used when trying to read or write and there is not answer.
@@ -66,6 +82,13 @@ class WriteAccessDenied(Exception):
     pass
 
 
+class COVSubscriptionError(Exception):
+    """
+    This exception is used when a device refuses a COV subscription.
+    """
+    pass
+
+
 class APDUError(Exception):
     pass
 
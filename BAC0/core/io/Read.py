@@ -17,11 +17,15 @@ Read.py - creation of ReadProperty and ReadPropertyMultiple requests
 
         ReadProperty()
             def read()
+            def read_async()
             def readMultiple()
+            def readMultiple_async()
+            def send_rpm_request()
 
 '''
 
 #--- standard Python modules ---
+import logging
 
 #--- 3rd party modules ---
 from bacpypes.debugging import bacpypes_debugging
@@ -41,6 +45,7 @@ from bacpypes.core import deferred
 #--- this application's modules ---
 from .IOExceptions import ReadPropertyException, ReadPropertyMultipleException, NoResponseFromController, ApplicationNotStarted, UnrecognizedService, SegmentationNotSupported, UnknownPropertyError, UnknownObjectError
 
+from .Futures import IOCBFuture, failed_future
 from ..utils.notes import note_and_log
 #------------------------------------------------------------------------------
 
@@ -70,14 +75,46 @@ class ReadProperty():
         Requests the controller at (Network 2, address 5) for the presentValue of
         its analog input 1 (AI:1).
         """
+        try:
+            return self.read_async(args, arr_index=arr_index,
+                                   vendor_id=vendor_id, bacoid=bacoid).result()
+
+        except SegmentationNotSupported:
+            self._log.warning(
+                "Segmentation not supported... will read properties one by one...")
+            self._log.debug("The Request was : {}".format(args.split()))
+            return self._split_the_read_request(args, arr_index)
+
+    def read_async(self, args, arr_index=None, vendor_id=0, bacoid=None):
+        """
+        Build a ReadProperty request and return immediately without waiting
+        for the answer.
+
+        :param args: String with <addr> <type> <inst> <prop> [ <indx> ]
+        :returns: (IOCBFuture) future holding the value read from device
+
+        The future can be used from a thread or awaited from a coroutine.
+
+        *Example*::
+
+            futures = [bacnet.read_async('{} analogInput 1 presentValue'.format(addr))
+                       for addr in addresses]
+            values = [future.result() for future in futures]
+
+            # or, inside a coroutine
+            value = await bacnet.read_async('2:5 analogInput 1 presentValue')
+
+        A segmentationNotSupported answer is raised as SegmentationNotSupported,
+        splitting the request is left to the caller (see read()).
+        """
         if not self._started:
             raise ApplicationNotStarted(
                 'BACnet stack not running - use startApp()')
 
         args_split = args.split()
-        
+
         self.log_title("Read property",args_split)
-                       
+
         vendor_id = vendor_id
         bacoid = bacoid
 
@@ -85,16 +122,24 @@ class ReadProperty():
             # build ReadProperty request
             iocb = IOCB(self.build_rp_request(
                 args_split, arr_index=arr_index, vendor_id=vendor_id, bacoid=bacoid))
+            future = IOCBFuture(iocb, lambda iocb: self._read_response(
+                iocb, args, vendor_id=vendor_id))
             # pass to the BACnet stack
             deferred(self.this_application.request_io, iocb)
             self._log.debug("{:<20} {!r}".format('iocb', iocb))
 
-        except ReadPropertyException as error:
+        except (ReadPropertyException, ValueError, TypeError) as error:
             # construction error
             self._log.exception("exception: {!r}".format(error))
+            return failed_future(error)
 
-        iocb.wait()             # Wait for BACnet response
+        return future
 
+    def _read_response(self, iocb, args, vendor_id=0):
+        """
+        Decode the answer to a ReadProperty request.
+        Called by the stack when the IOCB completes.
+        """
         if iocb.ioResponse:     # successful response
             apdu = iocb.ioResponse
 
@@ -132,11 +177,7 @@ class ReadProperty():
             apdu = iocb.ioError
             reason = find_reason(apdu)
             if reason == 'segmentationNotSupported':
-                self._log.warning(
-                    "Segmentation not supported... will read properties one by one...")
-                self._log.debug("The Request was : {}".format(args_split))
-                value = self._split_the_read_request(args, arr_index)
-                return value
+                raise SegmentationNotSupported()
             else:
                 if reason == 'unknownProperty':
                     self._log.warning('Unknown property {}'.format(args))
@@ -189,27 +230,72 @@ class ReadProperty():
         Requests the controller at (Network 2, address 5) for the (presentValue and units) of
         its analog input 1 (AI:1).
         """
+        return self.readMultiple_async(args).result()
+
+    def readMultiple_async(self, args):
+        """
+        Build a ReadPropertyMultiple request and return immediately without
+        waiting for the answer.
+
+        :param args: String with <addr> ( <type> <inst> ( <prop> [ <indx> ] )... )...
+        :returns: (IOCBFuture) future holding the list of values read from device
+
+        *Example*::
+
+            futures = [bacnet.readMultiple_async(request) for request in requests]
+            for future in futures:
+                print(future.result())
+        """
         if not self._started:
             raise ApplicationNotStarted(
                 'BACnet stack not running - use startApp()')
 
         args = args.split()
-        values = []
 
         self.log_title("Read Multiple",args)
 
         try:
             # build an ReadPropertyMultiple request
-            iocb = IOCB(self.build_rpm_request(args))
-            # pass to the BACnet stack
-            deferred(self.this_application.request_io, iocb)
-            self._log.debug("{:<20} {!r}".format('iocb', iocb))
+            future = self.send_rpm_request(self.build_rpm_request(args), args=args)
 
-        except ReadPropertyMultipleException as error:
+        except (ReadPropertyMultipleException, ValueError, TypeError) as error:
             # construction error
             self._log.exception("exception: {!r}".format(error))
+            return failed_future(error)
+
+        return future
+
+    def send_rpm_request(self, request, *, datatypes=None, args=None):
+        """
+        Send an already built ReadPropertyMultipleRequest and return immediately.
+        Used when the same objects are read over and over (ex. device polling)
+        so requests don't need to be rebuilt from strings each time.
+
+        :param request: (ReadPropertyMultipleRequest) with pduDestination set
+        :param datatypes: (dict) optional {(objectType, propertyIdentifier): datatype}
+                          to skip datatype lookup when decoding the answer
+        :param args: used in logs and error messages
+        :returns: (IOCBFuture) future holding the list of values read
+        """
+        if not self._started:
+            raise ApplicationNotStarted(
+                'BACnet stack not running - use startApp()')
 
-        iocb.wait()             # Wait for BACnet response
+        iocb = IOCB(request)
+        future = IOCBFuture(iocb, lambda iocb: self._read_multiple_response(
+            iocb, args, datatypes=datatypes))
+        # pass to the BACnet stack
+        deferred(self.this_application.request_io, iocb)
+        self._log.debug("{:<20} {!r}".format('iocb', iocb))
+        return future
+
+    def _read_multiple_response(self, iocb, args, datatypes=None):
+        """
+        Decode the answer to a ReadPropertyMultiple request.
+        Called by the stack when the IOCB completes.
+        """
+        values = []
+        verbose = self._log.isEnabledFor(logging.INFO)
 
         if iocb.ioResponse:     # successful response
             apdu = iocb.ioResponse
@@ -223,16 +309,17 @@ class ReadProperty():
             for result in apdu.listOfReadAccessResults:
                 # here is the object identifier
                 objectIdentifier = result.objectIdentifier
-                               
-                self.log_subtitle('{!r} : {!r}'.format(objectIdentifier[0],objectIdentifier[1]), width=114)
-                self._log.info(
-                    "{:<20} {:<20} {:<30} {:<20}".format(
-                    'propertyIdentifier',
-                    'propertyArrayIndex',
-                    'value',
-                    'datatype'))
-                self._log.info(
-                    "-"*114)
+
+                if verbose:
+                    self.log_subtitle('{!r} : {!r}'.format(objectIdentifier[0],objectIdentifier[1]), width=114)
+                    self._log.info(
+                        "{:<20} {:<20} {:<30} {:<20}".format(
+                        'propertyIdentifier',
+                        'propertyArrayIndex',
+                        'value',
+                        'datatype'))
+                    self._log.info(
+                        "-"*114)
 
                 # now come the property values per object
                 for element in result.listOfResults:
@@ -251,8 +338,13 @@ class ReadProperty():
                         propertyValue = readResult.propertyValue
 
                         # find the datatype
-                        datatype = get_datatype(
-                            objectIdentifier[0], propertyIdentifier)
+                        if datatypes:
+                            datatype = datatypes.get((objectIdentifier[0], propertyIdentifier))
+                        else:
+                            datatype = None
+                        if not datatype:
+                            datatype = get_datatype(
+                                objectIdentifier[0], propertyIdentifier)
 
                         if not datatype:
                             raise TypeError("unknown datatype")
@@ -268,12 +360,13 @@ class ReadProperty():
                             value = propertyValue.cast_out(datatype)
                             
 
-                        self._log.info(
-                            "{!r:<20} {!r:<20} {!r:<30} {!r:<20}".format(
-                            propertyIdentifier,
-                            propertyArrayIndex,
-                            value,
-                            datatype))                        
+                        if verbose:
+                            self._log.info(
+                                "{!r:<20} {!r:<20} {!r:<30} {!r:<20}".format(
+                                propertyIdentifier,
+                                propertyArrayIndex,
+                                value,
+                                datatype))
                         values.append(value)
 
             return values
@@ -285,7 +378,8 @@ class ReadProperty():
             self._log.debug("The Request was : {}".format(args))
             if reason == 'unrecognizedService':
                 raise UnrecognizedService()
-            elif reason == 'segmentationNotSupported':
+            elif reason in ('segmentationNotSupported', 'bufferOverflow', 'apduTooLong'):
+                # All mean the answer is too big, caller must reduce the request
                 raise SegmentationNotSupported()
             elif reason == 'unknownObject':
                 self._log.warning('Unknown object {}'.format(args))
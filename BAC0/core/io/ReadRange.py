@@ -0,0 +1,257 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+ReadRange.py - creation of ReadRange requests to retrieve trend logs
+
+    Used while defining an app
+    Example::
+
+        class BasicScript(WhoisIAm, ReadProperty, ReadRange)
+
+    Class::
+
+        ReadRange()
+            def readRange()
+            def readRange_async()
+            def read_log()
+
+'''
+#--- standard Python modules ---
+from collections import namedtuple
+from datetime import datetime
+
+#--- 3rd party modules ---
+from bacpypes.pdu import Address
+from bacpypes.apdu import ReadRangeRequest, ReadRangeACK, Range, RangeByPosition, \
+    RangeBySequenceNumber, RangeByTime
+from bacpypes.basetypes import DateTime, LogRecord, ResultFlags
+from bacpypes.constructeddata import ListOf
+from bacpypes.iocb import IOCB
+from bacpypes.core import deferred
+
+#--- this application's modules ---
+from .IOExceptions import ReadRangeException, NoResponseFromController, UnrecognizedService, \
+    SegmentationNotSupported, UnknownObjectError, UnknownPropertyError, ApplicationNotStarted
+from .Futures import IOCBFuture
+from .Read import find_reason
+from ..utils.apdu_size import records_per_request
+from ..utils.notes import note_and_log
+
+#------------------------------------------------------------------------------
+
+RangeResult = namedtuple('RangeResult', ['records', 'item_count',
+                                         'first_sequence_number', 'more_items'])
+
+# maxApduLengthAccepted of BACnet/IP devices, used when the device is unknown
+DEFAULT_MAX_APDU = 1476
+
+_MORE_ITEMS = ResultFlags.bitNames['moreItems']
+# Choices of a log record holding a reading (others are status records,
+# time changes, failures or values that can't be decoded without a type)
+_LOG_VALUES = ('realValue', 'booleanValue', 'enumValue', 'unsignedValue',
+               'signedValue', 'bitstringValue')
+
+
+def to_bacnet_datetime(timestamp):
+    """
+    datetime as a BACnet DateTime
+    """
+    return DateTime(date=(timestamp.year - 1900, timestamp.month, timestamp.day,
+                          timestamp.isoweekday()),
+                    time=(timestamp.hour, timestamp.minute, timestamp.second,
+                          timestamp.microsecond // 10000))
+
+
+def from_bacnet_datetime(value):
+    """
+    BACnet DateTime as a datetime (None if the date or time is not specified)
+    """
+    (year, month, day, _), (hour, minute, second, hundredth) = value.date, value.time
+    if 255 in (year, month, day, hour, minute):
+        return None
+    second = 0 if second == 255 else second
+    hundredth = 0 if hundredth == 255 else hundredth
+    try:
+        return datetime(year + 1900, month, day, hour, minute, second, hundredth * 10000)
+    except ValueError:
+        return None
+
+
+def log_record_value(record):
+    """
+    Value of a log record (None for failures and null values)
+    """
+    for choice in _LOG_VALUES:
+        value = getattr(record.logDatum, choice)
+        if value is not None:
+            return value
+    return None
+
+
+@note_and_log
+class ReadRange():
+    """
+    Defines BACnet ReadRange, used to retrieve the records of trend logs
+    (logBuffer) kept by the controllers.
+    """
+
+    def readRange(self, args, *, by=None, reference=None, count=None):
+        """
+        Build a ReadRange request, wait for the answer and return the records
+
+        :param args: String with <addr> <type> <inst> [ <prop> ] (prop
+                     defaults to logBuffer)
+        :param by: 'position', 'sequence' or 'time'. None = whole buffer.
+        :param reference: index (position, starting at 1), sequence number
+                          or datetime (time) of the first record
+        :param count: (int) number of records. Negative reads the records
+                      before reference.
+        :returns: (RangeResult) records as a list of (datetime, value),
+                  item_count, first_sequence_number and more_items
+
+        Status records (log enabled/disabled, buffer purged, time changes)
+        are not part of the records but are counted in item_count.
+
+        *Example*::
+
+            bacnet.readRange('2:5 trendLog 1', by='time',
+                             reference=datetime(2017, 1, 1), count=100)
+        """
+        return self.readRange_async(args, by=by, reference=reference, count=count).result()
+
+    def readRange_async(self, args, *, by=None, reference=None, count=None):
+        """
+        Build a ReadRange request and return immediately without waiting
+        for the answer. See readRange.
+
+        :returns: (IOCBFuture) future holding the RangeResult
+        """
+        if not self._started:
+            raise ApplicationNotStarted(
+                'BACnet stack not running - use startApp()')
+
+        request = self.build_readrange_request(args.split(), by=by, reference=reference,
+                                               count=count)
+        iocb = IOCB(request)
+        future = IOCBFuture(iocb, lambda iocb: self._read_range_response(iocb, args))
+        deferred(self.this_application.request_io, iocb)
+        self._log.debug("{:<20} {!r}".format('iocb', iocb))
+        return future
+
+    def read_log(self, args, *, start=None, end=None, page_size=None):
+        """
+        Generator reading a trend log one page at a time, each page being a
+        ReadRange request sized to fit in one answer.
+
+        :param args: String with <addr> <type> <inst> [ <prop> ]
+        :param start: (datetime) only records taken after start
+        :param end: (datetime) only records taken up to end
+        :param page_size: (int) records per request. Default fits in a
+                          1476 bytes answer. Halved each time the device
+                          answers that the request is too big.
+        :returns: (iter) lists of (datetime, value), oldest first
+
+        *Example*::
+
+            for page in bacnet.read_log('2:5 trendLog 1', start=yesterday):
+                print(len(page))
+        """
+        if page_size is None:
+            page_size = records_per_request(DEFAULT_MAX_APDU)
+        if start is None:
+            by, reference = 'position', 1
+        else:
+            by, reference = 'time', start
+
+        while True:
+            try:
+                result = self.readRange(args, by=by, reference=reference, count=page_size)
+            except SegmentationNotSupported:
+                if page_size == 1:
+                    raise
+                page_size = max(1, page_size // 2)
+                self._log.debug('ReadRange answer too big, reading {} records'.format(page_size))
+                continue
+
+            records = result.records
+            if start is not None:
+                records = [record for record in records if record[0] > start]
+            done = not result.more_items or not result.item_count
+            if end is not None and result.records and result.records[-1][0] > end:
+                records = [record for record in records if record[0] <= end]
+                done = True
+            if records:
+                yield records
+            if done:
+                return
+
+            # Sequence numbers don't move when new records are added
+            if result.first_sequence_number is not None:
+                by = 'sequence'
+                reference = result.first_sequence_number + result.item_count
+            elif by == 'position':
+                reference += result.item_count
+            elif result.records:
+                reference = result.records[-1][0]
+            else:
+                return
+
+    def build_readrange_request(self, args, *, by=None, reference=None, count=None):
+        addr, obj_type, obj_inst = args[:3]
+        prop_id = args[3] if len(args) > 3 else 'logBuffer'
+        if obj_type.isdigit():
+            obj_type = int(obj_type)
+        request = ReadRangeRequest(objectIdentifier=(obj_type, int(obj_inst)),
+                                   propertyIdentifier=prop_id)
+        if by == 'position':
+            request.range = Range(byPosition=RangeByPosition(
+                referenceIndex=int(reference), count=int(count)))
+        elif by == 'sequence':
+            request.range = Range(bySequenceNumber=RangeBySequenceNumber(
+                referenceSequenceNumber=int(reference), count=int(count)))
+        elif by == 'time':
+            request.range = Range(byTime=RangeByTime(
+                referenceTime=to_bacnet_datetime(reference), count=int(count)))
+        elif by is not None:
+            raise ValueError("by must be 'position', 'sequence' or 'time'")
+        request.pduDestination = Address(addr)
+        self._log.debug("{:<20} {}".format("REQUEST", request))
+        return request
+
+    def _read_range_response(self, iocb, args):
+        """
+        Decode the answer to a ReadRange request.
+        Called by the stack when the IOCB completes.
+        """
+        if iocb.ioResponse:
+            apdu = iocb.ioResponse
+            if not isinstance(apdu, ReadRangeACK):
+                raise ReadRangeException('Not an Ack : {!r}'.format(apdu))
+            records = []
+            for record in apdu.itemData.cast_out(ListOf(LogRecord)):
+                if record.logDatum.logStatus is not None or record.logDatum.timeChange is not None:
+                    continue
+                timestamp = from_bacnet_datetime(record.timestamp)
+                if timestamp is None:
+                    continue
+                records.append((timestamp, log_record_value(record)))
+            return RangeResult(records, apdu.itemCount, apdu.firstSequenceNumber,
+                               bool(apdu.resultFlags[_MORE_ITEMS]))
+
+        apdu = iocb.ioError
+        if not hasattr(apdu, 'pduType'):
+            raise NoResponseFromController('No answer to ReadRange {}'.format(args))
+        reason = find_reason(apdu)
+        if reason == 'unrecognizedService':
+            raise UnrecognizedService('ReadRange not supported by {}'.format(args))
+        elif reason in ('segmentationNotSupported', 'bufferOverflow', 'apduTooLong'):
+            raise SegmentationNotSupported()
+        elif reason == 'unknownObject':
+            raise UnknownObjectError('Unknown object {}'.format(args))
+        elif reason == 'unknownProperty':
+            raise UnknownPropertyError('Unknown property {}'.format(args))
+        raise ReadRangeException('ReadRange refused for {} : {}'.format(args, reason))
@@ -16,6 +16,9 @@ Write.py - creation of WriteProperty requests
 
         WriteProperty()
             def write()
+            def write_async()
+            def writeMultiple()
+            def writeMultiple_async()
 
     Functions::
 
@@ -28,7 +31,9 @@ from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.pdu import Address
 from bacpypes.object import get_datatype
 
-from bacpypes.apdu import WritePropertyRequest, SimpleAckPDU
+from bacpypes.apdu import WritePropertyRequest, WritePropertyMultipleRequest, \
+    WritePropertyMultipleError, WriteAccessSpecification, SimpleAckPDU
+from bacpypes.basetypes import PropertyValue
 
 from bacpypes.primitivedata import Null, Atomic, Integer, Unsigned, Real
 from bacpypes.constructeddata import Array, Any
@@ -36,7 +41,10 @@ from bacpypes.iocb import IOCB
 from bacpypes.core import deferred
 
 #--- this application's modules ---
-from .IOExceptions import WritePropertyCastError, NoResponseFromController, WritePropertyException, WriteAccessDenied, ApplicationNotStarted
+from .IOExceptions import WritePropertyCastError, NoResponseFromController, WritePropertyException, WriteAccessDenied, ApplicationNotStarted, \
+    WritePropertyMultipleException, UnrecognizedService, SegmentationNotSupported
+from .Futures import IOCBFuture, failed_future
+from .Read import find_reason
 from ...core.utils.notes import note_and_log
 
 #------------------------------------------------------------------------------
@@ -49,7 +57,7 @@ _LOG = ModuleLogger(globals())
 @note_and_log
 class WriteProperty():
     """
-    Defines BACnet Write functions: WriteProperty [WritePropertyMultiple not supported]
+    Defines BACnet Write functions: WriteProperty and WritePropertyMultiple
 
     """
 
@@ -69,6 +77,24 @@ class WriteProperty():
         Direct the controller at (Network 2, address 5) to write 100 to the presentValues of
         its analogValue 1 (AV:1)
         """
+        self.write_async(args, vendor_id=vendor_id).result()
+
+    def write_async(self, args, vendor_id=0):
+        """
+        Build a WriteProperty request and return immediately without waiting
+        for the answer.
+
+        :param args: String with <addr> <type> <inst> <prop> <value> [ <indx> ] [ <priority> ]
+        :returns: (IOCBFuture) future completed when the device answers
+                  (raises NoResponseFromController if the write failed)
+
+        *Example*::
+
+            futures = [bacnet.write_async('2:5 analogValue {} presentValue 0'.format(i))
+                       for i in range(10)]
+            for future in futures:
+                future.result()
+        """
         if not self._started:
             raise ApplicationNotStarted(
                 'BACnet stack not running - use startApp()')
@@ -78,19 +104,26 @@ class WriteProperty():
         try:
             # build a WriteProperty request
             iocb = IOCB(self.build_wp_request(args, vendor_id=vendor_id))
+            future = IOCBFuture(iocb, lambda iocb: self._write_response(iocb, args))
             # pass to the BACnet stack
             deferred(self.this_application.request_io, iocb)
             self._log.debug("{:<20} {!r}".format('iocb', iocb))
 
-        except WritePropertyException as error:
+        except (WritePropertyException, WritePropertyCastError, ValueError, TypeError) as error:
             # construction error
             self._log.exception("exception: {!r}".format(error))
+            return failed_future(error)
 
-        iocb.wait()             # Wait for BACnet response
+        return future
 
+    def _write_response(self, iocb, args):
+        """
+        Check the answer to a WriteProperty request.
+        Called by the stack when the IOCB completes.
+        """
         if iocb.ioResponse:     # successful response
             apdu = iocb.ioResponse
-            
+
             if not isinstance(iocb.ioResponse, SimpleAckPDU):   # expect an ACK
                 self._log.warning("Not an ack, see debug for more infos.")
                 self._log.debug("Not an ack. | APDU : {} / {}".format((apdu, type(apdu))))
@@ -99,22 +132,156 @@ class WriteProperty():
         if iocb.ioError:        # unsuccessful: error/reject/abort
             raise NoResponseFromController()
 
+    def writeMultiple(self, addr, args, vendor_id=0):
+        """ Build a WritePropertyMultiple request and wait for the answer.
+
+        :param addr: address of the device
+        :param args: list of String with <type> <inst> <prop> <value> [ <indx> ] [ <priority> ]
+
+        *Example*::
+
+            bacnet.writeMultiple('2:5', ['analogValue 1 presentValue 100',
+                                         'analogValue 2 presentValue 20 - 8'])
+
+        Writes are done in order. The device stops at the first write refused
+        and answers with WritePropertyMultipleException (args[1] is the
+        (object identifier, property) that failed) : writes before it are done.
+        """
+        return self.writeMultiple_async(addr, args, vendor_id=vendor_id).result()
+
+    def writeMultiple_async(self, addr, args, vendor_id=0):
+        """
+        Build a WritePropertyMultiple request and return immediately without
+        waiting for the answer. See writeMultiple.
+
+        :returns: (IOCBFuture) future completed when the device answers
+        """
+        if not self._started:
+            raise ApplicationNotStarted(
+                'BACnet stack not running - use startApp()')
+        self.log_title("Write property multiple", [addr] + list(args))
+
+        try:
+            iocb = IOCB(self.build_wpm_request(addr, [each.split() for each in args],
+                                               vendor_id=vendor_id))
+            future = IOCBFuture(iocb, lambda iocb: self._write_multiple_response(iocb, addr))
+            deferred(self.this_application.request_io, iocb)
+            self._log.debug("{:<20} {!r}".format('iocb', iocb))
+
+        except (WritePropertyException, WritePropertyCastError, ValueError, TypeError) as error:
+            # construction error
+            self._log.exception("exception: {!r}".format(error))
+            return failed_future(error)
+
+        return future
+
+    def _write_multiple_response(self, iocb, addr):
+        """
+        Check the answer to a WritePropertyMultiple request.
+        Called by the stack when the IOCB completes.
+        """
+        if iocb.ioResponse:
+            if not isinstance(iocb.ioResponse, SimpleAckPDU):
+                self._log.warning("Not an ack, see debug for more infos.")
+                self._log.debug("Not an ack. | APDU : {!r}".format(iocb.ioResponse))
+            return
+
+        apdu = iocb.ioError
+        if not hasattr(apdu, 'pduType'):
+            raise NoResponseFromController('No answer to WritePropertyMultiple ({})'.format(addr))
+        if isinstance(apdu, WritePropertyMultipleError):
+            failed = apdu.firstFailedWriteAttempt
+            raise WritePropertyMultipleException(
+                'Write refused by {} : {}'.format(addr, apdu.errorType.errorCode),
+                (failed.objectIdentifier, failed.propertyIdentifier))
+        reason = find_reason(apdu)
+        if reason == 'unrecognizedService':
+            raise UnrecognizedService('WritePropertyMultiple not supported by {}'.format(addr))
+        elif reason in ('segmentationNotSupported', 'bufferOverflow', 'apduTooLong'):
+            raise SegmentationNotSupported()
+        raise WritePropertyMultipleException('Write refused by {} : {}'.format(addr, reason), None)
+
     def build_wp_request(self, args, vendor_id=0):
-        addr, obj_type, obj_inst, prop_id = args[:4]
-        vendor_id = vendor_id
+        addr = args[0]
+        obj_type, obj_inst, prop_id, value, indx, priority = self._write_args(
+            args[1:], vendor_id=vendor_id)
+
+        # build a request
+        request = WritePropertyRequest(objectIdentifier=(obj_type, obj_inst),
+                                       propertyIdentifier=prop_id)
+        request.pduDestination = Address(addr)
+
+        # save the value
+        request.propertyValue = Any()
+        try:
+            request.propertyValue.cast_in(value)
+        except WritePropertyCastError as error:
+            self._log.error("WriteProperty cast error: {!r}".format(error))
+
+        # optional array index
+        if indx is not None:
+            request.propertyArrayIndex = indx
+
+        # optional priority
+        if priority is not None:
+            request.priority = priority
+
+        self._log.debug("{:<20} {}".format("REQUEST", request))
+        return request
+
+    def build_wpm_request(self, addr, args, vendor_id=0):
+        """
+        :param args: list of [<type>, <inst>, <prop>, <value>, [ <indx> ], [ <priority> ]]
+        """
+        write_access_specs = []
+        for each in args:
+            obj_type, obj_inst, prop_id, value, indx, priority = self._write_args(
+                each, vendor_id=vendor_id)
+            property_value = PropertyValue(propertyIdentifier=prop_id, value=Any())
+            try:
+                property_value.value.cast_in(value)
+            except (WritePropertyCastError, TypeError, AttributeError) as error:
+                # Don't send the write with an empty value
+                self._log.error("WriteProperty cast error: {!r}".format(error))
+                raise WritePropertyCastError('Unable to write {!r} to {} {} {}'.format(
+                    value, obj_type, obj_inst, prop_id)) from error
+            if indx is not None:
+                property_value.propertyArrayIndex = indx
+            if priority is not None:
+                property_value.priority = priority
+
+            # Consecutive writes to the same object share its specification
+            if write_access_specs and write_access_specs[-1].objectIdentifier == (obj_type, obj_inst):
+                write_access_specs[-1].listOfProperties.append(property_value)
+            else:
+                write_access_specs.append(WriteAccessSpecification(
+                    objectIdentifier=(obj_type, obj_inst), listOfProperties=[property_value]))
+
+        request = WritePropertyMultipleRequest(listOfWriteAccessSpecs=write_access_specs)
+        request.pduDestination = Address(addr)
+        self._log.debug("{:<20} {}".format("REQUEST", request))
+        return request
+
+    def _write_args(self, args, vendor_id=0):
+        """
+        Decode <type> <inst> <prop> <value> [ <indx> ] [ <priority> ]
+
+        :returns: (tuple) obj_type, obj_inst, prop_id, encodeable value, indx, priority
+        """
+        obj_type, obj_inst, prop_id = args[:3]
         if obj_type.isdigit():
             obj_type = int(obj_type)
         obj_inst = int(obj_inst)
-        value = args[4]
+        value = args[3]
 
         indx = None
-        if len(args) >= 6:
-            if args[5] != "-":
-                indx = int(args[5])
+        if len(args) >= 5:
+            if args[4] != "-":
+                indx = int(args[4])
 
         priority = None
-        if len(args) >= 7:
-            priority = int(args[6])
+        if len(args) >= 6:
+            priority = int(args[5])
 
         # get the datatype
         if prop_id.isdigit():
@@ -166,26 +333,4 @@ class WriteProperty():
                     (datatype.__name__,)))
         self._log.info("{:<20} {!r} {}".format(
             "Encodeable value", value, type(value)))
-
-        # build a request
-        request = WritePropertyRequest(objectIdentifier=(obj_type, obj_inst),
-                                       propertyIdentifier=prop_id)
-        request.pduDestination = Address(addr)
-
-        # save the value
-        request.propertyValue = Any()
-        try:
-            request.propertyValue.cast_in(value)
-        except WritePropertyCastError as error:
-            self._log.error("WriteProperty cast error: {!r}".format(error))
-
-        # optional array index
-        if indx is not None:
-            request.propertyArrayIndex = indx
-
-        # optional priority
-        if priority is not None:
-            request.priority = priority
-
-        self._log.debug("{:<20} {}".format("REQUEST", request))
-        return request
+        return (obj_type, obj_inst, prop_id, value, indx, priority)
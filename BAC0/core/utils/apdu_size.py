@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+apdu_size.py - estimate the encoded size of BACnet requests and answers
+
+Used to fill ReadPropertyMultiple requests up to what a device can accept
+instead of using a fixed number of points per request.
+Estimations are made on typical values; a device answering that a request
+was too big will make the caller reduce its budget.
+'''
+#--- standard Python modules ---
+#--- 3rd party modules ---
+#--- this application's modules ---
+
+#------------------------------------------------------------------------------
+
+# Confirmed request : PDU type, max segments/max resp, invoke ID, service choice
+REQUEST_HEADER = 4
+# Complex ACK : PDU type, invoke ID, service choice (+ 2 when segmented)
+ACK_HEADER = 5
+
+# objectIdentifier context tag (5) + opening/closing tags (2)
+OBJECT_OVERHEAD = 7
+# propertyIdentifier context tag
+PROPERTY_REQUEST = 2
+# propertyIdentifier context tag (2) + opening/closing tags of the value (2)
+PROPERTY_ANSWER = 4
+
+# priority context tag of a write
+PRIORITY_SIZE = 2
+# Application tag, extended length (up to 2 bytes) and character set of a string
+STRING_OVERHEAD = 4
+
+# Typical encoded length of property values (application tag included)
+PROPERTY_SIZE = {
+    'presentValue': 5,
+    'objectName': 64,
+    'description': 64,
+    'units': 2,
+    'stateText': 128,
+    'activeText': 24,
+    'inactiveText': 24,
+    'statusFlags': 4,
+    'outOfService': 1,
+    'relinquishDefault': 5,
+    'priorityArray': 96,
+    'objectList': 1024,
+}
+DEFAULT_PROPERTY_SIZE = 8
+
+# Smallest ReadPropertyMultiple answer budget we will reduce to
+MIN_BUDGET = 50
+# When a device can send segmented messages, allow that many segments
+DEFAULT_MAX_SEGMENTS = 4
+
+
+def property_size(prop_id):
+    return PROPERTY_SIZE.get(prop_id, DEFAULT_PROPERTY_SIZE)
+
+
+def rpm_sizes(obj_type, properties):
+    """
+    Estimated size of one object in a ReadPropertyMultiple request and in
+    its answer.
+
+    :param obj_type: (str) object type (not used for now, kept for vendors)
+    :param properties: (list) property identifiers requested
+    :returns: (tuple) request size, answer size in bytes
+    """
+    request = OBJECT_OVERHEAD + PROPERTY_REQUEST * len(properties)
+    answer = OBJECT_OVERHEAD + sum(PROPERTY_ANSWER + property_size(prop)
+                                   for prop in properties)
+    return (request, answer)
+
+
+def wpm_size(prop_id, priority=None, value=None):
+    """
+    Estimated size of one write in a WritePropertyMultiple request (the
+    answer is a simple ack)
+
+    :param prop_id: (str) property written
+    :param priority: (int) priority of the write, if any
+    :param value: value written, if known. A value that is not a number
+                  (ex. a character string) is counted at the encoded length
+                  of its text when longer than the typical size of the
+                  property.
+    :returns: (int) bytes
+    """
+    size = property_size(prop_id)
+    if value is not None:
+        try:
+            float(value)
+        except (TypeError, ValueError):
+            size = max(size, len(str(value).encode('utf-8')) + STRING_OVERHEAD)
+    return OBJECT_OVERHEAD + PROPERTY_ANSWER + size + \
+        (PRIORITY_SIZE if priority is not None else 0)
+
+
+def rpm_sizes_from_str(request):
+    """
+    Same as rpm_sizes but using a request string as used by readMultiple
+    (ex. 'analogInput 1 objectName presentValue units')
+    """
+    args = request.split()
+    properties = [each for each in args[2:] if not each.isdigit()]
+    return rpm_sizes(args[0], properties)
+
+
+def apdu_budget(max_apdu_length, segmentation_supported=False,
+                max_segments=DEFAULT_MAX_SEGMENTS):
+    """
+    Number of bytes available for an answer
+
+    :param max_apdu_length: (int) maxApduLengthAccepted of the device
+    :param segmentation_supported: (bool) device can send segmented answers
+    :returns: (int) bytes
+    """
+    budget = int(max_apdu_length)
+    if segmentation_supported:
+        budget *= max_segments
+    return budget
+
+
+def packed_slices(sizes, request_budget, answer_budget, max_items=None):
+    """
+    Generator splitting a list of (request size, answer size) in consecutive
+    slices fitting in both budgets. An item too big for the budget gets a
+    slice of its own.
+
+    :param sizes: (list) of tuple (request size, answer size)
+    :param request_budget: (int) maximum size of the request
+    :param answer_budget: (int) maximum size of the answer
+    :param max_items: (int) optional maximum number of items per slice
+    :returns: (iter) slice objects
+    """
+    start = 0
+    request = REQUEST_HEADER
+    answer = ACK_HEADER
+    for i, (req_size, ans_size) in enumerate(sizes):
+        if i > start and (request + req_size > request_budget
+                          or answer + ans_size > answer_budget
+                          or (max_items and i - start >= max_items)):
+            yield slice(start, i)
+            start = i
+            request = REQUEST_HEADER
+            answer = ACK_HEADER
+        request += req_size
+        answer += ans_size
+    if start < len(sizes):
+        yield slice(start, len(sizes))
+
+
+# ReadRange answer : object, property, result flags, item count, opening and
+# closing tags of the items, first sequence number
+READ_RANGE_OVERHEAD = 20
+# Trend log record : timestamp (12), value (7), status flags (4)
+LOG_RECORD_SIZE = 23
+
+
+def records_per_request(max_apdu_length, segmentation_supported=False,
+                        max_segments=DEFAULT_MAX_SEGMENTS):
+    """
+    Number of trend log records to ask for in a ReadRange request so the
+    answer fits in what the device can send
+
+    :param max_apdu_length: (int) maxApduLengthAccepted of the device
+    :param segmentation_supported: (bool) device can send segmented answers
+    :returns: (int) records
+    """
+    budget = apdu_budget(max_apdu_length, segmentation_supported, max_segments)
+    return max(1, (budget - ACK_HEADER - READ_RANGE_OVERHEAD) // LOG_RECORD_SIZE)
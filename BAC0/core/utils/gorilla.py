@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+gorilla.py - compression of blocks of (timestamp, float) samples
+
+Same scheme as Facebook's Gorilla time series database :
+
+- timestamps (integer microseconds) are stored as the difference between
+  two consecutive deltas. Points polled at a regular interval give
+  differences close to 0, written in a few bits.
+- values are XORed with the previous one. An unchanged value takes 1 bit,
+  a slowly changing one only stores the bits that changed.
+
+A block is decoded as a whole ; histories are cut in blocks so a period
+can be read without decoding everything.
+'''
+#--- standard Python modules ---
+import struct
+
+#--- 3rd party modules ---
+#--- this application's modules ---
+
+#------------------------------------------------------------------------------
+
+_HEADER = struct.Struct('<Iq')
+
+# (prefix, prefix length, bits of the value) used to write delta of deltas
+_DOD_BUCKETS = ((0b10, 2, 8), (0b110, 3, 14), (0b1110, 4, 20), (0b11110, 5, 32))
+_DOD_LARGE = (0b11111, 5, 64)
+
+_MASK64 = (1 << 64) - 1
+
+
+class _BitWriter():
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._acc = 0
+        self._nbits = 0
+
+    def write(self, value, nbits):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._nbits += nbits
+        if self._nbits >= 64:
+            keep = self._nbits % 8
+            self._buffer += (self._acc >> keep).to_bytes((self._nbits - keep) // 8, 'big')
+            self._acc &= (1 << keep) - 1
+            self._nbits = keep
+
+    def getvalue(self):
+        pad = -self._nbits % 8
+        return bytes(self._buffer) + (self._acc << pad).to_bytes((self._nbits + pad) // 8, 'big')
+
+
+class _BitReader():
+
+    def __init__(self, data, offset=0):
+        self._data = data
+        self._pos = offset
+        self._acc = 0
+        self._nbits = 0
+
+    def read(self, nbits):
+        while self._nbits < nbits:
+            chunk = self._data[self._pos:self._pos + 8]
+            self._pos += 8
+            # Past the end, bits are 0 (padding)
+            self._acc = (self._acc << 64) | int.from_bytes(chunk.ljust(8, b'\0'), 'big')
+            self._nbits += 64
+        self._nbits -= nbits
+        value = self._acc >> self._nbits
+        self._acc &= (1 << self._nbits) - 1
+        return value
+
+    def read_signed(self, nbits):
+        value = self.read(nbits)
+        if value >> (nbits - 1):
+            value -= 1 << nbits
+        return value
+
+
+def encode(timestamps, values):
+    """
+    Compress samples
+
+    :param timestamps: (list of int) ordered timestamps in microseconds
+    :param values: (list of float)
+    :returns: (bytes)
+    """
+    count = len(timestamps)
+    if count == 0:
+        return _HEADER.pack(0, 0)
+    bits = struct.unpack('<{}Q'.format(count), struct.pack('<{}d'.format(count), *values))
+
+    writer = _BitWriter()
+    writer.write(bits[0], 64)
+    previous_ts = timestamps[0]
+    previous_delta = 0
+    previous_bits = bits[0]
+    leading = trailing = None
+    for i in range(1, count):
+        # Timestamp : delta of delta
+        delta = timestamps[i] - previous_ts
+        dod = delta - previous_delta
+        previous_ts = timestamps[i]
+        previous_delta = delta
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for prefix, length, nbits in _DOD_BUCKETS:
+                if -(1 << (nbits - 1)) <= dod < (1 << (nbits - 1)):
+                    break
+            else:
+                prefix, length, nbits = _DOD_LARGE
+            writer.write(prefix, length)
+            writer.write(dod, nbits)
+
+        # Value : XOR with previous value
+        xor = bits[i] ^ previous_bits
+        previous_bits = bits[i]
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if leading is not None and lead >= leading and trail >= trailing:
+            # Changed bits fit in the previous window
+            writer.write(0b10, 2)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = lead, trail
+            meaningful = 64 - leading - trailing
+            writer.write(0b11, 2)
+            writer.write(leading, 5)
+            writer.write(meaningful - 1, 6)
+            writer.write(xor >> trailing, meaningful)
+
+    return _HEADER.pack(count, timestamps[0]) + writer.getvalue()
+
+
+def decode(data):
+    """
+    Decompress samples
+
+    :param data: (bytes) as returned by encode
+    :returns: (tuple) timestamps (list of int), values (list of float)
+    """
+    count, first = _HEADER.unpack_from(data)
+    if count == 0:
+        return ([], [])
+    reader = _BitReader(data, _HEADER.size)
+    previous_bits = reader.read(64)
+    timestamps = [first]
+    bits = [previous_bits]
+    delta = 0
+    leading = trailing = 0
+    for _ in range(1, count):
+        if reader.read(1):
+            for prefix, length, nbits in _DOD_BUCKETS:
+                if not reader.read(1):
+                    break
+            else:
+                prefix, length, nbits = _DOD_LARGE
+            delta += reader.read_signed(nbits)
+        timestamps.append(timestamps[-1] + delta)
+
+        if reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                meaningful = reader.read(6) + 1
+                trailing = 64 - leading - meaningful
+            previous_bits ^= reader.read(64 - leading - trailing) << trailing
+        bits.append(previous_bits)
+
+    values = struct.unpack('<{}d'.format(count), struct.pack('<{}Q'.format(count), *bits))
+    return (timestamps, list(values))
@@ -32,6 +32,8 @@ from ..scripts.Base import Base
 
 from ..core.io.Read import ReadProperty
 from ..core.io.Write import WriteProperty
+from ..core.io.COV import SubscribeCOV
+from ..core.io.ReadRange import ReadRange
 from ..core.functions.GetIPAddr import HostIP
 from ..core.functions.WhoisIAm import WhoisIAm
 from ..core.io.Simulate import Simulation
@@ -46,7 +48,8 @@ from ..infos import __version__ as version
 
 
 @note_and_log
-class Lite(Base, WhoisIAm, ReadProperty, WriteProperty, Simulation):
+class Lite(Base, WhoisIAm, ReadProperty, WriteProperty, SubscribeCOV, ReadRange,
+           Simulation):
     """
     Build a BACnet application to accept read and write requests.
     [Basic Whois/IAm functions are implemented in parent BasicScript class.]
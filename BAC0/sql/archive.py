@@ -0,0 +1,232 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+archive.py - columnar (Parquet) archives of point histories
+
+Histories are written in a directory per device, partitioned per day ::
+
+    path/
+        <device name>/
+            points.parquet                    (points properties)
+            export_state.json                 (last exported reading)
+            date=2017-03-30/part-<time>.parquet
+            date=2017-03-31/part-<time>.parquet
+
+Each file holds (point, ts, value) columns sorted by point and time. Files
+are memory-mapped when read and only the days and points requested are
+loaded.
+
+Each export only writes the readings taken since the previous one, so
+exporting the same device again never duplicates rows.
+
+Requires pyarrow.
+'''
+
+#--- standard Python modules ---
+from datetime import datetime
+import json
+import os
+
+#--- 3rd party modules ---
+try:
+    import pandas as pd
+    _PANDAS = True
+except ImportError:
+    _PANDAS = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+    from pyarrow.fs import LocalFileSystem
+    _PYARROW = True
+except ImportError:
+    _PYARROW = False
+
+#--- this application's modules ---
+
+#------------------------------------------------------------------------------
+
+_STATES = {'inactive': 0, 'active': 1}
+_STATE_FILE = 'export_state.json'
+
+
+def _check_pyarrow():
+    if not _PYARROW or not _PANDAS:
+        raise ImportError('pandas and pyarrow are required to use Parquet archives')
+
+
+def _numeric(his):
+    """
+    History as float64 (binary states as 0/1, invalid values as NaN)
+    """
+    if not pd.api.types.is_numeric_dtype(his):
+        his = pd.to_numeric(his.replace(list(_STATES), list(_STATES.values())),
+                            errors='coerce')
+    return his.astype('float64')
+
+
+def export_histories(device, path, start=None, end=None):
+    """
+    Write the histories of a device in a Parquet archive
+
+    :param device: device (connected or offline)
+    :param path: (str) root directory of the archive
+    :param start: (datetime) only readings taken after start
+    :param end: (datetime) only readings taken up to end (default : now)
+    :returns: (list) files written
+
+    Readings already exported (up to the last exported time kept in
+    export_state.json) are skipped.
+    """
+    _check_pyarrow()
+    root = os.path.join(path, device.properties.name)
+    os.makedirs(root, exist_ok=True)
+
+    # Readings taken while exporting will be part of the next export
+    if end is None:
+        end = datetime.now()
+    last = _last_exported(root)
+    if last is not None and (start is None or pd.Timestamp(start) < last):
+        start = last
+
+    frames = []
+    for point in device.points:
+        his = _numeric(point.history_between(start, end))
+        if len(his):
+            frames.append(pd.DataFrame({'point': point.properties.name,
+                                        'ts': his.index.values,
+                                        'value': his.values}))
+
+    _write_points(device, root)
+    if not frames:
+        _save_last_exported(root, last, end)
+        return []
+
+    data = pd.concat(frames, ignore_index=True)
+    data['point'] = data['point'].astype('category')
+    day = data['ts'].dt.strftime('%Y-%m-%d')
+    part = 'part-{}.parquet'.format(datetime.now().strftime('%Y%m%dT%H%M%S%f'))
+    files = []
+    for date, rows in data.groupby(day, sort=True):
+        directory = os.path.join(root, 'date={}'.format(date))
+        os.makedirs(directory, exist_ok=True)
+        table = pa.Table.from_pandas(rows.sort_values(['point', 'ts']),
+                                     preserve_index=False)
+        filename = os.path.join(directory, part)
+        pq.write_table(table, filename)
+        files.append(filename)
+    _save_last_exported(root, last, end)
+    return files
+
+
+def _last_exported(root):
+    """
+    returns: (datetime) time of the last exported reading, None if the
+    device was never exported
+    """
+    try:
+        with open(os.path.join(root, _STATE_FILE)) as file:
+            return pd.Timestamp(json.load(file)['last_exported']).to_pydatetime()
+    except FileNotFoundError:
+        return None
+
+
+def _save_last_exported(root, last, end):
+    end = pd.Timestamp(end).to_pydatetime()
+    if last is not None and last >= end:
+        return
+    with open(os.path.join(root, _STATE_FILE), 'w') as file:
+        json.dump({'last_exported': end.isoformat()}, file)
+
+
+def _write_points(device, root):
+    points = pd.DataFrame({
+        'name': [point.properties.name for point in device.points],
+        'type': [point.properties.type for point in device.points],
+        'address': [int(point.properties.address) for point in device.points],
+        'description': [point.properties.description for point in device.points],
+        'units_state': [json.dumps(point.properties.units_state, default=str)
+                        for point in device.points]})
+    pq.write_table(pa.Table.from_pandas(points, preserve_index=False),
+                   os.path.join(root, 'points.parquet'))
+
+
+class Archive():
+    """
+    Read access to the Parquet archive of a device.
+
+    ex.
+        archive = Archive('archives', 'my_device')
+        archive['Temperature']                       # pd.Series
+        archive.history('Temperature', start='2017-03-30', end='2017-03-31')
+        archive.df(['Temperature', 'Setpoint'])
+
+    :param path: (str) root directory of the archive
+    :param device_name: (str) name of the device
+    """
+
+    def __init__(self, path, device_name):
+        _check_pyarrow()
+        self.root = os.path.join(path, device_name)
+        self.name = device_name
+        points = pq.read_table(os.path.join(self.root, 'points.parquet'),
+                               memory_map=True).to_pandas()
+        points['units_state'] = points['units_state'].apply(json.loads)
+        self.points_properties = points.set_index('name')
+        # Files are memory-mapped : only the pages of the requested columns
+        # and row groups are read from the disk
+        self._dataset = ds.dataset(self.root, format='parquet',
+                                   filesystem=LocalFileSystem(use_mmap=True),
+                                   partitioning=ds.partitioning(
+                                       pa.schema([('date', pa.string())]), flavor='hive'),
+                                   ignore_prefixes=['points.parquet', _STATE_FILE])
+
+    @property
+    def points_name(self):
+        return list(self.points_properties.index)
+
+    def __contains__(self, point):
+        return point in self.points_properties.index
+
+    def _filter(self, points, start=None, end=None):
+        condition = ds.field('point').isin(points)
+        if start is not None:
+            start = pd.Timestamp(start)
+            condition &= ds.field('date') >= start.strftime('%Y-%m-%d')
+            condition &= ds.field('ts') > pa.scalar(start.to_pydatetime(), pa.timestamp('ns'))
+        if end is not None:
+            end = pd.Timestamp(end)
+            condition &= ds.field('date') <= end.strftime('%Y-%m-%d')
+            condition &= ds.field('ts') <= pa.scalar(end.to_pydatetime(), pa.timestamp('ns'))
+        return condition
+
+    def history(self, point, start=None, end=None):
+        """
+        returns: (pd.Series) readings of a point taken after start and up to end
+        """
+        if point not in self:
+            raise ValueError("{} doesn't exist in archive".format(point))
+        table = self._dataset.to_table(columns=['ts', 'value'],
+                                       filter=self._filter([point], start, end))
+        table = table.sort_by('ts')
+        return pd.Series(table.column('value').to_numpy(), name=point,
+                         index=pd.DatetimeIndex(table.column('ts').to_numpy()))
+
+    def __getitem__(self, point):
+        return self.history(point)
+
+    def df(self, list_of_points, start=None, end=None):
+        """
+        returns: (pd.DataFrame) histories of the points, a column per point
+        """
+        table = self._dataset.to_table(columns=['point', 'ts', 'value'],
+                                       filter=self._filter(list_of_points, start, end))
+        data = table.to_pandas()
+        data['point'] = data['point'].astype(str)
+        return data.pivot_table(index='ts', columns='point', values='value',
+                                aggfunc='last').reindex(columns=list_of_points)
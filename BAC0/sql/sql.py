@@ -9,6 +9,8 @@ sql.py -
 '''
 
 #--- standard Python modules ---
+from datetime import datetime
+import json
 import pickle
 import os.path
 
@@ -16,6 +18,7 @@ import os.path
 import sqlite3
 
 try:
+    import numpy as np
     import pandas as pd
     from pandas.io import sql
     try:
@@ -26,14 +29,60 @@ try:
 except ImportError:
     _PANDAS = False
 #--- this application's modules ---
+from .writer import HistoryWriter, update_last_saved
+from .archive import export_histories
+from ..core.utils.gorilla import encode, decode
 
 #------------------------------------------------------------------------------
 
+# Samples per compressed block (storage='compressed')
+_BLOCK_SIZE = 1024
+_TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+def _resampled(his):
+    """
+    History as numbers (binary states as 0 and 1), resampled to 1 second
+    """
+    if not pd.api.types.is_numeric_dtype(his):
+        his = pd.to_numeric(his.replace(['inactive', 'active'], [0, 1]), errors='coerce')
+    return his.resample('1s').mean()
+
+
+def _loads(value):
+    """
+    Value saved as JSON (plain text for databases saved with older versions)
+    """
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
 class SQLMixin(object):
     """
     Use SQL to persist a device's contents.  By saving the device contents to an SQL 
     database, you can work with the device's data while offline, or while the device 
     is not available. 
+
+    Device properties are kept in the device_properties table, point properties
+    in the points table (values that are not text are stored as JSON).
+
+    Each save only appends the readings taken since the previous one. The time
+    of the newest reading saved (by save() or by the HistoryWriter) is kept in
+    the save_state table of the database.
+
+    Histories are stored according to device.properties.storage :
+
+    - 'wide' : one history table, a column per point, readings resampled to 1s
+    - 'long' : raw readings in samples (point_id, ts, value), clustered on
+      (point_id, ts), and point details in a points table
+    - 'compressed' : raw readings in blocks (point_id, first_ts, last_ts,
+      count, data), each block holding up to 1024 compressed readings of a
+      point (see BAC0.core.utils.gorilla), and a points table
+
+    With device.properties.background_save, readings are sent to a
+    HistoryWriter thread as they are read (long format) and save() only
+    waits for it to be up to date.
     """
 
     def dev_properties_df(self):
@@ -63,16 +112,16 @@ class SQLMixin(object):
         return df
 
 
-    def backup_histories_df(self):
+    def backup_histories_df(self, start=None, end=None):
         """
         Build a dataframe of the point histories
+
+        :param start: (datetime) only readings taken after start
+        :param end: (datetime) only readings taken up to end
         """
         backup = {}
-        for point in self.points:
-            if point.history.dtypes == object:
-                backup[point.properties.name] = point.history.replace(['inactive', 'active'], [0, 1]).resample('1s').mean()
-            else:
-                backup[point.properties.name] = point.history.resample('1s').mean()
+        for name, his in self._histories_between(start, end).items():
+            backup[name] = _resampled(his)
 
         # in some circumstances, correct : pd.DataFrame(dict([ (k,pd.Series(v)) for k,v in backup.items() ]))
         backup = pd.DataFrame(dict([ (k,pd.Series(v)) for k,v in backup.items() ]))
@@ -82,78 +131,466 @@ class SQLMixin(object):
     def save(self, filename = None):
         """
         Save the point histories to sqlite3 database.  
-        Save the device object properties to a pickle file so the device can be reloaded.
+        Save the device and points properties in the same database so the device can be reloaded.
         """
         if filename:
             self.properties.db_name = filename
         else:
             self.properties.db_name = self.properties.name
-            
-        # Does file exist? If so, append data
-        if os.path.isfile('%s.db' % (self.properties.db_name)):
-            #print('File exists, appending data...')
-
-            db = sqlite3.connect('%s.db' % (self.properties.db_name))
-            his = sql.read_sql('select * from "%s"' % 'history', db)  
-            his.index = his['index'].apply(Timestamp)
-            last = his.index[-1]
-            df_to_backup = self.backup_histories_df()[last:]
-            db.close()
-            
-        else:
+
+        if not os.path.isfile('%s.db' % (self.properties.db_name)):
             self._log.debug('Creating a new backup database')
-            df_to_backup = self.backup_histories_df()
-        
+
+        writer = getattr(self, '_history_writer', None)
+        if writer is not None and writer.is_alive() \
+                and writer.filename == '%s.db' % self.properties.db_name:
+            writer.flush()
+        else:
+            self._save_histories()
+
         cnx = sqlite3.connect('%s.db' % (self.properties.db_name))
-    
-        # DataFrames that will be saved to SQL
-        sql.to_sql(df_to_backup, name='history', con=cnx, index_label = 'index', index = True, if_exists = 'append')
-
-        prop_backup = {}
-        prop_backup['device'] = self.dev_properties_df()
-        prop_backup['points'] = self.points_properties_df()
-        with open( "%s.bin"  % self.properties.db_name, "wb" ) as file:
-            pickle.dump(prop_backup, file)
+        with cnx:
+            self._save_properties(cnx)
+        cnx.close()
                 
         #print('%s saved to disk' % self.properties.db_name)
         
 
+    def to_parquet(self, path='.', start=None, end=None):
+        """
+        Export the point histories to a Parquet archive (a directory per
+        device, a sub-directory per day). Requires pyarrow.
+        Readings already exported are skipped, so it can be called again
+        to add the new readings.
+        Use BAC0.sql.archive.Archive to read it back.
+
+        :param path: (str) root directory of the archive
+        :param start: (datetime) only readings taken after start
+        :param end: (datetime) only readings taken up to end
+        :returns: (list) files written
+        """
+        return export_histories(self, path, start=start, end=end)
+
+
+    def _save_histories(self):
+        cnx = sqlite3.connect('%s.db' % (self.properties.db_name))
+        # Readings taken while saving will be part of the next save
+        now = datetime.now()
+        last = self._last_saved(cnx)
+
+        histories = {name: his for name, his in self._histories_between(last, now).items()
+                     if len(his)}
+
+        with cnx:
+            if self.properties.storage == 'long':
+                self._save_samples(cnx, histories=histories)
+            elif self.properties.storage == 'compressed':
+                self._save_blocks(cnx, histories=histories)
+            elif histories:
+                # DataFrames that will be saved to SQL
+                df_to_backup = pd.DataFrame({name: _resampled(his)
+                                             for name, his in histories.items()})
+                sql.to_sql(df_to_backup, name='history', con=cnx, index_label = 'index', index = True, if_exists = 'append')
+            if histories:
+                update_last_saved(cnx, max(his.index[-1] for his in histories.values())
+                                  .to_pydatetime())
+        cnx.close()
+
+
+    def save_backfill(self, histories):
+        """
+        Save readings added to the histories after they were taken (see
+        backfill). Only readings older than the last save are written, the
+        others will be part of the next save.
+
+        :param histories: (dict) {point name: pd.Series}
+        :returns: (int) number of readings written
+        """
+        if not self.properties.db_name:
+            self.properties.db_name = self.properties.name
+        cnx = sqlite3.connect('%s.db' % (self.properties.db_name))
+        last = self._last_saved(cnx)
+        if last is None:
+            # Nothing saved yet, the next save will write everything
+            cnx.close()
+            return 0
+        histories = {name: his[his.index <= Timestamp(last)]
+                     for name, his in histories.items()}
+        histories = {name: his for name, his in histories.items() if len(his)}
+
+        with cnx:
+            if self.properties.storage == 'long':
+                self._save_samples(cnx, histories=histories)
+            elif self.properties.storage == 'compressed':
+                self._save_blocks(cnx, histories=histories)
+            elif histories:
+                df = pd.DataFrame({name: _resampled(his).dropna()
+                                   for name, his in histories.items()})
+                sql.to_sql(df, name='history', con=cnx, index_label='index', index=True,
+                           if_exists='append')
+        cnx.close()
+        return sum(len(his) for his in histories.values())
+
+
+    def start_history_writer(self):
+        """
+        Start writing readings to the database from a background thread
+        """
+        if self._history_writer is not None and self._history_writer.is_alive():
+            return
+        if not self.properties.db_name:
+            self.properties.db_name = self.properties.name
+        self._history_writer = HistoryWriter(self, '%s.db' % self.properties.db_name,
+                                             flush_interval=self.properties.flush_interval,
+                                             flush_size=self.properties.flush_size)
+        # Readings taken before are saved first, new ones wait in the queue
+        self._save_histories()
+        self._history_writer.start()
+
+
+    def stop_history_writer(self):
+        """
+        Write pending readings and stop the background writer
+        """
+        if self._history_writer is not None:
+            self._history_writer.stop()
+            self._history_writer = None
+
+
+    def _save_properties(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS device_properties (key TEXT PRIMARY KEY, value TEXT)')
+        db.executemany('INSERT OR REPLACE INTO device_properties VALUES (?, ?)',
+                       ((key, json.dumps(value, default=str))
+                        for key, value in self.dev_properties_df().items()))
+        self._point_ids(db)
+
+
+    def _create_points_table(self, db):
+        db.execute("""CREATE TABLE IF NOT EXISTS points (
+                          point_id INTEGER PRIMARY KEY,
+                          name TEXT UNIQUE NOT NULL,
+                          type TEXT,
+                          address INTEGER,
+                          units_state TEXT,
+                          description TEXT)""")
+
+
+    def _create_long_tables(self, db):
+        self._create_points_table(db)
+        # The primary key is the table itself (no rowid) : rows of a point
+        # are stored together, ordered by time, values included
+        db.execute("""CREATE TABLE IF NOT EXISTS samples (
+                          point_id INTEGER NOT NULL,
+                          ts TEXT NOT NULL,
+                          value,
+                          PRIMARY KEY (point_id, ts)) WITHOUT ROWID""")
+
+
+    def _create_block_tables(self, db):
+        self._create_points_table(db)
+        db.execute("""CREATE TABLE IF NOT EXISTS blocks (
+                          point_id INTEGER NOT NULL,
+                          first_ts TEXT NOT NULL,
+                          last_ts TEXT NOT NULL,
+                          count INTEGER NOT NULL,
+                          data BLOB NOT NULL,
+                          PRIMARY KEY (point_id, first_ts)) WITHOUT ROWID""")
+
+
+    def _point_ids(self, db):
+        """
+        Register (or update) points in the points table, returns {name: point_id}
+        """
+        self._create_points_table(db)
+        db.executemany('INSERT INTO points (name, type, address, units_state, description) '
+                       'VALUES (?, ?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET '
+                       'type = excluded.type, address = excluded.address, '
+                       'units_state = excluded.units_state, description = excluded.description',
+                       ((point.properties.name, point.properties.type,
+                         int(point.properties.address),
+                         json.dumps(point.properties.units_state, default=str),
+                         point.properties.description) for point in self.points))
+        return dict(db.execute('SELECT name, point_id FROM points'))
+
+
+    def _histories_between(self, start=None, end=None):
+        """
+        returns: (dict) {point name: readings taken after start and up to end}
+        """
+        return {point.properties.name: point.history_between(start, end)
+                for point in self.points}
+
+
+    def _save_samples(self, db, start=None, end=None, histories=None):
+        """
+        Append raw readings taken after start and up to end to the samples table
+
+        :param histories: (dict) {point name: pd.Series} to save instead of
+                          the readings of the points
+        """
+        self._create_long_tables(db)
+        ids = self._point_ids(db)
+        if histories is None:
+            histories = self._histories_between(start, end)
+
+        def rows():
+            for name, his in histories.items():
+                if not len(his):
+                    continue
+                point_id = ids[name]
+                if not pd.api.types.is_numeric_dtype(his):
+                    his = his.replace(['inactive', 'active'], [0, 1])
+                his = his.astype(object).where(his.notna(), None)
+                for ts, value in zip(his.index.strftime(_TS_FORMAT), his):
+                    yield (point_id, ts, value)
+
+        db.executemany('INSERT OR REPLACE INTO samples VALUES (?, ?, ?)', rows())
+
+
+    def _save_blocks(self, db, start=None, end=None, histories=None):
+        """
+        Append readings taken after start and up to end to the blocks table,
+        compressed by blocks of 1024 readings. The last block of a point, if
+        not full, is completed (decoded and encoded again with the new
+        readings) so frequent saves don't leave many small blocks.
+
+        :param histories: (dict) {point name: pd.Series} to save instead of
+                          the readings of the points
+        """
+        self._create_block_tables(db)
+        ids = self._point_ids(db)
+        if histories is None:
+            histories = self._histories_between(start, end)
+
+        rows = []
+        for name, his in histories.items():
+            if not len(his):
+                continue
+            point_id = ids[name]
+            if not pd.api.types.is_numeric_dtype(his):
+                his = pd.to_numeric(his.replace(['inactive', 'active'], [0, 1]), errors='coerce')
+            timestamps = his.index.values.astype('datetime64[us]').astype('int64').tolist()
+            values = his.astype('float64').tolist()
+            index = list(his.index.strftime(_TS_FORMAT))
+
+            last = db.execute('SELECT first_ts, last_ts, count, data FROM blocks '
+                              'WHERE point_id = ? ORDER BY first_ts DESC LIMIT 1',
+                              (point_id,)).fetchone()
+            # Readings older than the last block (backfill) get blocks of their own
+            if last is not None and last[2] < _BLOCK_SIZE and last[1] < index[0]:
+                block_timestamps, block_values = decode(last[3])
+                timestamps = block_timestamps + timestamps
+                values = block_values + values
+                index = list(pd.DatetimeIndex(np.array(block_timestamps, dtype='datetime64[us]'))
+                             .strftime(_TS_FORMAT)) + index
+                # Same key : the block is replaced
+                index[0] = last[0]
+
+            for i in range(0, len(timestamps), _BLOCK_SIZE):
+                j = min(i + _BLOCK_SIZE, len(timestamps))
+                rows.append((point_id, index[i], index[j - 1], j - i,
+                             encode(timestamps[i:j], values[i:j])))
+
+        db.executemany('INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?)', rows)
+
+
+    def _db_storage(self, db):
+        """
+        Layout of the histories in db : 'long', 'compressed' or 'wide'
+
+        The layout is kept for the last connection asked about once it holds
+        histories (an empty database can still get any layout).
+        """
+        cached = getattr(self, '_db_storage_cache', None)
+        if cached is not None and cached[0] is db:
+            return cached[1]
+        tables = {name for name, in db.execute("SELECT name FROM sqlite_master "
+                                               "WHERE type = 'table'")}
+        if 'samples' in tables:
+            storage = 'long'
+        elif 'blocks' in tables:
+            storage = 'compressed'
+        elif 'history' in tables:
+            storage = 'wide'
+        else:
+            return 'wide'
+        self._db_storage_cache = (db, storage)
+        return storage
+
+
+    def _last_saved(self, db):
+        """
+        Time of the last reading saved to db (None if nothing was saved)
+        """
+        db.execute('CREATE TABLE IF NOT EXISTS save_state (key TEXT PRIMARY KEY, value TEXT)')
+        row = db.execute("SELECT value FROM save_state WHERE key = 'last_saved'").fetchone()
+        if row is None:
+            # Database saved before save_state existed
+            try:
+                storage = self._db_storage(db)
+                if storage == 'long':
+                    row = db.execute('SELECT MAX(ts) FROM samples').fetchone()
+                elif storage == 'compressed':
+                    row = db.execute('SELECT MAX(last_ts) FROM blocks').fetchone()
+                else:
+                    row = db.execute('SELECT MAX("index") FROM history').fetchone()
+            except sqlite3.OperationalError:
+                row = None
+        if row is None or row[0] is None:
+            return None
+        return Timestamp(row[0]).to_pydatetime()
+
+
     def points_from_sql(self, db):
         """
         Retrieve point list from SQL database
         """
-        points = sql.read_sql("SELECT * FROM history;", db) 
+        if self._db_storage(db) != 'wide':
+            return [name for name, in db.execute('SELECT name FROM points ORDER BY point_id')]
+        points = sql.read_sql("SELECT * FROM history LIMIT 0;", db)
         return list(points.columns.values)[1:]
         
 
-    def his_from_sql(self, db, point):
+    def _his_filter(self, db, point, start=None, end=None):
+        """
+        Time column, value column, table, WHERE conditions and parameters
+        selecting the readings of one point taken after start and up to end
+        """
+        if self._db_storage(db) == 'long':
+            ts, value, table = 'ts', 'value', 'samples'
+            where = ['point_id = (SELECT point_id FROM points WHERE name = ?)']
+            params = [point]
+        else:
+            ts, value, table = '"index"', '"{}"'.format(point.replace('"', '""')), 'history'
+            where = []
+            params = []
+        if start is not None:
+            where.append('{} > ?'.format(ts))
+            params.append(Timestamp(start).strftime(_TS_FORMAT))
+        if end is not None:
+            where.append('{} <= ?'.format(ts))
+            params.append(Timestamp(end).strftime(_TS_FORMAT))
+        return (ts, value, table, where, params)
+
+
+    def his_from_sql(self, db, point, start=None, end=None):
         """
-        Retrive point histories from SQL database
+        Retrive point histories from SQL database. Only the rows of the
+        point, taken after start and up to end, are read.
+
+        :param start: (datetime or str) None = from the first reading
+        :param end: (datetime or str) None = up to the last reading
         """
-        his = sql.read_sql('select * from "%s"' % 'history', db)  
-        his.index = his['index'].apply(Timestamp)
-        return his.set_index('index')[point]
+        if self._db_storage(db) == 'compressed':
+            return self._his_from_blocks(db, point, start, end)
+        ts, value, table, where, params = self._his_filter(db, point, start, end)
+        query = 'SELECT {}, {} FROM {}'.format(ts, value, table)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        his = sql.read_sql(query + ' ORDER BY ' + ts, db, params=params)
+        return pd.Series(his.iloc[:, 1].values, name=point,
+                         index=pd.DatetimeIndex(pd.to_datetime(his.iloc[:, 0])))
         
 
+    def _blocks_query(self, db, point, start=None, end=None, order='ASC'):
+        """
+        Decoded blocks of one point holding readings taken after start and up
+        to end, as (timestamps in microseconds, values)
+        """
+        where = ['point_id = (SELECT point_id FROM points WHERE name = ?)']
+        params = [point]
+        if start is not None:
+            where.append('last_ts > ?')
+            params.append(Timestamp(start).strftime(_TS_FORMAT))
+        if end is not None:
+            where.append('first_ts <= ?')
+            params.append(Timestamp(end).strftime(_TS_FORMAT))
+        for data, in db.execute('SELECT data FROM blocks WHERE {} ORDER BY first_ts {}'.format(
+                ' AND '.join(where), order), params):
+            yield decode(data)
+
+
+    def _his_from_blocks(self, db, point, start=None, end=None):
+        timestamps = []
+        values = []
+        for block_timestamps, block_values in self._blocks_query(db, point, start, end):
+            timestamps.extend(block_timestamps)
+            values.extend(block_values)
+        his = pd.Series(values, name=point, dtype='float64',
+                        index=pd.DatetimeIndex(np.array(timestamps, dtype='datetime64[us]')
+                                               .astype('datetime64[ns]')))
+        # Backfilled blocks can start before blocks saved earlier
+        his = his.sort_index(kind='stable')
+        if start is not None:
+            his = his[his.index > Timestamp(start)]
+        if end is not None:
+            his = his[his.index <= Timestamp(end)]
+        return his
+
+
     def value_from_sql(self, db, point):
         """
         Take last known value as the value
         """
-        return self.his_from_sql(db, point).last_valid_index()          
+        if self._db_storage(db) == 'compressed':
+            for _, values in self._blocks_query(db, point, order='DESC'):
+                for value in reversed(values):
+                    if value == value:
+                        return value
+            raise IndexError('No value saved for {}'.format(point))
+        ts, value, table, where, params = self._his_filter(db, point)
+        where.append('{} IS NOT NULL'.format(value))
+        row = db.execute('SELECT {} FROM {} WHERE {} ORDER BY {} DESC LIMIT 1'.format(
+            value, table, ' AND '.join(where), ts), params).fetchone()
+        if row is None:
+            raise IndexError('No value saved for {}'.format(point))
+        return row[0]
         
 
+    def _read_properties(self, device_name, query):
+        db = sqlite3.connect('%s.db' % device_name)
+        try:
+            return db.execute(query).fetchall()
+        except sqlite3.OperationalError:
+            return None
+        finally:
+            db.close()
+
+
+    def read_points_prop(self, device_name):
+        """
+        Properties of all points, as a dict {name: properties}
+        """
+        rows = self._read_properties(device_name,
+                                     'SELECT name, type, address, description, units_state FROM points')
+        if rows is None:
+            # Saved before properties were stored in the database
+            with open( "%s.bin" % device_name, "rb" ) as file:
+                points = pickle.load(file)['points']
+            return {name: points[name].to_dict() for name in points.columns}
+        return {name: {'name': name, 'type': obj_type, 'address': address,
+                       'description': description, 'units_state': _loads(units_state)}
+                for name, obj_type, address, description, units_state in rows}
+
+
     def read_point_prop(self, device_name, point):
         """
-        Points properties retrieved from pickle
+        Points properties retrieved from database
         """
-        with open( "%s.bin" % device_name, "rb" ) as file:        
-            return pickle.load(file)['points'][point]
+        return self.read_points_prop(device_name)[point]
 
 
     def read_dev_prop(self, device_name):
         """
-        Device properties retrieved from pickle
+        Device properties retrieved from database
         """
-        with open( "%s.bin" % device_name, "rb" ) as file:
-            return pickle.load(file)['device']            
+        rows = self._read_properties(device_name, 'SELECT key, value FROM device_properties')
+        if rows is None:
+            # Saved before properties were stored in the database
+            with open( "%s.bin" % device_name, "rb" ) as file:
+                return pickle.load(file)['device']
+        props = {key: _loads(value) for key, value in rows}
+        if props.get('objects_list'):
+            props['objects_list'] = [tuple(each) for each in props['objects_list']]
+        return props            
     
\ No newline at end of file
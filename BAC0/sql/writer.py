@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+writer.py - write point readings to SQLite from a background thread.
+
+Points put their readings in a queue ; the writer commits them in batches
+(one transaction, executemany) to the long format tables (see sql.py).
+Polling never waits for the disk.
+'''
+
+#--- standard Python modules ---
+from threading import Thread, Event
+from queue import Queue, Empty
+import atexit
+import sqlite3
+import time
+import weakref
+
+#--- 3rd party modules ---
+#--- this application's modules ---
+from ..core.utils.notes import note_and_log
+
+#------------------------------------------------------------------------------
+
+_STATES = {'inactive': 0, 'active': 1}
+
+
+def update_last_saved(db, timestamp):
+    """
+    Record timestamp as the time of the newest reading saved to db, unless
+    a newer one was saved already (save() and the writer both save).
+
+    :param timestamp: (datetime) newest reading just saved
+    """
+    db.execute('CREATE TABLE IF NOT EXISTS save_state (key TEXT PRIMARY KEY, value TEXT)')
+    value = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')
+    db.execute("INSERT OR IGNORE INTO save_state VALUES ('last_saved', ?)", (value,))
+    db.execute("UPDATE save_state SET value = ? WHERE key = 'last_saved' AND value < ?",
+               (value, value))
+
+
+@note_and_log
+class HistoryWriter(Thread):
+    """
+    Background writer of a device histories.
+
+    :param device: device owning the points (used to register them in the
+                   points table)
+    :param filename: (str) SQLite database
+    :param flush_interval: (float) maximum time in seconds a reading waits in
+                           the queue before being written
+    :param flush_size: (int) readings are written as soon as that many are
+                       waiting
+    """
+
+    def __init__(self, device, filename, *, flush_interval=5, flush_size=500):
+        Thread.__init__(self, name='BAC0_writer_{}'.format(filename), daemon=True)
+        self._device = weakref.ref(device)
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._queue = Queue()
+        self._stopped = Event()
+        self._flushed = Event()
+        self._ids = {}
+        atexit.register(self.stop)
+
+    def put(self, point, timestamp, value):
+        """
+        Add a reading to be written. Never blocks. Readings put once the
+        writer is stopped are dropped.
+        """
+        if self._stopped.is_set():
+            self._log.debug('Writer stopped, reading of {} dropped'.format(point.properties.name))
+            return
+        self._queue.put((point, timestamp, value))
+
+    def flush(self, timeout=None):
+        """
+        Write every reading waiting in the queue, wait until done
+        """
+        if not self.is_alive():
+            return
+        self._flushed.clear()
+        self._queue.put(None)
+        self._flushed.wait(timeout)
+
+    def stop(self, timeout=None):
+        """
+        Write pending readings and end the thread
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._queue.put(None)
+        if self.is_alive():
+            self.join(timeout)
+        atexit.unregister(self.stop)
+
+    def run(self):
+        db = sqlite3.connect(self.filename)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        device = self._device()
+        if device is not None:
+            device._create_long_tables(db)
+            db.execute('CREATE TABLE IF NOT EXISTS save_state (key TEXT PRIMARY KEY, value TEXT)')
+            db.commit()
+        del device
+
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            flush = False
+            item = False
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                if item is None:
+                    flush = True
+                else:
+                    batch.append(item)
+            except Empty:
+                flush = True
+            if flush and self._stopped.is_set():
+                # Readings put while stopping are written with the last batch
+                batch.extend(self._pending())
+            if flush or len(batch) >= self.flush_size:
+                try:
+                    self._write(db, batch)
+                except Exception as error:
+                    self._log.error('Unable to write histories to {} : {}'.format(self.filename, error))
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                if item is None:
+                    self._flushed.set()
+                if flush and self._stopped.is_set():
+                    break
+        # flush() calls waiting for a sentinel drained above
+        self._flushed.set()
+        db.close()
+
+    def _pending(self):
+        """
+        Readings waiting in the queue (without waiting for more)
+        """
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                return items
+            if item is not None:
+                items.append(item)
+
+    def _point_id(self, db, point):
+        name = point.properties.name
+        if name not in self._ids:
+            device = self._device()
+            if device is not None:
+                self._ids.update(device._point_ids(db))
+        return self._ids[name]
+
+    def _write(self, db, batch):
+        if not batch:
+            return
+        rows = []
+        last = None
+        for point, timestamp, value in batch:
+            value = _STATES.get(value, value)
+            if value != value:
+                value = None
+            rows.append((self._point_id(db, point),
+                         timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'), value))
+            if last is None or timestamp > last:
+                last = timestamp
+        with db:
+            db.executemany('INSERT OR REPLACE INTO samples VALUES (?, ?, ?)', rows)
+            update_last_saved(db, last)
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+COV.py - renew the COV subscriptions of a device before they expire.
+'''
+
+#--- standard Python modules ---
+import weakref
+
+#--- 3rd party modules ---
+#--- this application's modules ---
+from .TaskManager import Task, Manager
+
+#------------------------------------------------------------------------------
+
+class COVResubscribe(Task):
+    """
+    Renew the COV subscriptions of a device. Subscriptions are renewed when
+    3/4 of their lifetime has elapsed.
+    ex.
+        device.subscribe_cov(['point_name'], lifetime=300)
+    """
+
+    def __init__(self, device, lifetime):
+        """
+        :param device: (BAC0.core.devices.Device.Device) subscribed device
+        :param lifetime: (int) lifetime of the subscriptions in seconds
+
+        :returns: Nothing
+        """
+        self._device = weakref.ref(device)
+        Task.__init__(self, name='cov_resubscribe', delay=max(1, lifetime * 3 / 4),
+                      lock_key=device.properties.address)
+
+    def start(self):
+        # Subscriptions were just made, first renewal after delay
+        Manager.scheduler().schedule(self, self.delay, self._restart())
+
+    def task(self):
+        device = self._device()
+        if device is not None:
+            device.renew_cov()
@@ -22,21 +22,24 @@ from .TaskManager import Task
 class Match(Task):
     """
     Match two properties of a BACnet Object (i.e. a point status with its command).
+    Writes go through the write queue of the device : only the latest value
+    waiting is sent.
     """
 
     def __init__(self, command = None, status = None, delay=5):        
         self.command = command
         self.status = status
-        Task.__init__(self, delay=delay, daemon = True)
+        Task.__init__(self, delay=delay, daemon = True,
+                      lock_key=status.properties.device.properties.address)
 
 
     def task(self):
-        if  self.status.history[-1] != self.command.history[-1]:
-            self.status._setitem(self.command.history[-1])        
+        if  self.status.lastValue != self.command.lastValue:
+            self.status._setitem(self.command.lastValue, queued=True)
 
 
     def stop(self):
-        self.status._setitem('auto')
+        self.status._setitem('auto', queued=True)
         self.exitFlag = True
 
 
@@ -54,7 +57,8 @@ class Match_Value(Task):
     def __init__(self, value = None, point = None, delay=5):        
         self.value = value
         self.point = point
-        Task.__init__(self, delay=delay, daemon = True)
+        Task.__init__(self, delay=delay, daemon = True,
+                      lock_key=point.properties.device.properties.address)
 
 
     def task(self):
@@ -63,9 +67,9 @@ class Match_Value(Task):
         else:
             value = self.value
         if  value != self.point:
-            self.point._setitem(value)        
+            self.point._setitem(value, queued=True)
 
 
     def stop(self):
-        self.status._setitem('auto')
+        self.point._setitem('auto', queued=True)
         self.exitFlag = True
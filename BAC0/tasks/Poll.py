@@ -26,10 +26,11 @@ class SimplePoll(Task):
         device['point_name'].poll(delay=60)
     """
 
-    def __init__(self, point, *, delay=10):
+    def __init__(self, point, *, delay=10, fixed_rate=False):
         """
         :param point: (BAC0.core.device.Points.Point) name of the point to read
         :param delay: (int) Delay between reads in seconds, defaults = 10sec
+        :param fixed_rate: (bool) Read on a fixed grid of delay seconds
         
         A delay cannot be < 5sec (there are risks of overloading the device)
 
@@ -39,7 +40,9 @@ class SimplePoll(Task):
             delay = 5
         if point.properties:
             self._point = point
-            Task.__init__(self, name='rp_poll', delay=delay)
+            Task.__init__(self, name='rp_poll', delay=delay,
+                          lock_key=point.properties.device.properties.address,
+                          fixed_rate=fixed_rate)
         else:
             raise ValueError('Provide a point object')
 
@@ -53,10 +56,11 @@ class DevicePoll(Task):
     ReadPropertyMultiple requests.
     """
 
-    def __init__(self, device, delay=10):
+    def __init__(self, device, delay=10, fixed_rate=False):
         """
         :param device: (BAC0.core.devices.Device.Device) device to poll
         :param delay: (int) Delay between polls in seconds, defaults = 10sec
+        :param fixed_rate: (bool) Poll on a fixed grid of delay seconds
         
         A delay cannot be < 5sec (there are risks of overloading the device)
 
@@ -65,7 +69,9 @@ class DevicePoll(Task):
         if delay < 5:
             delay = 5
         self._device = weakref.ref(device)
-        Task.__init__(self, name='rpm_poll', delay=delay, daemon = True)
+        Task.__init__(self, name='rpm_poll', delay=delay, daemon = True,
+                      lock_key=device.properties.address,
+                      fixed_rate=fixed_rate)
         self._counter = 0
 
     @property
@@ -73,10 +79,14 @@ class DevicePoll(Task):
         return self._device()
 
     def task(self):
-        self.device.read_multiple(list(self.device.points_name), points_per_request=25)
+        self.device.read_poll_plan()
         self._counter += 1
         if self._counter == self.device.properties.auto_save:
-            self.device.save()
+            # A background writer already saves every reading : waiting for
+            # it here would block the poll on the disk
+            writer = getattr(self.device, '_history_writer', None)
+            if writer is None or not writer.is_alive():
+                self.device.save()
             if self.device.properties.clear_history_on_save:
                 self.device.clear_histories()
             self._counter = 0
@@ -5,22 +5,53 @@
 # Licensed under LGPLv3, see file LICENSE in this source tree.
 #
 '''
-TaskManager.py - creation of threads used for repetitive tasks.  
+TaskManager.py - scheduling of repetitive tasks.
 
 A key building block for point simulation.
+
+Tasks don't own a thread. A single scheduler thread keeps a heap of the
+next run time of every task and hands due tasks to a small pool of worker
+threads. Tasks sharing a lock_key (typically the address of the device they
+talk to) never run at the same time ; other tasks are not blocked by them.
+
+Each start() of a task begins a new generation : entries queued by a
+previous start (or before a stop) are dropped when they come due.
+
+By default, a task waits delay seconds after the end of its execution. A
+fixed_rate task is executed on a grid aligned on multiples of delay (wall
+clock) and keeps that cadence whatever the execution time. Cycles missed
+because the task was still running are skipped and counted in overruns.
 '''
 #--- standard Python modules ---
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition, Event
+from collections import deque
+from queue import Queue
+import heapq
+import itertools
 import time
 
 #--- 3rd party modules ---
 #--- this application's modules ---
+from ..core.utils.notes import note_and_log
 
 #------------------------------------------------------------------------------
 
 class Manager():
     taskList = []
-    threadLock = Lock()
+    # Number of worker threads executing tasks
+    max_workers = 8
+    _scheduler = None
+    _scheduler_lock = Lock()
+
+    @classmethod
+    def scheduler(cls):
+        """
+        The scheduler is created (and its threads started) on first use
+        """
+        with cls._scheduler_lock:
+            if cls._scheduler is None:
+                cls._scheduler = Scheduler(max_workers=cls.max_workers)
+            return cls._scheduler
 
 
 def stopAllTasks():
@@ -29,35 +60,218 @@ def stopAllTasks():
     print('Stopping all threads')
 
 
-class Task(Thread):
+@note_and_log
+class Scheduler():
+    """
+    Timer heap dispatching due tasks to a bounded pool of worker threads.
+    Only one task per lock_key is executed at a time ; the others wait in
+    a queue for that key without holding a worker.
+    """
+
+    def __init__(self, max_workers=8):
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = Condition()
+        self._jobs = Queue()
+        self._keys_lock = Lock()
+        self._busy = set()
+        self._waiting = {}
+
+        self._thread = Thread(target=self._dispatch, name='BAC0_scheduler', daemon=True)
+        self._thread.start()
+        self._workers = []
+        for i in range(max_workers):
+            worker = Thread(target=self._work, name='BAC0_worker_{}'.format(i), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def schedule(self, task, delay=0, generation=None):
+        """
+        Run task in delay seconds
+
+        :param generation: start() of the task this run belongs to
+                           (default : the last one)
+        """
+        if generation is None:
+            generation = task._generation
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence),
+                                        task, generation))
+            self._condition.notify()
+
+    def submit(self, task, generation=None):
+        """
+        Run task as soon as a worker (and its lock_key) is available
+        """
+        if generation is None:
+            generation = task._generation
+        key = task.lock_key
+        if key is not None:
+            with self._keys_lock:
+                if key in self._busy:
+                    self._waiting.setdefault(key, deque()).append((task, generation))
+                    return
+                self._busy.add(key)
+        self._jobs.put((task, generation))
+
+    def _release(self, key):
+        if key is None:
+            return
+        with self._keys_lock:
+            waiting = self._waiting.get(key)
+            if waiting:
+                # Key stays busy, handed over to the next task
+                self._jobs.put(waiting.popleft())
+                if not waiting:
+                    del self._waiting[key]
+            else:
+                self._busy.discard(key)
 
-    def __init__(self, delay=5, daemon = True, name='recurring'):
-        Thread.__init__(self, name=name, daemon = daemon)
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, task, generation = heapq.heappop(self._heap)
+                        break
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._condition.wait(timeout)
+            if generation != task._generation:
+                # Stopped or started again since
+                continue
+            if task.exitFlag:
+                task._finished()
+            else:
+                self.submit(task, generation)
+
+    def _work(self):
+        while True:
+            task, generation = self._jobs.get()
+            executed = False
+            try:
+                if task._claim(generation):
+                    executed = True
+                    task._execute()
+            except Exception as error:
+                self._log.error('Task {} failed : {}'.format(task.name, error), exc_info=True)
+            finally:
+                self._release(task.lock_key)
+
+            if not executed:
+                # Stale entry, unless all tasks were stopped (stopAllTasks)
+                if generation == task._generation and task.exitFlag:
+                    task._finished()
+            elif task.exitFlag:
+                task._finished()
+            elif generation != task._generation:
+                # Started again while executing : the new run owns the task
+                pass
+            elif not task.recurring:
+                task._finished()
+            else:
+                self.schedule(task, task._next_delay(), generation)
+
+
+class Task():
+    """
+    Recurring task. task() is called every delay seconds (delay counted from
+    the end of the previous execution) until stop() is called.
+
+    :param lock_key: tasks with the same lock_key are never executed
+                     at the same time (ex. device address)
+    :param fixed_rate: (bool) execute on a fixed grid of delay seconds
+                       instead of waiting delay seconds after each execution
+    """
+    recurring = True
+
+    def __init__(self, delay=5, daemon = True, name='recurring', lock_key=None,
+                 fixed_rate=False):
+        self.name = name
+        self.daemon = daemon
         self.is_running = False
         self.exitFlag = False
-        self.lock = Manager.threadLock
         self.delay = delay
+        self.lock_key = lock_key
+        self.fixed_rate = fixed_rate
+        self.overruns = 0
+        self._next_run = None
+        self._executing = False
+        self._done = Event()
+        self._done.set()
+        # Incremented by start() and stop(), queued runs of older ones are dropped
+        self._generation = 0
+        self._state_lock = Lock()
         if not self.name in Manager.taskList:
             Manager.taskList.append(self)
 
 
+    def start(self):
+        generation = self._restart()
+        delay = 0
+        if self.fixed_rate:
+            # First execution on the next multiple of delay (wall clock)
+            delay = -time.time() % self.delay
+            self._next_run = time.monotonic() + delay
+        Manager.scheduler().schedule(self, delay, generation)
+
+
+    def _restart(self):
+        """
+        Begin a new generation of the task, returns it
+        """
+        with self._state_lock:
+            self._generation += 1
+            self.is_running = True
+            self.exitFlag = False
+            self._done.clear()
+            return self._generation
+
+
+    def _claim(self, generation):
+        """
+        True (and the task is executing) if generation is the current one
+        """
+        with self._state_lock:
+            if generation != self._generation or self.exitFlag:
+                return False
+            self._executing = True
+            return True
+
+
+    def _next_delay(self):
+        """
+        Seconds to wait before next execution
+        """
+        if not self.fixed_rate:
+            return self.delay
+        now = time.monotonic()
+        self._next_run += self.delay
+        if self._next_run < now:
+            missed = int((now - self._next_run) // self.delay) + 1
+            self.overruns += missed
+            self._next_run += missed * self.delay
+        return self._next_run - now
+
+
     def run(self):
-        self.process()
+        """
+        Execute the task once, in the calling thread
+        """
+        self._execute()
 
 
-    def process(self):
-        self.is_running = True
-        while not self.exitFlag:
-            self.lock.acquire()
+    def _execute(self):
+        self._executing = True
+        try:
             self.task()
-            self.lock.release()
-            # This replace a single time.sleep
-            # the goal is to speed up the stop
-            # of the thread by providing an easy way out
-            for i in range(self.delay * 2):
-                if self.exitFlag:
-                    break
-                time.sleep(0.5)
+        finally:
+            self._executing = False
+
+
+    def _finished(self):
+        self.is_running = False
+        self._done.set()
 
 
     def task(self):
@@ -65,8 +279,29 @@ class Task(Thread):
 
 
     def stop(self):
-        self.is_running = False
-        self.exitFlag = True
+        with self._state_lock:
+            self.is_running = False
+            self.exitFlag = True
+            # Runs still queued are dropped
+            self._generation += 1
+            if not self._executing:
+                self._done.set()
+
+
+    def is_alive(self):
+        """
+        True until the task is stopped and not executing anymore
+        """
+        if self.exitFlag and not self._executing:
+            return False
+        return not self._done.is_set()
+
+
+    def join(self, timeout=None):
+        """
+        Wait for the task to end (after stop() was called)
+        """
+        self._done.wait(timeout)
 
 
     def beforeStop(self):
@@ -77,29 +312,15 @@ class Task(Thread):
             Manager.taskList.remove(self)
 
 
-class OneShotTask(Thread):
+class OneShotTask(Task):
 
-    def __init__(self, daemon = True,name='Oneshot'):
-        Thread.__init__(self, name=name, daemon = daemon)
-        self.lock = Manager.threadLock
-        if not self.name in Manager.taskList:
-            Manager.taskList.append(self)
+    recurring = False
 
-    def run(self):
-        self.process()
+    def __init__(self, daemon = True, name='Oneshot', lock_key=None):
+        Task.__init__(self, delay=0, daemon=daemon, name=name, lock_key=lock_key)
 
-    def process(self):
-        self.task()
-            
-    def task(self):
-        raise RuntimeError("task must be overridden")
+    def start(self):
+        Manager.scheduler().submit(self, self._restart())
 
     def stop(self):
         pass
-
-    def beforeStop(self):
-        """
-        Action done when closing thread
-        """
-        if self in Manager.taskList:
-            Manager.taskList.remove(self)
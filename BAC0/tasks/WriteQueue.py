@@ -0,0 +1,46 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 by Christian Tremblay, P.Eng <christian.tremblay@servisys.com>
+# Licensed under LGPLv3, see file LICENSE in this source tree.
+#
+'''
+WriteQueue.py - send the writes waiting in the write queue of a device.
+'''
+
+#--- standard Python modules ---
+import weakref
+
+#--- 3rd party modules ---
+#--- this application's modules ---
+from .TaskManager import OneShotTask, Manager
+
+#------------------------------------------------------------------------------
+
+class WriteQueueDrain(OneShotTask):
+    """
+    Send the writes queued for a device, delay seconds after the first one.
+    One instance per device, started again each time writes are queued.
+    ex.
+        device.queue_write('point_name', 21)
+    """
+
+    def __init__(self, device, delay=0):
+        """
+        :param device: (BAC0.core.devices.Device.Device) device written to
+        :param delay: (float) seconds the writes wait in the queue
+
+        :returns: Nothing
+        """
+        self._device = weakref.ref(device)
+        OneShotTask.__init__(self, name='write_queue', lock_key=device.properties.address)
+        self.delay = delay
+
+    def start(self):
+        # Writes queued meanwhile replace the older ones
+        Manager.scheduler().schedule(self, self.delay, self._restart())
+
+    def task(self):
+        device = self._device()
+        if device is not None:
+            device.flush_writes()
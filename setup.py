@@ -5,7 +5,7 @@ from setuptools import setup
 from BAC0 import infos
 
 requirements = [
-    'bacpypes',
+    'bacpypes>=0.18.1',
 ]
 
 setup(name='BAC0',
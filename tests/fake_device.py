@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Devices built for the tests
+---------------------------
+
+make_device() creates a device through Device.__init__ and the real state
+initialization (connect, discovery of the points), with only the network
+mocked. The fake network answers the reads made by the discovery from a
+list of objects.
+"""
+
+from BAC0.core.devices.Device import Device, RPMDeviceConnected
+
+from bacpypes.basetypes import ServicesSupported
+
+from concurrent.futures import Future
+from mock import Mock, DEFAULT
+
+
+def analog(obj_type, instance, name, value=0.0, units='noUnits'):
+    return (obj_type, instance, {'objectName': name, 'presentValue': value,
+                                 'units': units, 'description': ''})
+
+
+def binary(obj_type, instance, name, value='inactive', states=('Off', 'On')):
+    return (obj_type, instance, {'objectName': name, 'presentValue': value,
+                                 'inactiveText': states[0], 'activeText': states[1],
+                                 'description': ''})
+
+
+def multistate(obj_type, instance, name, value=1, states=('One', 'Two')):
+    return (obj_type, instance, {'objectName': name, 'presentValue': value,
+                                 'stateText': list(states), 'description': ''})
+
+
+def make_network(objects, *, name='dev', max_apdu_length=480,
+                 services=('readPropertyMultiple', 'writePropertyMultiple')):
+    """
+    Mock of the network answering the device discovery
+
+    :param objects: (list) (object type, instance, {property: value}) as
+                    returned by analog(), binary() or multistate()
+    """
+    properties = {(obj_type, int(instance)): values for obj_type, instance, values in objects}
+    pss = ServicesSupported()
+    for service in services:
+        pss[service] = 1
+    device_properties = {'objectName': name,
+                         'segmentationSupported': 'segmentedBoth',
+                         'maxApduLengthAccepted': max_apdu_length,
+                         'protocolServicesSupported': pss.value,
+                         'objectList': [(obj_type, instance) for obj_type, instance, _ in objects]}
+
+    def read(args, *other, **kwargs):
+        _, obj_type, _, prop = args.split()[:4]
+        if obj_type == 'device' and prop in device_properties:
+            return device_properties[prop]
+        return DEFAULT
+
+    def read_multiple(args, **kwargs):
+        # '<address> <type> <instance> <property>... <type> <instance> ...'
+        words = args.split()[1:]
+        values = []
+        i = 0
+        while i < len(words):
+            if i + 1 < len(words) and words[i + 1].isdigit():
+                obj = properties[(words[i], int(words[i + 1]))]
+                i += 2
+            else:
+                values.append(obj[words[i]])
+                i += 1
+        future = Future()
+        future.set_result(values)
+        return future
+
+    network = Mock()
+    network.read.side_effect = read
+    network.readMultiple_async.side_effect = read_multiple
+    return network
+
+
+def make_device(objects, *, max_apdu_length=480, **kwargs):
+    """
+    Device connected to a mocked network, holding the points of objects.
+    Polling is off. The mocks of the network are reset once the device is
+    built, so the tests only see their own requests.
+
+    :param max_apdu_length: (int) maxApduLengthAccepted of the device
+    :param kwargs: parameters of Device (ex. storage='long')
+    """
+    network = make_network(objects, max_apdu_length=max_apdu_length)
+    kwargs.setdefault('poll', 0)
+    device = Device('2:5', 5, network, **kwargs)
+    assert isinstance(device, RPMDeviceConnected), device
+    network.reset_mock()
+    return device
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test COV subscriptions
+----------------------
+"""
+
+from BAC0.core.io.COV import SubscribeCOV
+from BAC0.core.io.IOExceptions import COVSubscriptionError
+
+from concurrent.futures import Future
+from mock import Mock
+import unittest
+
+from bacpypes.apdu import UnconfirmedCOVNotificationRequest, SimpleAckPDU, Error
+from bacpypes.basetypes import PropertyValue, StatusFlags
+from bacpypes.constructeddata import Any
+from bacpypes.iocb import IOCB
+from bacpypes.primitivedata import Real
+
+from fake_device import make_device, analog
+
+
+class TestSubscribeCOV(unittest.TestCase):
+
+    def setUp(self):
+        self.network = SubscribeCOV()
+        self.network.this_application = Mock()
+        self.network._started = True
+
+    def test_request(self):
+        """
+        COV / Subscription and cancellation requests
+        """
+        request = self.network.build_cov_request('2:5 analogInput 1'.split(), 7,
+                                                 lifetime=300, confirmed=True)
+        self.assertEqual(request.monitoredObjectIdentifier, ('analogInput', 1))
+        self.assertEqual(request.lifetime, 300)
+        self.assertTrue(request.issueConfirmedNotifications)
+        cancel = self.network.build_cov_request('2:5 analogInput 1'.split(), 7, cancel=True)
+        self.assertIsNone(cancel.lifetime)
+        self.assertIsNone(cancel.issueConfirmedNotifications)
+
+    def test_notification_calls_callback(self):
+        """
+        COV / Notified values are decoded and passed to the callback
+        """
+        callback = Mock()
+        future = self.network.subscribe_cov_async('2:5 analogInput 1', callback=callback)
+        process_id = future.iocb.args[0].subscriberProcessIdentifier
+        future.iocb.complete(SimpleAckPDU())
+        self.assertEqual(future.result(), process_id)
+
+        notification = UnconfirmedCOVNotificationRequest(
+            subscriberProcessIdentifier=process_id,
+            initiatingDeviceIdentifier=('device', 5),
+            monitoredObjectIdentifier=('analogInput', 1),
+            timeRemaining=250,
+            listOfValues=[
+                PropertyValue(propertyIdentifier='presentValue', value=Any(Real(21.5))),
+                PropertyValue(propertyIdentifier='statusFlags',
+                              value=Any(StatusFlags([0, 0, 0, 0])))])
+        self.network._cov_notification(notification)
+        object_identifier, values = callback.call_args[0]
+        self.assertEqual(object_identifier, ('analogInput', 1))
+        self.assertEqual(values['presentValue'], 21.5)
+
+    def test_refused_subscription(self):
+        """
+        COV / A refused subscription raises COVSubscriptionError
+        """
+        future = self.network.subscribe_cov_async('2:5 analogInput 1')
+        future.iocb.abort(Error(errorClass='services', errorCode='optionalFunctionalityNotSupported'))
+        with self.assertRaises(COVSubscriptionError):
+            future.result()
+        self.assertEqual(self.network._cov_callbacks, {})
+
+
+class TestDeviceCOV(unittest.TestCase):
+
+    def setUp(self):
+        self.device = make_device([analog('analogInput', i, 'AI{}'.format(i)) for i in range(3)])
+
+    def answer(self, args, **kwargs):
+        future = Future()
+        if args.endswith(' 2'):
+            future.set_exception(COVSubscriptionError('refused'))
+        else:
+            future.set_result(int(args[-1]) + 100)
+        return future
+
+    def test_subscribed_points_are_not_polled(self):
+        """
+        COV / Subscribed points leave the poll plan, refused ones stay
+        """
+        self.device.properties.network.subscribe_cov_async.side_effect = self.answer
+        refused = self.device.subscribe_cov(lifetime=None)
+        self.assertEqual(refused, ['AI2'])
+        self.assertEqual(sorted(self.device.cov_points), ['AI0', 'AI1'])
+        polled = [point.properties.name for points in
+                  (batch[1] for batch in self.device.poll_plan.batches) for point in points]
+        self.assertEqual(polled, ['AI2'])
+
+        self.device._cov_value(('analogInput', 1), {'presentValue': 42.0})
+        self.assertEqual(self.device['AI1'].lastValue, 42.0)
+
+        self.device.unsubscribe_cov()
+        self.assertEqual(self.device.cov_points, [])
+        self.assertEqual(len(self.device.poll_plan.batches[0][1]), 3)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test device point indexes
+-------------------------
+"""
+
+from BAC0.core.devices.Device import Device, DeviceDisconnected, DeviceNotConnected
+from BAC0.core.devices.Points import NumericPoint, BooleanPoint, EnumPoint
+from BAC0.core.io.IOExceptions import NoResponseFromController
+
+from fake_device import make_device, analog, binary, multistate
+
+from mock import Mock
+import unittest
+
+
+def make_point(device, point_type, address, name):
+    cls = BooleanPoint if point_type.startswith('binary') else NumericPoint
+    return cls(device=device, pointType=point_type, pointAddress=address, pointName=name,
+               presentValue='inactive' if cls is BooleanPoint else 0.0)
+
+
+class TestPointIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.device = make_device([analog('analogInput', 1, 'AI1'),
+                                   analog('analogValue', 1, 'AV1'),
+                                   binary('binaryValue', 2, 'BV2')])
+
+    def test_find_by_name(self):
+        """
+        Device / Points are found by name
+        """
+        self.assertIs(self.device._findPoint('AV1', force_read=False), self.device.points[1])
+        self.assertIn('BV2', self.device)
+        with self.assertRaises(ValueError):
+            self.device._findPoint('AV2', force_read=False)
+        self.assertNotIn('AV2', self.device)
+
+    def test_find_by_id(self):
+        """
+        Device / Points are found by object type and instance
+        """
+        self.assertIs(self.device._findPointById('analogValue', 1), self.device.points[1])
+        self.assertIs(self.device._findPointById('binaryValue', '2'), self.device.points[2])
+        with self.assertRaises(ValueError):
+            self.device._findPointById('analogValue', 2)
+
+    def test_points_are_reindexed(self):
+        """
+        Device / Indexes follow points assigned or added, not points changed in place
+        """
+        plan = self.device.poll_plan
+        av2 = make_point(self.device, 'analogValue', 2, 'AV2')
+        self.device.add_point(av2)
+        self.assertIs(self.device._findPoint('AV2', force_read=False), av2)
+        self.assertIs(self.device._findPointById('analogValue', 2), av2)
+        self.assertIsNot(self.device.poll_plan, plan)
+        with self.assertRaises(AttributeError):
+            self.device.points.append(av2)
+
+        self.device.points = self.device.points[2:]
+        self.assertEqual(list(self.device.points_name), ['BV2', 'AV2'])
+        self.assertNotIn('AV1', self.device)
+        with self.assertRaises(ValueError):
+            self.device._findPointById('analogInput', 1)
+
+
+def scanned(device):
+    """
+    Units and states found by scanning every point, as done before the
+    indexes existed
+    """
+    analog = {point.properties.name: point.properties.units_state
+              for point in device.points if isinstance(point, NumericPoint)}
+    return {'analog_units': analog,
+            'binary_states': {point.properties.name: point.properties.units_state
+                              for point in device.points if isinstance(point, BooleanPoint)},
+            'multi_states': {point.properties.name: point.properties.units_state
+                             for point in device.points if isinstance(point, EnumPoint)},
+            'temperatures': [each for each in analog.items() if 'deg' in each[1]],
+            'percent': [each for each in analog.items() if 'percent' in each[1]]}
+
+
+class TestUnitIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.device = make_device([
+            analog('analogInput', 1, 'ZN-T', 21.0, 'degreesCelsius'),
+            analog('analogOutput', 1, 'VAV-O', 50.0, 'percent'),
+            analog('analogValue', 1, 'FLOW', 0.0, 'litersPerSecond'),
+            binary('binaryOutput', 1, 'FAN'),
+            multistate('multiStateValue', 1, 'MODE', 1, ['Occ', 'Unocc'])])
+
+    def check(self):
+        expected = scanned(self.device)
+        self.assertEqual(self.device.analog_units, expected['analog_units'])
+        self.assertEqual(self.device.binary_states, expected['binary_states'])
+        self.assertEqual(self.device.multi_states, expected['multi_states'])
+        self.assertEqual(list(self.device.temperatures), expected['temperatures'])
+        self.assertEqual(list(self.device.percent), expected['percent'])
+
+    def test_same_as_scan(self):
+        """
+        Device / Precomputed units and states match a scan of the points
+        """
+        self.check()
+        self.assertEqual(list(self.device.temperatures), [('ZN-T', 'degreesCelsius')])
+
+    def test_replaced_points(self):
+        """
+        Device / Units and states follow the points when they are replaced
+        """
+        self.device.points = self.device.points[1:4]
+        self.check()
+        self.assertEqual(list(self.device.temperatures), [])
+        self.device.add_point(NumericPoint(
+            device=self.device, pointType='analogInput', pointAddress=2, pointName='OA-T',
+            presentValue=-5.0, units_state='degreesFahrenheit'))
+        self.check()
+        self.assertEqual(list(self.device.temperatures), [('OA-T', 'degreesFahrenheit')])
+
+    def test_returned_dict_is_a_copy(self):
+        """
+        Device / Changing a returned dict doesn't change the index
+        """
+        self.device.analog_units['ZN-T'] = 'percent'
+        self.check()
+
+
+class TestOfflineDevice(unittest.TestCase):
+
+    def setUp(self):
+        # No answer and no database : the device stays disconnected
+        network = Mock()
+        network.read.side_effect = NoResponseFromController()
+        self.device = Device('2:5', 5, network, poll=0)
+
+    def test_bacnet_actions_raise(self):
+        """
+        Device / A disconnected device raises DeviceNotConnected for BACnet actions
+        """
+        self.assertIsInstance(self.device, DeviceDisconnected)
+        for action in (lambda: self.device.poll(delay=5),
+                       lambda: self.device.write_many({'AV1': 1}),
+                       lambda: 'AV1' in self.device,
+                       lambda: self.device.analog_units):
+            with self.assertRaises(DeviceNotConnected):
+                action()
+
+    def test_disconnected_has_no_points(self):
+        """
+        Device / A disconnected device can't find or count points
+        """
+        for find in (lambda: self.device['AV1'], lambda: len(self.device),
+                     lambda: self.device._findPoint('AV1'), lambda: self.device.points_name):
+            with self.assertRaises(DeviceNotConnected):
+                find()
+        self.assertEqual(list(self.device.simulated_points), [])
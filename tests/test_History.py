@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test point history storage
+--------------------------
+"""
+
+from BAC0.core.devices.History import History, CompressedHistory
+from BAC0.core.utils.gorilla import encode, decode
+
+from datetime import datetime, timedelta
+import math
+import numpy as np
+import unittest
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.t0 = datetime(2017, 1, 1)
+
+    def fill(self, history, count):
+        for i in range(count):
+            history.append(self.t0 + timedelta(seconds=i), i)
+
+    def test_unbounded_keeps_everything(self):
+        """
+        History / Without capacity, every sample is kept in order
+        """
+        history = History()
+        self.fill(history, 200)
+        self.assertEqual(len(history), 200)
+        self.assertEqual(list(history.values), list(range(200)))
+
+    def test_ring_keeps_last_samples(self):
+        """
+        History / With a capacity, oldest samples are overwritten
+        """
+        history = History(capacity=5)
+        self.fill(history, 12)
+        self.assertEqual(len(history), 5)
+        self.assertEqual(list(history.values), [7, 8, 9, 10, 11])
+        self.assertEqual(len(history.timestamps), 5)
+
+    def test_float_history_stores_nan(self):
+        """
+        History / Invalid values in a float history become NaN
+        """
+        history = History(dtype='float64')
+        history.append(self.t0, None)
+        history.append(self.t0, 'inactive')
+        self.assertTrue(all(math.isnan(v) for v in history.values))
+
+    def test_between(self):
+        """
+        History / between excludes start and includes end
+        """
+        history = History(capacity=50)
+        self.fill(history, 60)
+        timestamps, values = history.between(self.t0 + timedelta(seconds=20),
+                                             self.t0 + timedelta(seconds=25))
+        self.assertEqual(list(values), [21, 22, 23, 24, 25])
+        timestamps, values = history.between(self.t0 + timedelta(seconds=57))
+        self.assertEqual(list(values), [58, 59])
+
+    def test_clear(self):
+        """
+        History / clear removes every sample
+        """
+        history = History(capacity=3)
+        self.fill(history, 4)
+        history.clear()
+        self.assertEqual(len(history), 0)
+        self.assertEqual(len(history.values), 0)
+
+    def test_merge(self):
+        """
+        History / Merged samples are put in order, known ones are ignored
+        """
+        for history in (History(capacity=5), CompressedHistory(capacity=5, block_size=2)):
+            history.append(self.t0 + timedelta(seconds=3), 3)
+            history.append(self.t0 + timedelta(seconds=5), 5)
+            added = history.merge([self.t0 + timedelta(seconds=i) for i in (0, 1, 2, 3, 4)],
+                                  ['a', 'b', 'c', 'd', 'e'])
+            self.assertEqual(added, 4)
+            self.assertEqual(list(history.values), ['b', 'c', 3, 'e', 5])
+
+    def test_update_last(self):
+        """
+        History / The last valid reading is kept apart from the samples
+        """
+        for history in (History(capacity=2), CompressedHistory(capacity=2)):
+            self.assertIsNone(history.last)
+            history.update_last(self.t0 + timedelta(seconds=5), 5)
+            history.update_last(self.t0 + timedelta(seconds=1), 1, newer_only=True)
+            self.assertEqual(history.last, (self.t0 + timedelta(seconds=5), 5))
+            history.update_last(self.t0 + timedelta(seconds=1), 1)
+            self.assertEqual(history.last, (self.t0 + timedelta(seconds=1), 1))
+            history.clear()
+            self.assertEqual(history.last[1], 1)
+
+    def test_snapshot_of_full_ring_is_a_copy(self):
+        """
+        History / A full ring gives copies that later appends don't change
+        """
+        history = History(capacity=3)
+        self.fill(history, 2)
+        timestamps, values = history.snapshot()
+        self.fill(history, 1)
+        self.assertEqual(list(values), [0, 1])
+        timestamps, values = history.snapshot()
+        history.append(self.t0, 'new')
+        self.assertEqual(list(values), [0, 1, 0])
+        self.assertEqual(len(timestamps), 3)
+
+    def test_snapshot_while_appending(self):
+        """
+        History / Timestamps and values of a snapshot always match
+        """
+        from threading import Thread
+        for history in (History(capacity=100), History(), CompressedHistory(block_size=16)):
+            stop = []
+
+            def append():
+                i = 0
+                while not stop:
+                    history.append(self.t0 + timedelta(seconds=i), i)
+                    i += 1
+            thread = Thread(target=append)
+            thread.start()
+            try:
+                for _ in range(200):
+                    timestamps, values = history.snapshot()
+                    self.assertEqual(len(timestamps), len(values))
+                    if len(values):
+                        self.assertEqual(
+                            timestamps[-1],
+                            np.datetime64(self.t0 + timedelta(seconds=int(values[-1])), 'ns'))
+            finally:
+                stop.append(True)
+                thread.join()
+
+    def test_merge_during_appends(self):
+        """
+        History / Readings appended while a merge rebuilds the history are kept
+        """
+        from threading import Thread
+        for history in (History(), CompressedHistory(dtype='float64', block_size=64)):
+            now = datetime.now()
+
+            def poll():
+                for i in range(2000):
+                    history.append(now + timedelta(milliseconds=i), float(i))
+            thread = Thread(target=poll)
+            thread.start()
+            for k in range(20):
+                history.merge([now - timedelta(seconds=k * 100 + j + 1) for j in range(100)],
+                              [float(j) for j in range(100)])
+            thread.join()
+            self.assertEqual(len(history), 4000)
+
+
+class TestCompressedHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.t0 = datetime(2017, 1, 1)
+
+    def fill(self, history, count):
+        for i in range(count):
+            history.append(self.t0 + timedelta(seconds=10 * i, microseconds=i % 7), i / 10)
+
+    def test_encode_decode(self):
+        """
+        History / Compressed blocks decode to the original samples
+        """
+        timestamps = [0, 10, 20, 31, 1000000000000, 1000000000010]
+        values = [20.0, 20.0, 20.5, float('nan'), -1e300, 0.0]
+        decoded_timestamps, decoded_values = decode(encode(timestamps, values))
+        self.assertEqual(decoded_timestamps, timestamps)
+        self.assertEqual(decoded_values[:3] + decoded_values[4:], values[:3] + values[4:])
+        self.assertTrue(math.isnan(decoded_values[3]))
+
+    def test_same_samples_as_history(self):
+        """
+        History / CompressedHistory returns the samples of History
+        """
+        history = History(dtype='float64')
+        compressed = CompressedHistory(dtype='float64', block_size=16)
+        self.fill(history, 100)
+        self.fill(compressed, 100)
+        self.assertEqual(len(compressed), 100)
+        self.assertEqual(list(compressed.timestamps), list(history.timestamps))
+        self.assertEqual(list(compressed.values), list(history.values))
+        start = self.t0 + timedelta(seconds=200)
+        end = self.t0 + timedelta(seconds=500)
+        self.assertEqual(list(compressed.between(start, end)[1]),
+                         list(history.between(start, end)[1]))
+
+    def test_bounded(self):
+        """
+        History / A bounded CompressedHistory keeps the last samples
+        """
+        compressed = CompressedHistory(capacity=10, dtype='float64')
+        self.fill(compressed, 35)
+        self.assertEqual(len(compressed), 10)
+        self.assertEqual(list(compressed.values), [i / 10 for i in range(25, 35)])
+
+    def test_states(self):
+        """
+        History / Values that are not floats are kept as they were read
+        """
+        compressed = CompressedHistory(block_size=2)
+        for i, value in enumerate(['active', 'inactive', 'active', 3]):
+            compressed.append(self.t0 + timedelta(seconds=i), value)
+        self.assertEqual(list(compressed.values), ['active', 'inactive', 'active', 3])
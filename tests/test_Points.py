@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test points : last value, deadband and value cache
+--------------------------------------------------
+"""
+
+from fake_device import make_device, analog, binary
+
+from datetime import datetime, timedelta
+import math
+import time
+import unittest
+
+
+def make_point(obj=None, **kwargs):
+    """
+    Point of a device holding only it
+
+    :param obj: object of the point (analog AV1 = 1.0 by default)
+    :param kwargs: parameters of Device (ex. deadband=0.5)
+    """
+    return make_device([obj or analog('analogValue', 1, 'AV1', 1.0)], **kwargs).points[0]
+
+
+class TestPointLastValue(unittest.TestCase):
+
+    def test_last_value_skips_invalid(self):
+        """
+        Points / lastValue returns the last valid reading
+        """
+        point = make_point()
+        point._trend(21.5)
+        point._trend(None)
+        self.assertEqual(point.lastValue, 21.5)
+        self.assertEqual(len(point), 3)
+
+    def test_merge_updates_last_value(self):
+        """
+        Points / Merged readings newer than the last one become lastValue
+        """
+        point = make_point()
+        past = datetime.now() - timedelta(hours=1)
+        self.assertEqual(point._merge([past], [5.0]), 1)
+        self.assertEqual(point.lastValue, 1.0)
+        future = datetime.now() + timedelta(hours=1)
+        point._merge([future, future - timedelta(minutes=1)], [7.0, None])
+        self.assertEqual(point.lastValue, 7.0)
+        self.assertEqual(len(point), 4)
+
+
+class TestDeadband(unittest.TestCase):
+
+    def test_absolute_deadband(self):
+        """
+        Points / Numeric readings within the deadband are not kept
+        """
+        point = make_point(analog('analogValue', 1, 'AV1', 20.0), deadband=0.5)
+        for value in (20.2, 20.4, 20.6, 20.7, None, None, 21.0):
+            point._trend(value)
+        values = list(point.history.values)
+        self.assertEqual(values[:2], [20.0, 20.6])
+        self.assertTrue(math.isnan(values[2]))
+        self.assertEqual(values[3:], [21.0])
+        self.assertEqual(point.lastValue, 21.0)
+
+    def test_percent_deadband_on_point(self):
+        """
+        Points / A point deadband in percent overrides the device one
+        """
+        point = make_point(analog('analogValue', 1, 'AV1', 100.0), deadband=50)
+        point.properties.deadband = '1%'
+        for value in (100.5, 101.5, 101.0):
+            point._trend(value)
+        self.assertEqual(list(point.history.values), [100.0, 101.5])
+        self.assertEqual(point.lastValue, 101.0)
+
+    def test_states_and_heartbeat(self):
+        """
+        Points / States are kept on change, or when the heartbeat is due
+        """
+        point = make_point(binary('binaryValue', 1, 'BV1'), deadband=0, heartbeat=3600)
+        for value in ('inactive', 'active', 'active', 'inactive'):
+            point._trend(value)
+        self.assertEqual(list(point.history.values), ['inactive', 'active', 'inactive'])
+        point.properties.heartbeat = 0
+        point._trend('inactive')
+        self.assertEqual(len(point), 4)
+
+
+class TestValueCache(unittest.TestCase):
+
+    def setUp(self):
+        self.point = make_point(analog('analogValue', 1, 'AV1', 21.0))
+        self.network = self.point.properties.device.properties.network
+        self.network.read.return_value = 22.0
+
+    def test_fresh_value_is_not_read(self):
+        """
+        Points / Operators use the last value when read less than max_age ago
+        """
+        self.assertTrue(20 < self.point < 25)
+        self.assertEqual(self.network.read.call_count, 2)
+
+        self.point.properties.device.properties.max_age = 10
+        self.assertTrue(20 < self.point < 25)
+        self.assertEqual(self.point.value, 22.0)
+        self.assertEqual(self.network.read.call_count, 2)
+
+        timestamp, value = self.point._history.last
+        self.point._history.last = (timestamp - timedelta(seconds=11), value)
+        self.assertEqual(self.point + 1, 23.0)
+        self.assertEqual(self.network.read.call_count, 3)
+
+        # Written, not read since
+        self.point.properties.device._pending_writes['AV1'] = self.point
+        self.point.value
+        self.assertEqual(self.network.read.call_count, 4)
+
+    def test_concurrent_reads_are_shared(self):
+        """
+        Points / Callers asking for the value during a read share its answer
+        """
+        from threading import Event, Thread
+        answer = Event()
+        self.network.read.side_effect = lambda args: answer.wait(5) and 23.0
+        values = []
+        threads = [Thread(target=lambda: values.append(self.point.value)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        # Threads are started : all of them wait for the read in progress
+        time.sleep(0.2)
+        answer.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(values, [23.0] * 4)
+        self.assertEqual(self.network.read.call_count, 1)
+        self.assertEqual(len(self.point), 2)
+
+    def test_read_after_write_is_not_shared(self):
+        """
+        Points / The read after a write doesn't reuse a read sent before it
+        """
+        from threading import Event, Thread
+        answer = Event()
+        values = iter([10.0, 50.0])
+
+        def read(args):
+            value = next(values)
+            if value == 10.0:
+                answer.wait(5)
+            return value
+        self.network.read.side_effect = read
+        thread = Thread(target=lambda: self.point.value)
+        thread.start()
+        time.sleep(0.1)
+        self.point.write(50)
+        self.assertEqual(self.network.read.call_count, 2)
+        self.assertEqual(self.point.lastValue, 50.0)
+        answer.set()
+        thread.join(5)
@@ -132,6 +132,66 @@ class TestReadProperty(unittest.TestCase):
         with self.assertRaises(ApplicationNotStarted):
             self.read_property.read(self.req)
 
+    @patch('BAC0.core.io.Read.deferred')
+    def test_read_async_returns_future(self, mock_deferred):
+        """
+        TestReadProperty / read_async must not block and future must hold the value once answered
+        """
+        iocbs = []
+        mock_deferred.side_effect = lambda fn, iocb: iocbs.append(iocb)
+        future = self.read_property.read_async(self.req)
+        self.assertFalse(future.done())
+        iocbs[0].complete(ReadPropertyACK(
+            objectIdentifier=('analogValue', 1),
+            propertyIdentifier='presentValue',
+            propertyValue=Any(Real(32)), ))
+        self.assertEqual(future.result(timeout=1), 32)
+
+    @patch('BAC0.core.io.Read.deferred')
+    def test_read_async_is_awaitable(self, mock_deferred):
+        """
+        TestReadProperty / read_async future can be awaited from a coroutine
+        """
+        import asyncio
+        mock_deferred.side_effect = lambda fn, iocb: iocb.complete(ReadPropertyACK(
+            objectIdentifier=('analogValue', 1),
+            propertyIdentifier='presentValue',
+            propertyValue=Any(Real(21)), ))
+
+        async def _read():
+            return await self.read_property.read_async(self.req)
+        self.assertEqual(asyncio.run(_read()), 21)
+
+    @patch('BAC0.core.io.Read.deferred')
+    def test_read_async_bad_request(self, mock_deferred):
+        """
+        TestReadProperty / A request that can't be built gives a failed future
+        """
+        future = self.read_property.read_async('2:5 analogVal 1 presentValue')
+        self.assertIsInstance(future.exception(timeout=1), ValueError)
+        self.assertFalse(mock_deferred.called)
+
+    @patch('BAC0.core.io.Read.deferred')
+    def test_readMultiple_async_bad_request(self, mock_deferred):
+        """
+        TestReadProperty / A multiple request that can't be built gives a failed future
+        """
+        future = self.read_property.readMultiple_async('2:5 analogVal 1 presentValue')
+        self.assertIsInstance(future.exception(timeout=1), ValueError)
+        self.assertFalse(mock_deferred.called)
+
+    @patch('BAC0.core.io.Read.deferred')
+    def test_await_bad_request(self, mock_deferred):
+        """
+        TestReadProperty / Awaiting a request that can't be built raises its error
+        """
+        import asyncio
+
+        async def _read():
+            return await self.read_property.read_async('2:5 analogVal 1 presentValue')
+        with self.assertRaises(ValueError):
+            asyncio.run(_read())
+
 
 def create_ReadPropertyRequest(args):
     """
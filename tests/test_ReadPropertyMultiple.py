@@ -7,6 +7,7 @@ Test Read Property
 """
 
 from BAC0.core.io.Read import ReadProperty
+from BAC0.core.io.Futures import pipelined
 from BAC0.core.app.ScriptApplication import SimpleApplication
 
 from mock import Mock, patch, call
@@ -24,10 +25,14 @@ from bacpypes.iocb import IOCB
 from bacpypes.constructeddata import Any
 from bacpypes.primitivedata import Real, CharacterString, Enumerated
 
-from threading import Event, Lock
+from concurrent.futures import Future
+from threading import Event, Lock, Timer
 from queue import Empty
 
-from BAC0.core.io.IOExceptions import ReadPropertyException, ReadPropertyMultipleException, NoResponseFromController, ApplicationNotStarted
+from fake_device import make_device, analog, binary
+
+from BAC0.core.io.IOExceptions import ReadPropertyException, ReadPropertyMultipleException, NoResponseFromController, ApplicationNotStarted, \
+    SegmentationNotSupported
 
 
 
@@ -163,6 +168,265 @@ class TestReadPropertyMultiple(unittest.TestCase):
             self.read_property.readMultiple(self.req)
 
 
+class TestPipelined(unittest.TestCase):
+
+    def test_in_flight_window(self):
+        """
+        TestReadPropertyMultiple / No more than max_in_flight requests wait for an answer
+        """
+        sent = []
+
+        def send(request):
+            sent.append(request)
+            future = Future()
+            future.set_result(request)
+            return future
+
+        results = pipelined(range(5), send, 2)
+        self.assertEqual(sent, [])
+        self.assertEqual(next(results).result(), 0)
+        self.assertEqual(sent, [0, 1])
+        self.assertEqual(next(results).result(), 1)
+        self.assertEqual(sent, [0, 1, 2])
+        self.assertEqual([future.result() for future in results], [2, 3, 4])
+
+    def test_request_order(self):
+        """
+        TestReadPropertyMultiple / Answers are given in the order of the requests
+        """
+        def send(request):
+            # Later requests are answered first
+            future = Future()
+            Timer(0.05 * (4 - request), future.set_result, (request,)).start()
+            return future
+
+        self.assertEqual([future.result() for future in pipelined(range(4), send, 4)],
+                         [0, 1, 2, 3])
+
+    def test_no_answer(self):
+        """
+        TestReadPropertyMultiple / A request never answered fails after the timeout
+        """
+        futures = list(pipelined(range(2), lambda request: Future(), 2, timeout=0.01))
+        self.assertEqual(len(futures), 2)
+        for future in futures:
+            self.assertIsInstance(future.exception(), NoResponseFromController)
+
+    @patch('BAC0.core.io.Futures.deferred')
+    def test_unanswered_request_is_aborted(self, mock_deferred):
+        """
+        TestReadPropertyMultiple / A request without answer is aborted before the next one is sent
+        """
+        from BAC0.core.io.Futures import IOCBFuture
+        from bacpypes.iocb import IOCB, ABORTED
+        mock_deferred.side_effect = lambda fn, *args: fn(*args)
+        iocbs = []
+
+        def send(request):
+            # The previous request left the window
+            self.assertTrue(all(iocb.ioState == ABORTED for iocb in iocbs))
+            iocbs.append(IOCB())
+            return IOCBFuture(iocbs[-1], lambda iocb: iocb.ioResponse)
+
+        futures = list(pipelined(range(3), send, 1, timeout=0.01))
+        self.assertEqual(len(iocbs), 3)
+        self.assertTrue(all(iocb.ioState == ABORTED for iocb in iocbs))
+        for future in futures:
+            self.assertIsInstance(future.exception(), NoResponseFromController)
+
+
+class TestDeviceReadMultiple(unittest.TestCase):
+
+    def setUp(self):
+        self.device = make_device([analog('analogValue', i, 'AV{}'.format(i)) for i in range(6)])
+        self.requests = []
+        # Requests refused as too big (2nd one by default)
+        self.refused = [2]
+
+    def answer(self, args, **kwargs):
+        """
+        Values read are the instances of the objects
+        """
+        self.requests.append(args)
+        future = Future()
+        if len(self.requests) in self.refused:
+            future.set_exception(SegmentationNotSupported())
+        else:
+            args = args.split()
+            future.set_result([float(args[i]) for i in range(2, len(args), 3)])
+        return future
+
+    def test_values_in_order(self):
+        """
+        TestReadPropertyMultiple / Values read go to the points of each request
+        """
+        self.refused = []
+        self.device.properties.network.readMultiple_async.side_effect = self.answer
+        self.device.read_multiple(self.device.points_name, points_per_request=2)
+        self.assertEqual(len(self.requests), 3)
+        for i, point in enumerate(self.device.points):
+            self.assertEqual(point.lastValue, i)
+
+    def test_unanswered_request_is_skipped(self):
+        """
+        TestReadPropertyMultiple / Requests after one without answer are still read
+        """
+        def answer(args, **kwargs):
+            if not self.requests:
+                self.requests.append(args)
+                future = Future()
+                future.set_exception(NoResponseFromController())
+                return future
+            return self.answer(args)
+        self.refused = []
+        self.device.properties.network.readMultiple_async.side_effect = answer
+        self.device.read_multiple(self.device.points_name, points_per_request=2)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual([len(point.history) for point in self.device.points], [1, 1, 2, 2, 2, 2])
+
+    def test_refused_request_only_retries_the_rest(self):
+        """
+        TestReadPropertyMultiple / After a request too big, points already read are not read again
+        """
+        self.device.properties.network.readMultiple_async.side_effect = self.answer
+        self.device.read_multiple(self.device.points_name, points_per_request=2,
+                                  max_in_flight=1)
+        self.assertFalse(self.device.properties.segmentation_supported)
+        for i, point in enumerate(self.device.points):
+            self.assertEqual(point.lastValue, i)
+            # Initial value and one reading
+            self.assertEqual(len(point.history), 2)
+        retried = ' '.join(self.requests[2:])
+        self.assertNotIn('analogValue 0 ', retried)
+        self.assertIn('analogValue 2 ', retried)
+
+    def test_refused_poll_only_retries_the_rest(self):
+        """
+        TestReadPropertyMultiple / Same for the poll plan
+        """
+        # 2 points per request
+        self.device.properties.max_apdu_length = 30
+        self.assertEqual(len(self.device.poll_plan.batches), 3)
+
+        def answer(request, datatypes=None, **kwargs):
+            self.requests.append(request)
+            future = Future()
+            if len(self.requests) in self.refused:
+                future.set_exception(SegmentationNotSupported())
+            else:
+                future.set_result([float(spec.objectIdentifier[1])
+                                   for spec in request.listOfReadAccessSpecs])
+            return future
+        self.device.properties.network.send_rpm_request.side_effect = answer
+        self.device.properties.network.readMultiple_async.side_effect = self.answer
+        self.device.read_poll_plan(max_in_flight=1)
+        for i, point in enumerate(self.device.points):
+            self.assertEqual(point.lastValue, i)
+            self.assertEqual(len(point.history), 2)
+
+
+class TestPollPlan(unittest.TestCase):
+
+    def setUp(self):
+        # 2 points per request
+        self.device = make_device([analog('analogValue', i, 'AV{}'.format(i)) for i in range(3)]
+                                  + [binary('binaryValue', 1, 'BV1')], max_apdu_length=30)
+
+    def polled(self):
+        return [[point.properties.name for point in points]
+                for read_access_specs, points in self.device.poll_plan.batches]
+
+    def test_plan(self):
+        """
+        TestReadPropertyMultiple / Points are packed in requests read with known datatypes
+        """
+        plan = self.device.poll_plan
+        self.assertIs(self.device.poll_plan, plan)
+        self.assertEqual(self.polled(), [['AV0', 'AV1'], ['AV2', 'BV1']])
+        specs = plan.batches[1][0]
+        self.assertEqual([spec.objectIdentifier for spec in specs],
+                         [('analogValue', 2), ('binaryValue', 1)])
+        self.assertEqual([[ref.propertyIdentifier for ref in spec.listOfPropertyReferences]
+                          for spec in specs], [['presentValue'], ['presentValue']])
+        self.assertEqual(plan.datatypes,
+                         {('analogValue', 'presentValue'): get_datatype('analogValue', 'presentValue'),
+                          ('binaryValue', 'presentValue'): get_datatype('binaryValue', 'presentValue')})
+        requests = list(plan.requests())
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[0].pduDestination, Address('2:5'))
+        self.assertEqual(requests[1].listOfReadAccessSpecs, specs)
+
+        def answer(request, datatypes=None):
+            self.assertIs(datatypes, plan.datatypes)
+            future = Future()
+            future.set_result([1.0] * len(request.listOfReadAccessSpecs))
+            return future
+        network = self.device.properties.network
+        network.send_rpm_request.side_effect = answer
+        self.device.read_poll_plan()
+        self.assertEqual(network.send_rpm_request.call_count, 2)
+        self.assertEqual(self.device['AV2'].lastValue, 1.0)
+
+    def test_empty_answer_reduces_requests(self):
+        """
+        TestReadPropertyMultiple / A poll request answered without values is taken as too big
+        """
+        def answer(request, datatypes=None):
+            future = Future()
+            future.set_result(None)
+            return future
+
+        def read_multiple(args, **kwargs):
+            future = Future()
+            future.set_result([3.0 if obj_type.startswith('analog') else 'active'
+                               for obj_type in args.split()[1::3]])
+            return future
+        network = self.device.properties.network
+        network.send_rpm_request.side_effect = answer
+        network.readMultiple_async.side_effect = read_multiple
+        self.device.read_poll_plan()
+        self.assertFalse(self.device.properties.segmentation_supported)
+        self.assertEqual([len(point.history) for point in self.device.points], [2, 2, 2, 2])
+
+    def test_poll_goes_on_without_answer(self):
+        """
+        TestReadPropertyMultiple / A poll request without answer doesn't stop the poll
+        """
+        def answer(request, datatypes=None):
+            future = Future()
+            if request.listOfReadAccessSpecs[0].objectIdentifier[1] == 0:
+                future.set_exception(NoResponseFromController())
+            else:
+                future.set_result([2.0] * len(request.listOfReadAccessSpecs))
+            return future
+        self.device.properties.network.send_rpm_request.side_effect = answer
+        self.device.read_poll_plan()
+        points = {point.properties.name: point for point in self.device.points}
+        self.assertEqual(len(points['AV0'].history), 1)
+        self.assertEqual(points['AV2'].lastValue, 2.0)
+        self.assertEqual(len(points['BV1'].history), 2)
+
+    def test_plan_rebuilt_with_points(self):
+        """
+        TestReadPropertyMultiple / Assigning points rebuilds the plan
+        """
+        plan = self.device.poll_plan
+        self.device.points = self.device.points[:1]
+        self.assertIsNot(self.device.poll_plan, plan)
+        self.assertEqual(self.polled(), [['AV0']])
+
+    def test_cov_points_not_polled(self):
+        """
+        TestReadPropertyMultiple / Points updated by COV are left out of the plan
+        """
+        # As done by subscribe_cov
+        self.device._cov_subscriptions['AV1'] = 10
+        self.device._cov_subscriptions['BV1'] = 11
+        self.device._poll_plan = None
+        self.assertEqual(self.polled(), [['AV0', 'AV2']])
+        self.assertNotIn(('binaryValue', 'presentValue'), self.device.poll_plan.datatypes)
+
+
 def create_ReadPropertyMultipleRequest(args):
     """
     Create a request to compare with called arg
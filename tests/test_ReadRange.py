@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test trend log retrieval
+------------------------
+"""
+
+from BAC0.core.io.ReadRange import ReadRange, RangeResult, to_bacnet_datetime
+from BAC0.core.io.IOExceptions import SegmentationNotSupported
+
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from mock import Mock
+import unittest
+
+from bacpypes.apdu import ReadRangeACK, APDU, AbortPDU
+from bacpypes.basetypes import LogRecord, LogRecordLogDatum, ResultFlags, \
+    DeviceObjectPropertyReference
+from bacpypes.constructeddata import ListOf, SequenceOfAny
+
+from fake_device import make_device, binary
+
+
+T0 = datetime(2017, 1, 1, 8, 0, 0, 250000)
+
+
+def log_records(count, first=0):
+    return [(T0 + timedelta(minutes=first + i), float(first + i)) for i in range(count)]
+
+
+class TestReadRange(unittest.TestCase):
+
+    def setUp(self):
+        self.network = ReadRange()
+        self.network.this_application = Mock()
+        self.network._started = True
+
+    def test_request(self):
+        """
+        ReadRange / Requests by position, sequence number and time
+        """
+        request = self.network.build_readrange_request('2:5 trendLog 1'.split(), by='time',
+                                                       reference=T0, count=10)
+        self.assertEqual(request.propertyIdentifier, 'logBuffer')
+        self.assertEqual(request.range.byTime.count, 10)
+        self.assertEqual(request.range.byTime.referenceTime.time, (8, 0, 0, 25))
+        request = self.network.build_readrange_request('2:5 trendLog 1'.split(), by='sequence',
+                                                       reference=12, count=-5)
+        self.assertEqual(request.range.bySequenceNumber.referenceSequenceNumber, 12)
+        with self.assertRaises(ValueError):
+            self.network.build_readrange_request('2:5 trendLog 1'.split(), by='index',
+                                                 reference=1, count=1)
+
+    def test_answer_is_decoded(self):
+        """
+        ReadRange / Records are decoded, status records are skipped
+        """
+        records = [LogRecord(timestamp=to_bacnet_datetime(T0),
+                             logDatum=LogRecordLogDatum(realValue=21.5)),
+                   LogRecord(timestamp=to_bacnet_datetime(T0),
+                             logDatum=LogRecordLogDatum(logStatus=[0, 1, 0])),
+                   LogRecord(timestamp=to_bacnet_datetime(T0 + timedelta(minutes=1)),
+                             logDatum=LogRecordLogDatum(booleanValue=False))]
+        ack = ReadRangeACK(objectIdentifier=('trendLog', 1), propertyIdentifier='logBuffer',
+                           resultFlags=ResultFlags([1, 0, 1]), itemCount=3,
+                           itemData=SequenceOfAny(ListOf(LogRecord)(records)),
+                           firstSequenceNumber=5)
+        ack.apduInvokeID = 1
+        apdu = APDU()
+        ack.encode(apdu)
+        answer = ReadRangeACK()
+        answer.decode(apdu)
+
+        future = self.network.readRange_async('2:5 trendLog 1', by='position',
+                                              reference=1, count=3)
+        future.iocb.complete(answer)
+        result = future.result()
+        self.assertEqual(result.records, [(T0, 21.5), (T0 + timedelta(minutes=1), False)])
+        self.assertEqual(result.item_count, 3)
+        self.assertEqual(result.first_sequence_number, 5)
+        self.assertTrue(result.more_items)
+
+    def test_read_log_pages(self):
+        """
+        ReadRange / read_log follows sequence numbers up to end
+        """
+        log = log_records(25)
+        requests = []
+
+        def read_range(args, *, by, reference, count):
+            requests.append((by, reference, count))
+            if by == 'time':
+                first = [i for i, record in enumerate(log) if record[0] > reference][0]
+            else:
+                first = reference - 1
+            if count > 8:
+                raise SegmentationNotSupported()
+            records = log[first:first + count]
+            return RangeResult(records, len(records), first + 1, first + count < len(log))
+
+        self.network.readRange = read_range
+        pages = list(self.network.read_log('2:5 trendLog 1', start=log[2][0], end=log[20][0],
+                                           page_size=10))
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 3])
+        self.assertEqual([record for page in pages for record in page], log[3:21])
+        self.assertEqual(requests[:3], [('time', log[2][0], 10), ('time', log[2][0], 5),
+                                        ('sequence', 9, 5)])
+
+    def test_too_big_answer(self):
+        """
+        ReadRange / An abort because of the size raises SegmentationNotSupported
+        """
+        future = self.network.readRange_async('2:5 trendLog 1')
+        future.iocb.abort(AbortPDU(reason='segmentationNotSupported'))
+        with self.assertRaises(SegmentationNotSupported):
+            future.result()
+
+
+class TestBackfill(unittest.TestCase):
+
+    def test_backfill_merges_records(self):
+        """
+        ReadRange / Trend log records are merged in the point history
+        """
+        device = make_device([binary('binaryValue', 1, 'BV1'), ('trendLog', 3, {})])
+        network = device.properties.network
+        reference = Future()
+        reference.set_result(DeviceObjectPropertyReference(
+            objectIdentifier=('binaryValue', 1), propertyIdentifier='presentValue'))
+        network.read_async.return_value = reference
+        network.read_log.return_value = iter([
+            [(T0, 1), (T0 + timedelta(minutes=1), 0)], [(T0 + timedelta(minutes=2), 1)]])
+        self.assertEqual(device.backfill(), {'BV1': 3})
+        self.assertEqual(list(device._findPoint('BV1', force_read=False).history.values),
+                         ['active', 'inactive', 'active', 'inactive'])
+        self.assertEqual(device.properties.network.read_log.call_args[0][0], '2:5 trendLog 3')
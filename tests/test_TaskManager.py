@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test task scheduling
+--------------------
+"""
+
+from BAC0.tasks.TaskManager import Task
+from BAC0.tasks.DoOnce import DoOnce
+
+from threading import Event
+import time
+import unittest
+
+
+class Counter(Task):
+
+    def __init__(self, lock_key=None, duration=0, delay=0.01, fixed_rate=False):
+        self.count = 0
+        self.duration = duration
+        self.times = []
+        Task.__init__(self, delay=delay, lock_key=lock_key, fixed_rate=fixed_rate)
+
+    def task(self):
+        self.count += 1
+        self.times.append(time.time())
+        time.sleep(self.duration)
+
+
+class TestTaskManager(unittest.TestCase):
+
+    def test_slow_task_does_not_block_others(self):
+        """
+        TaskManager / A slow task doesn't delay tasks on other keys
+        """
+        slow = Counter(lock_key='slow device', duration=0.5)
+        fast = Counter(lock_key='fast device')
+        slow.start()
+        fast.start()
+        time.sleep(0.3)
+        slow.stop()
+        fast.stop()
+        self.assertEqual(slow.count, 1)
+        self.assertGreater(fast.count, 5)
+        slow.join(1)
+        self.assertFalse(slow.is_alive())
+
+    def test_stop(self):
+        """
+        TaskManager / A stopped task is not executed anymore
+        """
+        task = Counter()
+        task.start()
+        time.sleep(0.05)
+        task.stop()
+        task.join(1)
+        count = task.count
+        time.sleep(0.05)
+        self.assertEqual(task.count, count)
+
+    def test_stop_then_start(self):
+        """
+        TaskManager / A task stopped and started again runs once per delay
+        """
+        task = Counter(delay=0.2)
+        task.start()
+        time.sleep(0.05)
+        task.stop()
+        self.assertFalse(task.is_alive())
+        task.start()
+        time.sleep(1.0)
+        task.stop()
+        task.join(1)
+        # 1 + 5 runs (0.05 s, then every 0.2 s), not twice as many
+        self.assertLessEqual(task.count, 7)
+        self.assertGreaterEqual(task.count, 5)
+
+    def test_join_waits_for_execution(self):
+        """
+        TaskManager / join() returns once the execution in progress ends
+        """
+        task = Counter(duration=0.3, delay=1)
+        task.start()
+        time.sleep(0.1)
+        task.stop()
+        self.assertTrue(task.is_alive())
+        task.join(1)
+        self.assertFalse(task.is_alive())
+        self.assertEqual(task.count, 1)
+
+    def test_fixed_rate(self):
+        """
+        TaskManager / Fixed rate tasks run on a grid, whatever their duration
+        """
+        task = Counter(duration=0.05, delay=0.1, fixed_rate=True)
+        task.start()
+        time.sleep(0.55)
+        task.stop()
+        for each in task.times:
+            offset = each % 0.1
+            self.assertLess(min(offset, 0.1 - offset), 0.03)
+        self.assertGreaterEqual(task.count, 4)
+        self.assertEqual(task.overruns, 0)
+
+    def test_fixed_rate_overruns(self):
+        """
+        TaskManager / Cycles missed by a long execution are skipped and counted
+        """
+        task = Counter(duration=0.25, delay=0.1, fixed_rate=True)
+        task.start()
+        time.sleep(0.6)
+        task.stop()
+        task.join(1)
+        self.assertGreater(task.overruns, 0)
+        self.assertLessEqual(task.count, 3)
+
+    def test_do_once(self):
+        """
+        TaskManager / DoOnce executes the function in a worker
+        """
+        done = Event()
+        DoOnce(done.set).start()
+        self.assertTrue(done.wait(1))
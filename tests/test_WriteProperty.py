@@ -11,6 +11,8 @@ from BAC0.core.app.ScriptApplication import SimpleApplication
 from BAC0.core.io.IOExceptions import WritePropertyException, WritePropertyCastError, NoResponseFromController, ApplicationNotStarted
 
 from mock import Mock, patch, call
+from threading import Lock
+import time
 import unittest
 
 from bacpypes.app import BIPSimpleApplication
@@ -25,6 +27,8 @@ from bacpypes.constructeddata import Array, Any
 from threading import Event, Lock
 from queue import Queue, Empty
 
+from fake_device import make_device, analog, binary
+
 
 class TestSimpleApplication(SimpleApplication):
     """
@@ -219,3 +223,277 @@ def create_WritePropertyRequest(args):
     if priority is not None:
         request.priority = priority
     return request
+
+
+class TestWritePropertyMultiple(unittest.TestCase):
+
+    def setUp(self):
+        self.network = WriteProperty()
+        self.network.this_application = Mock()
+        self.network._started = True
+
+    def test_request(self):
+        """
+        TestWriteProperty / Writes to the same object share a WriteAccessSpecification
+        """
+        request = self.network.build_wpm_request('2:5', [
+            'analogValue 1 presentValue 100 - 8'.split(),
+            'analogValue 1 description test'.split(),
+            'binaryValue 2 presentValue active'.split()])
+        specs = request.listOfWriteAccessSpecs
+        self.assertEqual([spec.objectIdentifier for spec in specs],
+                         [('analogValue', 1), ('binaryValue', 2)])
+        self.assertEqual(specs[0].listOfProperties[0].priority, 8)
+        self.assertEqual(specs[0].listOfProperties[1].propertyIdentifier, 'description')
+
+    def test_refused_write(self):
+        """
+        TestWriteProperty / A refused WritePropertyMultiple tells the first failed write
+        """
+        from bacpypes.apdu import WritePropertyMultipleError
+        from bacpypes.basetypes import ErrorType, ObjectPropertyReference
+        from BAC0.core.io.IOExceptions import WritePropertyMultipleException
+        future = self.network.writeMultiple_async('2:5', ['analogValue 1 presentValue 100'])
+        future.iocb.abort(WritePropertyMultipleError(
+            errorType=ErrorType(errorClass='property', errorCode='writeAccessDenied'),
+            firstFailedWriteAttempt=ObjectPropertyReference(
+                objectIdentifier=('analogValue', 1), propertyIdentifier='presentValue')))
+        with self.assertRaises(WritePropertyMultipleException) as context:
+            future.result()
+        self.assertEqual(context.exception.args[1], (('analogValue', 1), 'presentValue'))
+
+    def test_bad_request(self):
+        """
+        TestWriteProperty / A request that can't be built gives a failed future
+        """
+        future = self.network.write_async('2:5 analogValue 1 presValue 100')
+        self.assertIsInstance(future.exception(), TypeError)
+        self.assertFalse(self.network.this_application.request_io.called)
+
+    def test_bad_multiple_request(self):
+        """
+        TestWriteProperty / A multiple request that can't be built gives a failed future
+        """
+        future = self.network.writeMultiple_async('2:5', ['analogValue 1 presentValue 100',
+                                                          'analogValue 2 presentValue abc'])
+        self.assertIsInstance(future.exception(), ValueError)
+        self.assertFalse(self.network.this_application.request_io.called)
+
+    @patch('BAC0.core.io.Write.Any.cast_in')
+    def test_cast_error_is_not_sent(self, mock_cast_in):
+        """
+        TestWriteProperty / A value that can't be cast fails the write instead of sending it empty
+        """
+        mock_cast_in.side_effect = TypeError('bad value')
+        future = self.network.writeMultiple_async('2:5', ['analogValue 1 presentValue 100'])
+        self.assertIsInstance(future.exception(), WritePropertyCastError)
+        self.assertFalse(self.network.this_application.request_io.called)
+
+
+class TestWriteMany(unittest.TestCase):
+
+    def setUp(self):
+        device = make_device([analog('analogValue', i, 'AV{}'.format(i)) for i in range(100)]
+                             + [binary('binaryValue', 1, 'BV1'), analog('analogInput', 1, 'AI1')])
+        # Queued writes are sent by the tests, not by the drain task
+        device._write_drain = Mock()
+        device.read_multiple = Mock()
+        self.device = device
+
+    def done(self, exception=None):
+        from concurrent.futures import Future
+        future = Future()
+        if exception is None:
+            future.set_result(None)
+        else:
+            future.set_exception(exception)
+        return future
+
+    def test_batched_writes(self):
+        """
+        TestWriteProperty / write_many fills WritePropertyMultiple requests and reads back once
+        """
+        network = self.device.properties.network
+        network.writeMultiple_async.side_effect = lambda addr, args: self.done()
+        values = {'AV{}'.format(i): i for i in range(100)}
+        values['BV1'] = True
+        self.assertEqual(self.device.write_many(values, priority=8), [])
+
+        requests = [call[0][1] for call in network.writeMultiple_async.call_args_list]
+        self.assertGreater(len(requests), 1)
+        self.assertLess(len(requests), 10)
+        written = [request for batch in requests for request in batch]
+        self.assertEqual(written[0], 'analogValue 0 presentValue 0 - 8')
+        self.assertEqual(written[-1], 'binaryValue 1 presentValue active - 8')
+        self.device.read_multiple.assert_called_once_with(list(values))
+
+    def test_fallback_to_write_property(self):
+        """
+        TestWriteProperty / write_many uses WriteProperty if WritePropertyMultiple is not supported
+        """
+        from BAC0.core.io.IOExceptions import UnrecognizedService
+        network = self.device.properties.network
+        network.writeMultiple_async.side_effect = lambda addr, args: self.done(UnrecognizedService())
+        network.write_async.side_effect = lambda args: self.done(
+            NoResponseFromController() if args.startswith('2:5 analogValue 2 ') else None)
+        failed = self.device.write_many({'AV1': 1, 'AV2': 2, 'AV3': 3})
+        self.assertEqual(failed, ['AV2'])
+        self.assertEqual(network.write_async.call_count, 3)
+        self.assertFalse(self.device.properties.pss['writePropertyMultiple'])
+        self.device.read_multiple.assert_called_once_with(['AV1', 'AV3'])
+
+    def test_bad_value_is_reported(self):
+        """
+        TestWriteProperty / write_many reports a request that can't be built as a failed point
+        """
+        network = self.device.properties.network
+        network.writeMultiple_async.side_effect = lambda addr, args: self.done(
+            ValueError('could not convert string to float'))
+        network.write_async.side_effect = lambda args: self.done(
+            ValueError() if args.startswith('2:5 analogValue 2 ') else None)
+        self.assertEqual(self.device.write_many({'AV1': 1, 'AV2': 'abc'}), ['AV2'])
+        self.assertEqual(network.write_async.call_count, 2)
+        self.assertTrue(self.device.properties.pss['writePropertyMultiple'])
+
+    def test_refused_write_only_resends_the_rest(self):
+        """
+        TestWriteProperty / Writes before the one refused are not sent again
+        """
+        from BAC0.core.io.IOExceptions import WritePropertyMultipleException
+        network = self.device.properties.network
+        answers = iter([self.done(WritePropertyMultipleException(
+            'Write refused', (('analogValue', 2), 'presentValue'))), self.done()])
+        network.writeMultiple_async.side_effect = lambda addr, args: next(answers)
+        self.assertEqual(self.device.write_many({'AV1': 1, 'AV2': 2, 'AV3': 3}), ['AV2'])
+        requests = [call[0][1] for call in network.writeMultiple_async.call_args_list]
+        self.assertEqual(requests, [['analogValue 1 presentValue 1',
+                                     'analogValue 2 presentValue 2',
+                                     'analogValue 3 presentValue 3'],
+                                    ['analogValue 3 presentValue 3']])
+        self.assertFalse(network.write_async.called)
+        self.device.read_multiple.assert_called_once_with(['AV1', 'AV3'])
+
+    def test_long_values_use_more_requests(self):
+        """
+        TestWriteProperty / Writes are packed using the length of the values
+        """
+        network = self.device.properties.network
+        network.writeMultiple_async.side_effect = lambda addr, args: self.done()
+        self.device.write_many({'AV{}'.format(i): 'x' * 100 for i in range(10)},
+                               prop='description')
+        # About 115 bytes per write in 480 bytes requests
+        self.assertEqual([len(call_args[0][1]) for call_args in
+                          network.writeMultiple_async.call_args_list], [4, 4, 2])
+
+    def test_batch_writes(self):
+        """
+        TestWriteProperty / Points written in batch_writes are read once at the end
+        """
+        network = self.device.properties.network
+        with self.device.batch_writes():
+            for i in range(5):
+                self.device._findPoint('AV{}'.format(i), force_read=False).ovr(i)
+            self.device._findPoint('AV4', force_read=False)._trend(4.0)
+            self.assertEqual(self.device.pending_writes, ['AV0', 'AV1', 'AV2', 'AV3'])
+            self.assertEqual(network.read.call_count, 0)
+        self.assertEqual(network.write.call_count, 5)
+        self.device.read_multiple.assert_called_once_with(['AV0', 'AV1', 'AV2', 'AV3'])
+        self.assertEqual(self.device.pending_writes, [])
+
+    def test_batch_writes_of_other_threads(self):
+        """
+        TestWriteProperty / Writes from other threads don't wait for a batch_writes block
+        """
+        from threading import Thread
+        network = self.device.properties.network
+        with self.device.batch_writes():
+            self.device._findPoint('AV0', force_read=False).ovr(0)
+            thread = Thread(target=lambda: self.device._findPoint('AV1', force_read=False).ovr(1))
+            thread.start()
+            thread.join(2)
+            self.assertEqual(self.device.pending_writes, ['AV0'])
+            self.assertEqual(network.read.call_count, 1)
+        self.device.read_multiple.assert_called_once_with(['AV0'])
+
+    def test_queued_writes_are_coalesced(self):
+        """
+        TestWriteProperty / Only the latest value queued for a property is sent
+        """
+        network = self.device.properties.network
+        network.writeMultiple_async.side_effect = lambda addr, args: self.done()
+        av1 = self.device._findPoint('AV1', force_read=False)
+        ai1 = self.device._findPoint('AI1', force_read=False)
+        for value in range(5):
+            av1._setitem(value, queued=True)
+        ai1._setitem(18, queued=True)
+        self.device.queue_write('AV1', 20, priority=8)
+        self.assertEqual(self.device._write_drain.start.call_count, 1)
+        self.assertEqual(self.device.queued_writes, [('AV1', 'presentValue', None, 4),
+                                                     ('AI1', 'outOfService', None, 'True'),
+                                                     ('AI1', 'presentValue', None, 18),
+                                                     ('AV1', 'presentValue', 8, 20)])
+
+        self.assertEqual(self.device.flush_writes(), [])
+        requests = [call[0][1] for call in network.writeMultiple_async.call_args_list]
+        self.assertEqual(requests, [['analogInput 1 outOfService True'],
+                                    ['analogValue 1 presentValue 4', 'analogInput 1 presentValue 18'],
+                                    ['analogValue 1 presentValue 20 - 8']])
+        self.assertEqual(self.device.queued_writes, [])
+        self.assertEqual(ai1.properties.simulated, (True, 18))
+
+    def test_queue_is_drained(self):
+        """
+        TestWriteProperty / The write queue is sent by its task after write_delay
+        """
+        from threading import Event
+        network = self.device.properties.network
+        sending = Event()
+        release = Event()
+
+        def write_multiple(addr, args):
+            sending.set()
+            release.wait(2)
+            return self.done()
+        network.writeMultiple_async.side_effect = write_multiple
+        self.device.properties.write_delay = 0.05
+        self.device._write_drain = None
+        self.device.queue_write('AV1', 1)
+        self.device.queue_write('AV1', 2)
+        drain = self.device._write_drain
+        self.assertTrue(sending.wait(2))
+        # Queued while the first drain is sending : a second drain follows
+        self.device.queue_write('AV2', 3)
+        time.sleep(0.1)
+        self.assertTrue(drain.is_alive())
+        release.set()
+        drain.join(2)
+        self.assertFalse(drain.is_alive())
+        requests = [call[0][1] for call in network.writeMultiple_async.call_args_list]
+        self.assertEqual(requests, [['analogValue 1 presentValue 2'],
+                                    ['analogValue 2 presentValue 3']])
+        self.assertEqual(self.device.queued_writes, [])
+
+    def test_sim_many_and_release_all(self):
+        """
+        TestWriteProperty / sim_many sets outOfService then values, release_all clears it
+        """
+        network = self.device.properties.network
+        network.writeMultiple_async.side_effect = lambda addr, args: self.done()
+        self.assertEqual(self.device.sim_many({'AI1': 18, 'BV1': True}), [])
+        # Already simulated to that value : nothing sent
+        self.assertEqual(self.device.sim_many({'AI1': 18}), [])
+        requests = [call[0][1] for call in network.writeMultiple_async.call_args_list]
+        self.assertEqual(requests, [['analogInput 1 outOfService True',
+                                     'binaryValue 1 outOfService True'],
+                                    ['analogInput 1 presentValue 18',
+                                     'binaryValue 1 presentValue active']])
+        self.assertEqual([point.properties.name for point in self.device.simulated_points],
+                         ['AI1', 'BV1'])
+
+        network.writeMultiple_async.reset_mock()
+        self.assertEqual(self.device.release_all(), [])
+        requests = [call[0][1] for call in network.writeMultiple_async.call_args_list]
+        self.assertEqual(requests, [['analogInput 1 outOfService False',
+                                     'binaryValue 1 outOfService False']])
+        self.assertEqual(list(self.device.simulated_points), [])
+        self.device.read_multiple.assert_called_with(['AI1', 'BV1'])
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test APDU size estimation
+-------------------------
+"""
+
+from BAC0.core.utils.apdu_size import rpm_sizes, rpm_sizes_from_str, \
+    packed_slices, apdu_budget, wpm_size, REQUEST_HEADER, ACK_HEADER
+
+import unittest
+
+
+class TestAPDUSize(unittest.TestCase):
+
+    def test_sizes_from_str_equals_sizes(self):
+        """
+        APDUSize / Parsing a request string must give the same estimation
+        """
+        self.assertEqual(rpm_sizes_from_str(' analogValue 1 presentValue units'),
+                         rpm_sizes('analogValue', ['presentValue', 'units']))
+
+    def test_slices_fit_in_budget(self):
+        """
+        APDUSize / Every slice must fit in the answer budget
+        """
+        sizes = [rpm_sizes('analogValue', ['presentValue'])] * 200
+        budget = apdu_budget(480)
+        slices = list(packed_slices(sizes, 480, budget))
+        self.assertEqual(sum(s.stop - s.start for s in slices), 200)
+        for each in slices:
+            answer = ACK_HEADER + sum(ans for req, ans in sizes[each])
+            self.assertLessEqual(answer, budget)
+
+    def test_segmentation_allows_bigger_requests(self):
+        """
+        APDUSize / Segmentation must allow more objects per request
+        """
+        sizes = [rpm_sizes('analogValue', ['presentValue'])] * 500
+        single = list(packed_slices(sizes, 1476, apdu_budget(1476)))
+        segmented = list(packed_slices(sizes, 1476 * 4, apdu_budget(1476, True)))
+        self.assertLess(len(segmented), len(single))
+
+    def test_too_big_item_gets_own_slice(self):
+        """
+        APDUSize / An item bigger than the budget is sent alone
+        """
+        sizes = [(10, 10), (10, 1000), (10, 10)]
+        slices = list(packed_slices(sizes, 480, 100))
+        self.assertEqual([(s.start, s.stop) for s in slices],
+                         [(0, 1), (1, 2), (2, 3)])
+
+    def test_max_items(self):
+        """
+        APDUSize / max_items limits the number of objects per slice
+        """
+        sizes = [(REQUEST_HEADER, 1)] * 10
+        slices = list(packed_slices(sizes, 1476, 1476, max_items=3))
+        self.assertEqual([s.stop - s.start for s in slices], [3, 3, 3, 1])
+
+    def test_write_size_includes_value(self):
+        """
+        APDUSize / A long character string counts for its length in a write
+        """
+        self.assertEqual(wpm_size('presentValue', 8, '21.5'), wpm_size('presentValue', 8))
+        self.assertGreater(wpm_size('description', None, 'x' * 300), 300)
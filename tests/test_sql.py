@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test histories saved to SQLite
+------------------------------
+"""
+
+from BAC0.core.devices.Device import DeviceLoad, DeviceFromDB, DeviceNotConnected
+from BAC0.sql.archive import Archive, _PYARROW
+from BAC0.sql.writer import HistoryWriter
+
+from datetime import datetime, timedelta
+from mock import Mock
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import fake_device
+from fake_device import analog, binary
+
+
+T0 = datetime(2017, 1, 1, 8, 0, 0)
+
+
+def make_device(storage='wide'):
+    return fake_device.make_device([analog('analogValue', 1, 'AV1', 1.0),
+                                    binary('binaryValue', 2, 'BV2', 'active')],
+                                   storage=storage)
+
+
+class SQLTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+
+class TestHistoryWriter(SQLTestCase):
+
+    def test_stop_with_late_reading(self):
+        """
+        SQL / The writer ends even if a reading is put after the stop sentinel
+        """
+        device = make_device('long')
+        point = device._findPoint('AV1', force_read=False)
+        writer = HistoryWriter(device, self.path('dev.db'), flush_interval=10)
+        # stop() racing with a poll : the reading lands after the sentinel
+        writer._stopped.set()
+        writer._queue.put(None)
+        writer._queue.put((point, T0, 21.5))
+        writer.start()
+        writer.join(2)
+        self.assertFalse(writer.is_alive())
+        db = sqlite3.connect(self.path('dev.db'))
+        self.assertEqual(db.execute('SELECT value FROM samples').fetchall(), [(21.5,)])
+        db.close()
+
+        # Readings put once stopped are dropped
+        writer.put(point, T0, 22.0)
+        self.assertTrue(writer._queue.empty())
+        writer.stop(timeout=1)
+
+    def test_readings_from_another_thread(self):
+        """
+        SQL / Readings put from another thread are each written once
+        """
+        device = make_device('long')
+        point = device._findPoint('AV1', force_read=False)
+        writer = HistoryWriter(device, self.path('dev.db'), flush_interval=0.01, flush_size=7)
+        writer.start()
+        readings = [(T0 + timedelta(seconds=i), float(i)) for i in range(200)]
+
+        def poll():
+            for timestamp, value in readings:
+                writer.put(point, timestamp, value)
+
+        thread = threading.Thread(target=poll)
+        thread.start()
+        thread.join()
+        writer.stop(timeout=2)
+        self.assertFalse(writer.is_alive())
+
+        db = sqlite3.connect(self.path('dev.db'))
+        rows = db.execute('SELECT ts, value FROM samples ORDER BY ts').fetchall()
+        last, = db.execute("SELECT value FROM save_state WHERE key = 'last_saved'").fetchone()
+        db.close()
+        self.assertEqual(len(rows), len(readings))
+        # Same meaning as for save() : time of the newest reading saved
+        self.assertEqual(datetime.fromisoformat(last), readings[-1][0])
+        self.assertEqual([value for _, value in rows], [value for _, value in readings])
+
+    def test_poll_does_not_wait_for_writer(self):
+        """
+        SQL / auto_save doesn't save from the poll when a background writer runs
+        """
+        from BAC0.tasks.Poll import DevicePoll
+        device = make_device('long')
+        device.properties.auto_save = 1
+        device.properties.clear_history_on_save = False
+        device.read_poll_plan = Mock()
+        device.save = Mock()
+        device._history_writer = Mock()
+        device._history_writer.is_alive.return_value = True
+        poll = DevicePoll(device, delay=10)
+        poll.task()
+        self.assertFalse(device.save.called)
+        device._history_writer.is_alive.return_value = False
+        poll.task()
+        self.assertTrue(device.save.called)
+
+
+class TestLongStorage(SQLTestCase):
+
+    def test_save_and_load(self):
+        """
+        SQL / Raw readings saved in the long layout are loaded back as saved
+        """
+        device = make_device('long')
+        av1 = device._findPoint('AV1', force_read=False)
+        av1._trend(2.5)
+        av1._trend(None)
+        device._findPoint('BV2', force_read=False)._trend('inactive')
+        device.save(self.path('dev'))
+
+        loaded = DeviceLoad(self.path('dev.db'))
+        self.assertEqual([point.properties.name for point in loaded.points], ['AV1', 'BV2'])
+        his = loaded._findPoint('AV1', force_read=False).history
+        self.assertEqual(list(his.index), list(av1.history.index))
+        self.assertEqual(list(his.fillna(-1)), [1.0, 2.5, -1])
+        self.assertEqual(list(loaded._findPoint('BV2', force_read=False).history), [1, 0])
+
+    def test_incremental_saves(self):
+        """
+        SQL / Each save only adds the readings taken since the last save
+        """
+        device = make_device('long')
+        av1 = device._findPoint('AV1', force_read=False)
+
+        def saved():
+            device.save(self.path('dev'))
+            db = sqlite3.connect(self.path('dev.db'))
+            count, = db.execute('SELECT COUNT(*) FROM samples').fetchone()
+            last, = db.execute("SELECT value FROM save_state WHERE key = 'last_saved'").fetchone()
+            db.close()
+            return count, datetime.fromisoformat(last)
+
+        # last_saved is the time of the newest reading saved
+        newest = max(point.history.index[-1] for point in device.points)
+        count, last = saved()
+        self.assertEqual(count, 2)
+        self.assertEqual(last, newest)
+        count, second = saved()
+        self.assertEqual(count, 2)
+        self.assertEqual(second, last)
+
+        av1._trend(2.5)
+        count, third = saved()
+        self.assertEqual(count, 3)
+        self.assertEqual(third, av1.history.index[-1])
+        loaded = DeviceLoad(self.path('dev.db'))
+        self.assertEqual(list(loaded._findPoint('AV1', force_read=False).history), [1.0, 2.5])
+
+
+class TestHistoryBounds(SQLTestCase):
+    """
+    Readings are selected after start (excluded) and up to end (included)
+    """
+
+    def saved(self, storage):
+        device = make_device(storage)
+        timestamps = [T0 + timedelta(seconds=i) for i in range(6)]
+        for point in device.points:
+            point.clear_history()
+        av1 = device._findPoint('AV1', force_read=False)
+        for i, timestamp in enumerate(timestamps):
+            av1._history.append(timestamp, float(i))
+        device.save(self.path(storage))
+        return device
+
+    def test_history_between(self):
+        """
+        SQL / history_between excludes start and includes end
+        """
+        point = self.saved('long')._findPoint('AV1', force_read=False)
+        his = point.history_between(T0 + timedelta(seconds=1), T0 + timedelta(seconds=3))
+        self.assertEqual(list(his), [2.0, 3.0])
+        self.assertEqual(list(point.history_between(end=T0)), [0.0])
+        self.assertEqual(list(point.history_between(start=T0 + timedelta(seconds=5))), [])
+
+    def check_bounds(self, storage):
+        device = self.saved(storage)
+        db = sqlite3.connect(self.path(storage + '.db'))
+        his = device.his_from_sql(db, 'AV1', start=T0 + timedelta(seconds=1),
+                                  end=T0 + timedelta(seconds=3))
+        self.assertEqual(list(his), [2.0, 3.0])
+        self.assertEqual(list(his.index), [T0 + timedelta(seconds=2),
+                                           T0 + timedelta(seconds=3)])
+        self.assertEqual(list(device.his_from_sql(db, 'AV1', end=T0)), [0.0])
+        self.assertEqual(list(device.his_from_sql(
+            db, 'AV1', start=T0 + timedelta(seconds=5))), [])
+        db.close()
+
+        # Offline points read the same range from the database
+        loaded = DeviceLoad(self.path(storage + '.db'))
+        his = loaded._findPoint('AV1', force_read=False).history_between(
+            T0 + timedelta(seconds=1), T0 + timedelta(seconds=3))
+        self.assertEqual(list(his), [2.0, 3.0])
+
+    def test_wide_bounds(self):
+        """
+        SQL / Range reads of the wide layout exclude start and include end
+        """
+        self.check_bounds('wide')
+
+    def test_long_bounds(self):
+        """
+        SQL / Range reads of the long layout exclude start and include end
+        """
+        self.check_bounds('long')
+
+    def test_compressed_bounds(self):
+        """
+        SQL / Range reads of the compressed layout exclude start and include end
+        """
+        self.check_bounds('compressed')
+
+
+class TestDeviceFromDB(SQLTestCase):
+
+    def check_loaded(self, storage):
+        device = make_device(storage)
+        timestamps = [T0 + timedelta(seconds=i) for i in range(4)]
+        for point in device.points:
+            point.clear_history()
+        for name, values in (('AV1', [20.0, 21.0, 22.5, None]),
+                             ('BV2', ['active', 'active', 'inactive', 'inactive'])):
+            point = device._findPoint(name, force_read=False)
+            for timestamp, value in zip(timestamps, values):
+                point._history.append(timestamp, value)
+        device.save(self.path(storage))
+
+        loaded = DeviceLoad(self.path(storage + '.db'))
+        self.assertIsInstance(loaded, DeviceFromDB)
+        self.assertEqual(loaded.properties.name, 'dev')
+        self.assertEqual(list(loaded.points_name), ['AV1', 'BV2'])
+        # Last valid value
+        self.assertEqual(loaded._findPoint('AV1', force_read=False).lastValue, 22.5)
+        self.assertEqual(loaded._findPoint('BV2', force_read=False).lastValue, 0)
+
+    def test_wide(self):
+        """
+        SQL / A device is loaded from a database saved in the wide layout
+        """
+        self.check_loaded('wide')
+
+    def test_long(self):
+        """
+        SQL / A device is loaded from a database saved in the long layout
+        """
+        self.check_loaded('long')
+
+    def test_compressed(self):
+        """
+        SQL / A device is loaded from a database saved in the compressed layout
+        """
+        self.check_loaded('compressed')
+
+    def test_bacnet_actions_raise(self):
+        """
+        SQL / A device loaded from a database raises DeviceNotConnected for BACnet actions
+        """
+        make_device('long').save(self.path('dev'))
+        loaded = DeviceLoad(self.path('dev.db'))
+        for action in (lambda: loaded.poll(delay=5),
+                       lambda: loaded.write_many({'AV1': 1}),
+                       lambda: 'AV1' in loaded,
+                       lambda: list(loaded.simulated_points)):
+            with self.assertRaises(DeviceNotConnected):
+                action()
+
+    def test_layout_is_looked_up_once(self):
+        """
+        SQL / The layout of a loaded database is looked up once per connection
+        """
+        self.check_loaded('long')
+        loaded = DeviceLoad(self.path('long.db'))
+        queries = []
+        loaded.db.set_trace_callback(queries.append)
+        av1 = loaded._findPoint('AV1', force_read=False)
+        av1.history
+        av1.lastValue
+        self.assertFalse([query for query in queries if 'sqlite_master' in query])
+        self.assertEqual(loaded._db_storage(sqlite3.connect(':memory:')), 'wide')
+
+
+class TestCompressedStorage(SQLTestCase):
+
+    def saved(self, storage):
+        device = make_device(storage)
+        av1 = device._findPoint('AV1', force_read=False)
+        bv2 = device._findPoint('BV2', force_read=False)
+        for save in range(100):
+            for i in range(10):
+                av1._trend(20 + (save * 10 + i) % 7 / 4)
+                bv2._trend('active' if i % 5 else 'inactive')
+            device.save(self.path(storage))
+        return device
+
+    def test_frequent_saves_fill_blocks(self):
+        """
+        SQL / Frequent saves complete the last block instead of adding small ones
+        """
+        device = self.saved('compressed')
+        db = sqlite3.connect(self.path('compressed.db'))
+        self.assertEqual(db.execute('SELECT COUNT(*), SUM(count) FROM blocks').fetchone(),
+                         (2, 2002))
+        self.assertEqual(len(device.his_from_sql(db, 'AV1')), 1001)
+        db.close()
+        self.saved('long')
+        self.assertLess(os.path.getsize(self.path('compressed.db')),
+                        os.path.getsize(self.path('long.db')) / 2)
+
+
+@unittest.skipUnless(_PYARROW, 'pyarrow is not installed')
+class TestArchive(SQLTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.device = make_device('long')
+        for point in self.device.points:
+            point.clear_history()
+        # Readings every 6 hours from T0, over three days
+        timestamps = [T0 + timedelta(hours=6 * i) for i in range(8)]
+        av1 = self.device._findPoint('AV1', force_read=False)
+        bv2 = self.device._findPoint('BV2', force_read=False)
+        for i, timestamp in enumerate(timestamps):
+            av1._history.append(timestamp, 20.0 + i)
+            bv2._history.append(timestamp, 'active' if i % 2 else 'inactive')
+
+    def test_export_twice(self):
+        """
+        Archive / Exporting again only adds the new readings
+        """
+        files = self.device.to_parquet(self.path('archive'))
+        self.assertEqual(len(files), 3)
+        self.assertEqual(self.device.to_parquet(self.path('archive')), [])
+        self.assertEqual(len(Archive(self.path('archive'), 'dev')['AV1']), 8)
+
+        self.device._findPoint('AV1', force_read=False)._trend(30.0)
+        self.assertEqual(len(self.device.to_parquet(self.path('archive'))), 1)
+        his = Archive(self.path('archive'), 'dev')['AV1']
+        self.assertEqual(len(his), 9)
+        self.assertEqual(his.iloc[-1], 30.0)
+        self.assertTrue(his.index.is_unique)
+
+    def test_read_back(self):
+        """
+        Archive / Points and histories are read back from the archive
+        """
+        self.device.to_parquet(self.path('archive'))
+        archive = Archive(self.path('archive'), 'dev')
+        self.assertEqual(archive.points_name, ['AV1', 'BV2'])
+        self.assertIn('BV2', archive)
+        self.assertEqual(archive.points_properties.loc['AV1', 'type'], 'analogValue')
+        with self.assertRaises(ValueError):
+            archive.history('AV3')
+
+        # start is excluded, end is included
+        his = archive.history('AV1', start=T0, end=T0 + timedelta(hours=24))
+        self.assertEqual(list(his), [21.0, 22.0, 23.0, 24.0])
+        self.assertEqual(his.index[-1], T0 + timedelta(hours=24))
+
+        df = archive.df(['AV1', 'BV2'], start=T0 + timedelta(hours=30))
+        self.assertEqual(list(df.columns), ['AV1', 'BV2'])
+        self.assertEqual(list(df['AV1']), [26.0, 27.0])
+        self.assertEqual(list(df['BV2']), [0.0, 1.0])